@@ -48,4 +48,14 @@ limit_request_line = 4094
 
 # Limit the allowed size of request headers
 limit_request_fields = 100
-limit_request_field_size = 8190
\ No newline at end of file
+limit_request_field_size = 8190
+
+# Load the hottest projects' indexes before a new or recycled worker takes requests
+def post_worker_init(worker):
+    from django.conf import settings
+    if settings.PREWARM_ON_START:
+        from vector_search.warmup import prewarm
+        try:
+            prewarm()
+        except Exception as e:
+            worker.log.warning(f"Prewarm failed: {e}")
@@ -0,0 +1,151 @@
+import math
+import time
+import atexit
+import logging
+import threading
+from collections import Counter
+from django.conf import settings
+from .ingest_lock import get_redis
+
+logger = logging.getLogger('vector_search')
+
+# Per-project query counts, last access times and a hotness score, kept in
+# Redis. Queries are counted in process memory and written in one pipeline at
+# most every ACCESS_STATS_FLUSH_SECONDS, so serving a query never waits on a
+# write.
+HOTNESS_KEY = 'stats:project_hotness_log2'
+QUERIES_KEY = 'stats:project_queries'
+LAST_ACCESS_KEY = 'stats:project_last_access'
+
+# Hotness is an exponentially decayed query count. Each query adds
+# 2 ** ((t - epoch) / half_life), so newer queries weigh more and scores can
+# be compared without ever decaying the stored values. The weights outgrow
+# float range within years (days with a short half-life), so scores are kept
+# as their base-2 logarithm and added in log space.
+HOTNESS_EPOCH = 1704067200  # 2024-01-01
+
+# Add log2 weights to members' log2 scores: ARGV holds member, weight pairs
+_LOG_ADD_SCRIPT = """
+for i = 1, #ARGV, 2 do
+    local score = tonumber(ARGV[i + 1])
+    local current = redis.call('ZSCORE', KEYS[1], ARGV[i])
+    if current then
+        current = tonumber(current)
+        local high, low = math.max(current, score), math.min(current, score)
+        score = high + math.log(1 + 2 ^ (low - high)) / math.log(2)
+    end
+    redis.call('ZADD', KEYS[1], score, ARGV[i])
+end
+"""
+
+_pending = Counter()
+# log2 of each project's unflushed weight
+_pending_weight = {}
+_last_access = {}
+_last_flush = time.monotonic()
+_lock = threading.Lock()
+
+
+def _log_weight(at):
+    return (at - HOTNESS_EPOCH) / settings.ACCESS_HOTNESS_HALF_LIFE
+
+
+def _log_add(a, b):
+    """log2(2 ** a + 2 ** b), for values whose powers would overflow."""
+    high, low = max(a, b), min(a, b)
+    if low == -math.inf:
+        return high
+    return high + math.log2(1 + 2 ** (low - high))
+
+
+def record_access(project_id):
+    """Count a query against the project; flushes to Redis when the batch is due.
+
+    Never raises: the query being counted must not fail because of its stats.
+    """
+    try:
+        now = time.time()
+        weight = _log_weight(now)
+        with _lock:
+            _pending[project_id] += 1
+            _pending_weight[project_id] = _log_add(_pending_weight.get(project_id, -math.inf), weight)
+            _last_access[project_id] = now
+            due = time.monotonic() - _last_flush >= settings.ACCESS_STATS_FLUSH_SECONDS
+        if due:
+            flush()
+    except Exception as e:
+        logger.warning(f"Could not record access to project {project_id}: {str(e)}")
+
+
+def flush():
+    global _last_flush
+    with _lock:
+        pending, weights, last_access = dict(_pending), dict(_pending_weight), dict(_last_access)
+        _pending.clear()
+        _pending_weight.clear()
+        _last_access.clear()
+        _last_flush = time.monotonic()
+    if not pending:
+        return
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        for project_id, count in pending.items():
+            pipe.hincrby(QUERIES_KEY, project_id, count)
+        pipe.eval(_LOG_ADD_SCRIPT, 1, HOTNESS_KEY, *(value for item in weights.items() for value in item))
+        pipe.hset(LAST_ACCESS_KEY, mapping={k: f'{v:.0f}' for k, v in last_access.items()})
+        pipe.execute()
+    except Exception as e:
+        # Stats are best effort; a lost batch only makes rankings slightly stale
+        logger.warning(f"Could not flush access stats for {len(pending)} projects: {str(e)}")
+
+
+atexit.register(flush)
+
+
+def hottest(limit):
+    """Project ids by descending hotness."""
+    return get_redis().zrevrange(HOTNESS_KEY, 0, limit - 1)
+
+
+def hotness(project_ids):
+    """{project_id: log2 score} including this process's unflushed queries.
+
+    -inf for unknown projects, and for all of them (but this process's queries) if Redis is down.
+    """
+    project_ids = list(project_ids)
+    scores = dict.fromkeys(project_ids, -math.inf)
+    if not project_ids:
+        return scores
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        for project_id in project_ids:
+            pipe.zscore(HOTNESS_KEY, project_id)
+        for project_id, score in zip(project_ids, pipe.execute()):
+            if score is not None:
+                scores[project_id] = score
+    except Exception as e:
+        logger.warning(f"Could not read project hotness: {str(e)}")
+    with _lock:
+        for project_id in project_ids:
+            scores[project_id] = _log_add(scores[project_id], _pending_weight.get(project_id, -math.inf))
+    return scores
+
+
+def project_stats(project_id):
+    client = get_redis()
+    last_access = client.hget(LAST_ACCESS_KEY, project_id)
+    return {
+        'queries': int(client.hget(QUERIES_KEY, project_id) or 0),
+        'last_access': float(last_access) if last_access else None,
+    }
+
+
+def forget(project_id):
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.zrem(HOTNESS_KEY, project_id)
+        pipe.hdel(QUERIES_KEY, project_id)
+        pipe.hdel(LAST_ACCESS_KEY, project_id)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Could not remove access stats for project {project_id}: {str(e)}")
@@ -1,15 +1,27 @@
 from django.contrib import admin
-from .models import Document, VectorDatabase
+from .models import Document, VectorDatabase, UploadSession, ProjectAPIToken
 
 class DocumentAdmin(admin.ModelAdmin):
-    list_display = ('document_id', 'user', 'file', 'uploaded_at', 'processed')
+    list_display = ('document_id', 'user', 'file', 'file_size', 'uploaded_at', 'processed')
     list_filter = ('processed', 'uploaded_at')
     search_fields = ('document_id', 'user__username', 'file')
 
 class VectorDatabaseAdmin(admin.ModelAdmin):
-    list_display = ('project_id', 'user', 'name', 'created_at', 'updated_at')
+    list_display = ('project_id', 'user', 'name', 'num_documents', 'num_chunks', 'total_bytes', 'created_at', 'updated_at')
     list_filter = ('created_at', 'updated_at')
     search_fields = ('project_id', 'user__username', 'name')
 
+class UploadSessionAdmin(admin.ModelAdmin):
+    list_display = ('upload_id', 'user', 'filename', 'received_bytes', 'total_size', 'status', 'updated_at')
+    list_filter = ('status', 'created_at')
+    search_fields = ('upload_id', 'user__username', 'filename')
+
+class ProjectAPITokenAdmin(admin.ModelAdmin):
+    list_display = ('token_id', 'user', 'vector_database', 'name', 'prefix', 'created_at', 'last_used_at')
+    search_fields = ('token_id', 'user__username', 'name', 'prefix')
+    readonly_fields = ('prefix', 'key_hash')
+
 admin.site.register(Document, DocumentAdmin)
-admin.site.register(VectorDatabase, VectorDatabaseAdmin)
\ No newline at end of file
+admin.site.register(VectorDatabase, VectorDatabaseAdmin)
+admin.site.register(UploadSession, UploadSessionAdmin)
+admin.site.register(ProjectAPIToken, ProjectAPITokenAdmin)
@@ -0,0 +1,227 @@
+import time
+import uuid
+import logging
+from django.conf import settings
+from rest_framework import exceptions
+from .authentication import cached_group_names
+from .ingest_lock import get_redis
+
+logger = logging.getLogger('vector_search')
+
+# Concurrency limits for CPU-heavy endpoints, shared by every web worker
+# through Redis. Each scope ('query', 'ingest', 'preview') has a global limit
+# and a per-user limit taken from the user's plan. A request that finds no
+# free slot waits in a bounded queue for up to ADMISSION_QUEUE_TIMEOUT seconds;
+# once the queue is full, or the wait runs out, it is answered at once with 429
+# and Retry-After instead of tying up a worker until Gunicorn kills it.
+#
+# Slots and queue places are sorted-set members scored by their expiry, so
+# the ones held by a killed worker lapse: slots after ADMISSION_SLOT_TTL
+# seconds, queue places once the request would have timed out anyway.
+ACTIVE_KEY = 'admission:{scope}:active'
+QUEUED_KEY = 'admission:{scope}:queued'
+SHED_KEY = 'admission:shed'
+
+POLL_SECONDS = 0.05
+MAX_POLL_SECONDS = 0.5
+
+# Take a slot if the scope and the user both have one free, without
+# overtaking anyone: a request only gets the user's free slots once the same
+# user's earlier waiters have theirs, and a global slot once the waiters ahead
+# of it in the scope's queue have theirs. Only requests held back by the
+# global limit wait in the scope's queue; one held back by its own user's
+# limit waits in the user's queue alone, so it neither delays other users nor
+# takes one of their queue places. Queue places are scored by the request's
+# arrival (its expiry, fixed when it first queued), which keeps both queues in
+# arrival order. Returns 1 (admitted), 0 (queued) or -1 (queue full).
+_ACQUIRE_SCRIPT = """
+for i = 1, 4 do
+    redis.call('ZREMRANGEBYSCORE', KEYS[i], '-inf', ARGV[2])
+end
+local token = ARGV[1]
+local arrival = redis.call('ZSCORE', KEYS[4], token)
+local user_ahead = arrival and redis.call('ZRANK', KEYS[4], token) or redis.call('ZCARD', KEYS[4])
+local user_free = redis.call('ZCARD', KEYS[2]) + user_ahead < tonumber(ARGV[5])
+local global_ahead = redis.call('ZRANK', KEYS[3], token) or redis.call('ZCARD', KEYS[3])
+if user_free and redis.call('ZCARD', KEYS[1]) + global_ahead < tonumber(ARGV[4]) then
+    redis.call('ZADD', KEYS[1], ARGV[3], token)
+    redis.call('ZADD', KEYS[2], ARGV[3], token)
+    redis.call('ZREM', KEYS[3], token)
+    redis.call('ZREM', KEYS[4], token)
+    for i = 1, 4 do
+        redis.call('EXPIRE', KEYS[i], ARGV[8])
+    end
+    return 1
+end
+if not arrival then
+    if redis.call('ZCARD', KEYS[4]) >= tonumber(ARGV[7])
+            or (user_free and redis.call('ZCARD', KEYS[3]) >= tonumber(ARGV[6])) then
+        return -1
+    end
+    arrival = ARGV[9]
+    redis.call('ZADD', KEYS[4], arrival, token)
+end
+if not user_free then
+    redis.call('ZREM', KEYS[3], token)
+elseif not redis.call('ZSCORE', KEYS[3], token) and redis.call('ZCARD', KEYS[3]) < tonumber(ARGV[6]) then
+    redis.call('ZADD', KEYS[3], arrival, token)
+end
+redis.call('EXPIRE', KEYS[3], ARGV[8])
+redis.call('EXPIRE', KEYS[4], ARGV[8])
+return 0
+"""
+
+
+class Overloaded(exceptions.Throttled):
+    default_detail = 'The server is busy. Please retry shortly.'
+    default_code = 'overloaded'
+
+
+def plan_for(user):
+    """The user's plan: the name of a group of theirs listed in ADMISSION_PLANS, else 'default'.
+
+    With several, the one allowing the most concurrent queries wins.
+    """
+    plans = settings.ADMISSION_PLANS
+    names = [name for name in cached_group_names(user) if name in plans] if user.is_authenticated else []
+    if not names:
+        return 'default'
+    return max(names, key=lambda name: plans[name].get('query', {}).get('concurrent', 0))
+
+
+def limits_for(scope, plan):
+    """(global concurrent, global queued, user concurrent, user queued) for the scope."""
+    scope_limits = settings.ADMISSION_GLOBAL_LIMITS[scope]
+    user_limits = settings.ADMISSION_PLANS.get(plan, settings.ADMISSION_PLANS['default'])[scope]
+    return scope_limits['concurrent'], scope_limits['queued'], user_limits['concurrent'], user_limits['queued']
+
+
+def _keys(scope, user_key):
+    active, queued = ACTIVE_KEY.format(scope=scope), QUEUED_KEY.format(scope=scope)
+    return [active, f'{active}:{user_key}', queued, f'{queued}:{user_key}']
+
+
+def _record_shed(scope, plan, reason):
+    try:
+        get_redis().hincrby(SHED_KEY, f'{scope}:{plan}:{reason}', 1)
+    except Exception as e:
+        logger.warning(f"Could not count shed request: {str(e)}")
+
+
+class Slot:
+    def __init__(self, scope, user_key, token):
+        self.scope = scope
+        self.user_key = user_key
+        self.token = token
+
+    def release(self):
+        active, user_active, _, _ = _keys(self.scope, self.user_key)
+        try:
+            pipe = get_redis().pipeline(transaction=False)
+            pipe.zrem(active, self.token)
+            pipe.zrem(user_active, self.token)
+            pipe.execute()
+        except Exception as e:
+            # The slot lapses after ADMISSION_SLOT_TTL
+            logger.warning(f"Could not release {self.scope} slot: {str(e)}")
+
+
+def try_acquire(scope, user_key, plan, token, queue_expiry):
+    """One admission attempt for the request `token`: 1 (admitted), 0 (queued) or -1 (queue full).
+
+    queue_expiry is when the request's queue place lapses if its worker dies;
+    it also orders the queues, so pass the same value on every attempt.
+    """
+    global_limit, global_queue, user_limit, user_queue = limits_for(scope, plan)
+    now = time.time()
+    return get_redis().eval(_ACQUIRE_SCRIPT, 4, *_keys(scope, user_key), token, now, now + settings.ADMISSION_SLOT_TTL,
+                            global_limit, user_limit, global_queue, user_queue, settings.ADMISSION_SLOT_TTL, queue_expiry)
+
+
+def acquire(scope, user_key, plan):
+    """Wait for a slot in the scope; returns a Slot to release, or None if Redis is unreachable.
+
+    Raises Overloaded when the queue is full or the wait times out.
+    """
+    keys = _keys(scope, user_key)
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + settings.ADMISSION_QUEUE_TIMEOUT
+    # A live waiter leaves the queue by its deadline; one whose worker died lapses soon after
+    queue_expiry = time.time() + settings.ADMISSION_QUEUE_TIMEOUT + 2 * MAX_POLL_SECONDS
+    pause = POLL_SECONDS
+    while True:
+        try:
+            admitted = try_acquire(scope, user_key, plan, token, queue_expiry)
+        except Exception as e:
+            # Failing open: an unlimited request beats no service while Redis is down
+            logger.warning(f"Admission control unavailable, admitting {scope} request: {str(e)}")
+            return None
+        if admitted == 1:
+            return Slot(scope, user_key, token)
+        if admitted == -1:
+            _record_shed(scope, plan, 'queue_full')
+            logger.warning(f"Shed {scope} request from {user_key} ({plan}): queue full")
+            raise Overloaded(wait=settings.ADMISSION_RETRY_AFTER)
+        if time.monotonic() >= deadline:
+            try:
+                pipe = get_redis().pipeline(transaction=False)
+                pipe.zrem(keys[2], token)
+                pipe.zrem(keys[3], token)
+                pipe.execute()
+            except Exception as e:
+                logger.warning(f"Could not leave {scope} queue: {str(e)}")
+            _record_shed(scope, plan, 'timeout')
+            logger.warning(f"Shed {scope} request from {user_key} ({plan}): waited {settings.ADMISSION_QUEUE_TIMEOUT}s")
+            raise Overloaded(wait=settings.ADMISSION_RETRY_AFTER)
+        time.sleep(min(pause, max(deadline - time.monotonic(), 0)))
+        pause = min(pause * 2, MAX_POLL_SECONDS)
+
+
+def shed_counts():
+    """{(scope, plan, reason): count} since the counters were last reset (admission_stats --reset)."""
+    counts = {}
+    for field, count in get_redis().hgetall(SHED_KEY).items():
+        scope, plan, reason = field.split(':', 2)
+        counts[(scope, plan, reason)] = int(count)
+    return counts
+
+
+def current_load(scope):
+    """(active, queued) requests in the scope across all workers."""
+    now = time.time()
+    pipe = get_redis().pipeline(transaction=False)
+    pipe.zcount(ACTIVE_KEY.format(scope=scope), now, '+inf')
+    pipe.zcount(QUEUED_KEY.format(scope=scope), now, '+inf')
+    active, queued = pipe.execute()
+    return active, queued
+
+
+class AdmissionControlMixin:
+    """Admit at most the configured number of concurrent requests per user and overall for `admission_scope`.
+
+    The slot is taken after authentication, so the limits are the user's
+    own, and held until the response has been built.
+    """
+    admission_scope = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self._admission_slot = None
+        if not settings.ADMISSION_CONTROL or self.admission_scope is None:
+            return
+        user_key = f'user:{request.user.pk}' if request.user.is_authenticated else f"ip:{request.META.get('REMOTE_ADDR')}"
+        started = time.perf_counter()
+        try:
+            self._admission_slot = acquire(self.admission_scope, user_key, plan_for(request.user))
+        finally:
+            # Read by RequestTimingMiddleware
+            request._request.admission_seconds = time.perf_counter() - started
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            slot = getattr(self, '_admission_slot', None)
+            if slot is not None:
+                slot.release()
+                self._admission_slot = None
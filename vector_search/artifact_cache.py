@@ -0,0 +1,164 @@
+import os
+import json
+import uuid
+import fcntl
+import hashlib
+import logging
+import threading
+from django.conf import settings
+
+logger = logging.getLogger('vector_search')
+
+# Node-local copies of index artifacts published to the index storage.
+# Files are stored under their SHA-256, so an entry never changes once
+# written and identical files are kept once. Manifests, which carry those
+# checksums, are keyed by their storage name (version directories are
+# immutable, so a name always means the same content).
+MANIFESTS_DIRNAME = 'manifests'
+READ_SIZE = 1024 * 1024
+
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+class ChecksumMismatch(OSError):
+    pass
+
+
+def cache_dir():
+    return settings.INDEX_CACHE_DIR
+
+
+def _entry_path(sha256):
+    return os.path.join(cache_dir(), sha256[:2], sha256)
+
+
+def _manifest_path(name):
+    return os.path.join(cache_dir(), MANIFESTS_DIRNAME, hashlib.sha256(name.encode('utf-8')).hexdigest() + '.json')
+
+
+class _single_flight:
+    """One download per entry: a thread lock within the process, flock across processes on the node."""
+
+    def __init__(self, path):
+        self.path = path
+        with _locks_lock:
+            self.thread_lock = _locks.setdefault(path, threading.Lock())
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.lock_file = open(f'{self.path}.lock', 'w')
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+        except BaseException:
+            self.thread_lock.release()
+            raise
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+            self.lock_file.close()
+        finally:
+            self.thread_lock.release()
+
+
+def _touch(path):
+    # Eviction goes by mtime; atime is often disabled
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def _download(storage, name, path, sha256=None, size=None):
+    tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    hasher = hashlib.sha256()
+    written = 0
+    try:
+        with storage.open(name, 'rb') as source, open(tmp_path, 'wb') as target:
+            for chunk in iter(lambda: source.read(READ_SIZE), b''):
+                hasher.update(chunk)
+                target.write(chunk)
+                written += len(chunk)
+            target.flush()
+            os.fsync(target.fileno())
+        if (sha256 and hasher.hexdigest() != sha256) or (size is not None and written != size):
+            raise ChecksumMismatch(f'{name}: expected {sha256} ({size} bytes), got {hasher.hexdigest()} ({written} bytes)')
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    logger.info(f"Cached {name} ({written} bytes)")
+    return written
+
+
+def fetch(storage, name, sha256, size=None):
+    """Local path of the artifact `name`, downloading and verifying it on a miss.
+
+    Concurrent callers for the same artifact wait for a single download.
+    """
+    path = _entry_path(sha256)
+    if os.path.isfile(path):
+        _touch(path)
+        return path
+    with _single_flight(path):
+        if not os.path.isfile(path):
+            _download(storage, name, path, sha256, size)
+            evict(keep=path)
+    return path
+
+
+def fetch_manifest(storage, name):
+    path = _manifest_path(name)
+    if not os.path.isfile(path):
+        with _single_flight(path):
+            if not os.path.isfile(path):
+                _download(storage, name, path)
+    with open(path) as f:
+        return json.load(f)
+
+
+def evict(keep=None, max_bytes=None):
+    """Remove least recently used artifacts until the cache fits in INDEX_CACHE_MAX_BYTES.
+
+    Removing a file another process has open or mapped is safe: it keeps its
+    copy until it closes it.
+    """
+    max_bytes = max_bytes if max_bytes is not None else settings.INDEX_CACHE_MAX_BYTES
+    entries = []
+    root = cache_dir()
+    if not os.path.isdir(root):
+        return []
+    for prefix in os.listdir(root):
+        folder = os.path.join(root, prefix)
+        if prefix == MANIFESTS_DIRNAME or not os.path.isdir(folder):
+            continue
+        for name in os.listdir(folder):
+            path = os.path.join(folder, name)
+            if name.endswith(('.lock', '.tmp')):
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    removed = []
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed.append(path)
+    if removed:
+        logger.info(f"Evicted {len(removed)} cached index artifacts, {total} bytes remain")
+    return removed
@@ -0,0 +1,244 @@
+import hmac
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from django.conf import settings
+from django.contrib.auth.models import Group, User
+from django.db.models.signals import m2m_changed, post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication, BasicAuthentication, get_authorization_header
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+from . import progress
+from .models import ProjectAPIToken
+
+
+class _ExpiringCache:
+    """Small process-local LRU whose entries expire after AUTH_CACHE_TTL seconds."""
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + settings.AUTH_CACHE_TTL, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > settings.AUTH_CACHE_MAX_ENTRIES:
+                self._entries.popitem(last=False)
+
+    def discard(self, match):
+        with self._lock:
+            for key in [k for k, (_, value) in self._entries.items() if match(k, value)]:
+                del self._entries[key]
+
+
+# Users by id, verified Basic credentials and API tokens. Saves and deletes in
+# this process drop the affected entries at once; other processes see the
+# change within AUTH_CACHE_TTL.
+_users = _ExpiringCache()
+_credentials = _ExpiringCache()
+_api_tokens = _ExpiringCache()
+_group_names = _ExpiringCache()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def _forget_user(sender, instance, **kwargs):
+    _users.discard(lambda key, user: key == str(instance.pk))
+    _credentials.discard(lambda key, value: value[0] == instance.pk)
+    _api_tokens.discard(lambda key, value: value[1] == instance.pk)
+    _group_names.discard(lambda key, names: key == str(instance.pk))
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def _forget_user_groups(sender, instance, **kwargs):
+    if isinstance(instance, User):
+        _group_names.discard(lambda key, names: key == str(instance.pk))
+    else:
+        # Changed from the group's side; the affected users aren't passed along
+        _group_names.discard(lambda key, names: True)
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def _forget_group(sender, instance, **kwargs):
+    _group_names.discard(lambda key, names: True)
+
+
+@receiver(post_save, sender=ProjectAPIToken)
+@receiver(post_delete, sender=ProjectAPIToken)
+def _forget_api_token(sender, instance, **kwargs):
+    _api_tokens.discard(lambda key, value: key == instance.key_hash)
+
+
+def cached_user(user_id):
+    """The active-or-not User with this id, from the cache when possible; None if it doesn't exist."""
+    # Claims may carry the id as a string
+    user = _users.get(str(user_id))
+    if user is None:
+        user = User.objects.filter(pk=user_id).first()
+        if user is None:
+            return None
+        _users.set(str(user_id), user)
+    return user
+
+
+def cached_group_names(user):
+    """Names of the user's groups (which carry plans), from the cache when possible."""
+    names = _group_names.get(str(user.pk))
+    if names is None:
+        names = frozenset(user.groups.values_list('name', flat=True))
+        _group_names.set(str(user.pk), names)
+    return names
+
+
+def _record_auth_time(request, seconds):
+    # Read by RequestTimingMiddleware; several classes may run for one request
+    django_request = request._request
+    django_request.auth_seconds = getattr(django_request, 'auth_seconds', 0.0) + seconds
+
+
+class TimedAuthenticationMixin:
+    def authenticate(self, request):
+        started = time.perf_counter()
+        try:
+            return super().authenticate(request)
+        finally:
+            _record_auth_time(request, time.perf_counter() - started)
+
+
+class CachedJWTAuthentication(TimedAuthenticationMixin, JWTAuthentication):
+    """JWTAuthentication that resolves the user from the token's id claim through the user cache."""
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[jwt_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        user = cached_user(user_id)
+        if user is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        if getattr(jwt_settings, 'CHECK_REVOKE_TOKEN', False):
+            if validated_token.get(jwt_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+        return user
+
+
+class StreamTicketAuthentication(BaseAuthentication):
+    """?ticket= from POST task_progress/ticket/, for clients that can't set headers (the browser EventSource).
+
+    A ticket is good for one stream of the task it was issued for, so unlike
+    an access token in the query string it is worthless once logged.
+    request.auth is that task's id.
+    """
+
+    def authenticate(self, request):
+        ticket = request.query_params.get('ticket')
+        if not ticket:
+            return None
+        started = time.perf_counter()
+        try:
+            redeemed = progress.redeem_ticket(ticket)
+            if redeemed is None:
+                raise exceptions.AuthenticationFailed(_('Invalid or expired stream ticket.'))
+            user_id, task_id = redeemed
+            if request.query_params.get('task_id') != task_id:
+                raise exceptions.AuthenticationFailed(_('The stream ticket is for another task.'))
+            user = cached_user(user_id)
+            if user is None or not user.is_active:
+                raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+            return user, task_id
+        finally:
+            _record_auth_time(request, time.perf_counter() - started)
+
+
+class CachedBasicAuthentication(TimedAuthenticationMixin, BasicAuthentication):
+    """BasicAuthentication that runs the password hasher once per AUTH_CACHE_TTL per credential.
+
+    The cache key is an HMAC of the credentials, so plaintext passwords are
+    never kept. A hit is only honoured while the user's stored password hash
+    is the one it was verified against.
+    """
+
+    def authenticate_credentials(self, userid, password, request=None):
+        key = hmac.new(settings.SECRET_KEY.encode('utf-8'), f'{userid}\0{password}'.encode('utf-8'),
+                       hashlib.sha256).hexdigest()
+        verified = _credentials.get(key)
+        if verified is not None:
+            user_id, password_hash = verified
+            user = cached_user(user_id)
+            if user is not None and user.is_active and user.password == password_hash:
+                return user, None
+
+        user, auth = super().authenticate_credentials(userid, password, request)
+        _credentials.set(key, (user.pk, user.password))
+        return user, auth
+
+
+class ProjectTokenAuthentication(BaseAuthentication):
+    """API tokens for machine clients: "Authorization: Token qq_...".
+
+    Tokens are random, so a single SHA-256 is enough to store and look them
+    up. request.auth is the ProjectAPIToken; views that accept these tokens
+    add ProjectTokenScope to keep them to their own project.
+    """
+    keyword = 'Token'
+
+    def authenticate(self, request):
+        started = time.perf_counter()
+        try:
+            auth = get_authorization_header(request).split()
+            if not auth or auth[0].lower() != self.keyword.lower().encode():
+                return None
+            if len(auth) != 2:
+                raise exceptions.AuthenticationFailed(_('Invalid token header.'))
+            try:
+                key = auth[1].decode()
+            except UnicodeError:
+                raise exceptions.AuthenticationFailed(_('Invalid token header.'))
+            return self.authenticate_credentials(key)
+        finally:
+            _record_auth_time(request, time.perf_counter() - started)
+
+    def authenticate_credentials(self, key):
+        key_hash = ProjectAPIToken.hash_key(key)
+        token = _api_tokens.get(key_hash)
+        if token is None:
+            token = ProjectAPIToken.objects.filter(key_hash=key_hash).first()
+            if token is None:
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+            # Written on cache misses only, so at most once per AUTH_CACHE_TTL per process
+            ProjectAPIToken.objects.filter(pk=token.pk).update(last_used_at=timezone.now())
+            token = (token, token.user_id)
+            _api_tokens.set(key_hash, token)
+        token, user_id = token
+
+        user = cached_user(user_id)
+        if user is None or not user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+        return user, token
+
+    def authenticate_header(self, request):
+        return self.keyword
@@ -0,0 +1,404 @@
+import os
+import json
+import time
+import pickle
+import shutil
+import tarfile
+import hashlib
+import logging
+import numpy as np
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from . import index_store, shared_index
+from .index_tuner import candidates
+from .models import Document, VectorDatabase, user_directory_path
+from .vector_db_utils import fill_index, new_index
+
+logger = logging.getLogger('vector_search')
+
+# A project as one tar stream: bundle.json first, then the index data, then
+# optionally the source documents and their extracted text. bundle.json
+# carries the SHA-256 and size of every other member, so an import can check
+# each file as it streams past and never needs the whole bundle on disk.
+# Exports are generated member by member and can be sent over HTTP as they
+# are produced.
+#
+# A bundle is untrusted input, so it never carries a pickle or a serialized
+# faiss index: chunks travel as JSON and the index as its raw float32
+# vectors. An import validates both, pickles the chunks itself and rebuilds
+# the index from the vectors, which costs training time for IVF indexes but
+# never re-embeds.
+BUNDLE_FORMAT = 2
+BUNDLE_EXTENSION = '.qqbundle'
+BUNDLE_MANIFEST = 'bundle.json'
+MAX_MANIFEST_SIZE = 64 * 1024 * 1024
+READ_SIZE = 1024 * 1024
+BLOCK_SIZE = tarfile.BLOCKSIZE
+# Vectors are exported and indexed this many rows at a time
+VECTOR_ROWS = 65536
+
+# Project fields carried over; the index stats come from publishing the index
+PROJECT_FIELDS = ('name', 'description', 'approvedDomains', 'introPrompt', 'embedding_model',
+                  'chunk_unit', 'chunk_size', 'chunk_overlap', 'duplicate_chunks', 'index_factory', 'search_params')
+DOCUMENT_FIELDS = ('source_url', 'etag', 'last_modified', 'text_length', 'page_count')
+SEARCH_PARAMS = ('nprobe', 'efSearch')
+# Little-endian float32 rows, num_chunks x dimension, in chunk order
+VECTORS_MEMBER = 'index/vectors.f32'
+CHUNKS_MEMBER = 'index/chunks.json'
+INDEX_MEMBERS = (VECTORS_MEMBER, CHUNKS_MEMBER)
+# Entries of an imported index manifest that publishing the rebuilt index sets itself
+REBUILT_INDEX_KEYS = ('manifest_version', 'created_at', 'num_chunks', 'dimension', 'index_type', 'files',
+                      'version', 'build_key', 'shard', 'projects', 'start', 'count')
+
+
+class BundleError(Exception):
+    pass
+
+
+def _checksum(path):
+    return {'sha256': index_store.file_checksum(path), 'size': os.path.getsize(path)}
+
+
+def _project_index(vector_db):
+    """(index, chunks, version manifest) of the project's current version, the index read privately."""
+    if vector_db.shared_shard:
+        return shared_index.project_build(vector_db)
+    if not vector_db.index_file:
+        raise BundleError('The project has no index to export')
+    index_path, chunks_path = index_store.local_paths(vector_db)
+    # Not mapped: an IVF index needs a direct map built on it to give its vectors back
+    index, _ = index_store.read_faiss_index(index_path, mmap=False)
+    with open(chunks_path, 'rb') as f:
+        chunks = pickle.load(f)
+    try:
+        index_manifest = index_store.version_manifest(vector_db)
+    except FileNotFoundError:
+        # Legacy unversioned layout
+        index_manifest = {}
+    return index, chunks, index_manifest
+
+
+def _vector_batches(index):
+    """The index's vectors in id order as little-endian float32 bytes, VECTOR_ROWS rows at a time.
+
+    Exact for flat, IVF-Flat and HNSW indexes; compressed (PQ) indexes give
+    their decoded vectors.
+    """
+    import faiss
+
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.make_direct_map()
+    for start in range(0, index.ntotal, VECTOR_ROWS):
+        rows = index.reconstruct_n(start, min(VECTOR_ROWS, index.ntotal - start))
+        yield np.ascontiguousarray(rows, dtype='<f4').tobytes()
+
+
+def _index_members(vector_db):
+    """(index manifest, [(member, source)]) with the project's chunks as JSON and its index as raw vectors."""
+    index, chunks, index_manifest = _project_index(vector_db)
+    if len(chunks) != index.ntotal:
+        raise BundleError(f'The index has {index.ntotal} vectors for {len(chunks)} chunks')
+    chunks_data = json.dumps([{'page_content': chunk.page_content, 'metadata': chunk.metadata} for chunk in chunks],
+                             default=str).encode('utf-8')
+    # Hashed in a first pass, since bundle.json goes out before the vectors
+    hasher = hashlib.sha256()
+    for data in _vector_batches(index):
+        hasher.update(data)
+
+    index_manifest = dict(index_manifest, num_chunks=index.ntotal, dimension=index.d, files={
+        VECTORS_MEMBER: {'sha256': hasher.hexdigest(), 'size': index.ntotal * index.d * 4},
+        CHUNKS_MEMBER: {'sha256': hashlib.sha256(chunks_data).hexdigest(), 'size': len(chunks_data)},
+    })
+    return index_manifest, [(VECTORS_MEMBER, lambda: _vector_batches(index)), (CHUNKS_MEMBER, chunks_data)]
+
+
+def _text_artifacts(document):
+    base_path = document.text_artifact_path
+    if not base_path:
+        return []
+    return [(f'text/{document.content_hash}{suffix}', base_path + suffix)
+            for suffix in ('.txt', '.json') if os.path.isfile(base_path + suffix)]
+
+
+def bundle_manifest(vector_db, include_sources=True):
+    """(manifest, [(member name, source)]) for the project's current version.
+
+    A source is a local path, bytes, or a callable that yields the member's bytes.
+    """
+    index_manifest, members = _index_members(vector_db)
+    files = dict(index_manifest['files'])
+
+    documents = []
+    for position, document in enumerate(Document.objects.filter(vector_database=vector_db).order_by('uploaded_at')):
+        entry = {field: getattr(document, field) for field in DOCUMENT_FIELDS}
+        entry['name'] = os.path.basename(document.file.name)
+        entry['content_hash'] = document.content_hash
+        entry['member'] = None
+        if include_sources and document.file and os.path.isfile(document.file.path):
+            entry['member'] = f'documents/{position}/{entry["name"]}'
+            info = _checksum(document.file.path)
+            entry['content_hash'] = entry['content_hash'] or info['sha256']
+            files[entry['member']] = info
+            members.append((entry['member'], document.file.path))
+            for name, path in _text_artifacts(document):
+                if name not in files:
+                    files[name] = _checksum(path)
+                    members.append((name, path))
+        documents.append(entry)
+
+    manifest = {
+        'bundle_format': BUNDLE_FORMAT,
+        'exported_at': timezone.now().isoformat(),
+        'project': {field: getattr(vector_db, field) for field in PROJECT_FIELDS},
+        'index': {key: value for key, value in index_manifest.items() if key not in ('files', 'version', 'build_key')},
+        'documents': documents,
+        'files': files,
+    }
+    manifest['project']['embedding_model'] = vector_db.model_name
+    return manifest, members
+
+
+def _tar_header(name, size):
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mode = 0o644
+    info.mtime = int(time.time())
+    return info.tobuf(tarfile.PAX_FORMAT)
+
+
+def _padding(size):
+    return b'\0' * (-size % BLOCK_SIZE)
+
+
+def iter_bundle(manifest, members):
+    """Yield the bundle described by bundle_manifest() as a tar stream, one buffer at a time, without staging it on disk."""
+    data = json.dumps(manifest, indent=2, default=str).encode('utf-8')
+    yield _tar_header(BUNDLE_MANIFEST, len(data)) + data + _padding(len(data))
+
+    for name, source in members:
+        size = manifest['files'][name]['size']
+        yield _tar_header(name, size)
+        if isinstance(source, bytes):
+            yield source
+            yield _padding(size)
+            continue
+        sent = 0
+        if callable(source):
+            for chunk in source():
+                sent += len(chunk)
+                yield chunk
+        else:
+            with open(source, 'rb') as f:
+                for chunk in iter(lambda: f.read(min(READ_SIZE, size - sent)), b''):
+                    sent += len(chunk)
+                    yield chunk
+        if sent != size:
+            raise BundleError(f'{name} changed size during export')
+        yield _padding(size)
+    # End-of-archive marker
+    yield b'\0' * (2 * BLOCK_SIZE)
+    logger.info(f"Exported a bundle of {len(members)} files")
+
+
+def export_bundle(vector_db, fileobj, include_sources=True):
+    written = 0
+    for data in iter_bundle(*bundle_manifest(vector_db, include_sources)):
+        fileobj.write(data)
+        written += len(data)
+    return written
+
+
+def _copy_member(source, path, expected):
+    hasher = hashlib.sha256()
+    size = 0
+    with open(path, 'wb') as f:
+        for chunk in iter(lambda: source.read(READ_SIZE), b''):
+            hasher.update(chunk)
+            f.write(chunk)
+            size += len(chunk)
+    if hasher.hexdigest() != expected['sha256'] or size != expected['size']:
+        raise BundleError(f'Checksum mismatch for {os.path.basename(path)}')
+
+
+def _positive_int(value):
+    return isinstance(value, int) and not isinstance(value, bool) and value > 0
+
+
+def _read_manifest(tar):
+    try:
+        member = tar.next()
+    except tarfile.TarError as e:
+        raise BundleError(f'Not a project bundle: {e}')
+    if member is None or member.name != BUNDLE_MANIFEST or not member.isfile():
+        raise BundleError(f'Not a project bundle: {BUNDLE_MANIFEST} must come first')
+    if member.size > MAX_MANIFEST_SIZE:
+        raise BundleError(f'{BUNDLE_MANIFEST} is too large')
+    try:
+        manifest = json.load(tar.extractfile(member))
+    except ValueError:
+        raise BundleError(f'{BUNDLE_MANIFEST} is not valid JSON')
+    if not isinstance(manifest, dict) or manifest.get('bundle_format') != BUNDLE_FORMAT:
+        # Format 1 carried a pickled chunks file and a serialized faiss index, which are never read back
+        raise BundleError(f"Unsupported bundle format {manifest.get('bundle_format') if isinstance(manifest, dict) else None}")
+
+    files = manifest.get('files')
+    if not isinstance(files, dict) or not all(
+            isinstance(info, dict) and isinstance(info.get('sha256'), str) and _positive_int(info.get('size'))
+            for info in files.values()):
+        raise BundleError('The bundle manifest does not list its files')
+    index = manifest.get('index')
+    if (not isinstance(index, dict) or not _positive_int(index.get('num_chunks'))
+            or not _positive_int(index.get('dimension')) or not set(INDEX_MEMBERS) <= set(files)):
+        raise BundleError('The bundle manifest does not describe an index')
+    if files[VECTORS_MEMBER]['size'] != index['num_chunks'] * index['dimension'] * 4:
+        raise BundleError(f'{VECTORS_MEMBER} does not hold {index["num_chunks"]} vectors of dimension {index["dimension"]}')
+    if not isinstance(manifest.get('project'), dict) or not isinstance(manifest.get('documents'), list):
+        raise BundleError('The bundle manifest does not describe a project')
+    for entry in manifest['documents']:
+        if not isinstance(entry, dict) or not isinstance(entry.get('name'), str) or (
+                entry.get('member') and entry['member'] not in files):
+            raise BundleError('The bundle manifest lists a document it does not carry')
+    return manifest
+
+
+def _project_fields(manifest):
+    """The project fields to create the copy with; an index type the tuner wouldn't pick here is dropped."""
+    project = {field: value for field, value in manifest['project'].items()
+               if field in PROJECT_FIELDS and value is not None}
+    index = manifest['index']
+    factories = {factory for factory, _, _ in candidates(index['num_chunks'], index['dimension'])}
+    if project.get('index_factory') and project['index_factory'] not in factories:
+        logger.info(f"Ignoring index type {project['index_factory']!r} of an imported project")
+        project['index_factory'] = ''
+    params = project.get('search_params')
+    project['search_params'] = {key: value for key, value in params.items()
+                                if key in SEARCH_PARAMS and _positive_int(value)} if isinstance(params, dict) else {}
+    return project
+
+
+def _read_chunks(path, num_chunks):
+    from langchain_core.documents import Document as LangchainDocument
+
+    try:
+        with open(path, encoding='utf-8') as f:
+            entries = json.load(f)
+    except ValueError:
+        raise BundleError(f'{CHUNKS_MEMBER} is not valid JSON')
+    if not isinstance(entries, list) or len(entries) != num_chunks:
+        raise BundleError(f'{CHUNKS_MEMBER} does not hold {num_chunks} chunks')
+    chunks = []
+    for entry in entries:
+        if (not isinstance(entry, dict) or not isinstance(entry.get('page_content'), str)
+                or not isinstance(entry.get('metadata', {}), dict)):
+            raise BundleError(f'Malformed chunk in {CHUNKS_MEMBER}')
+        chunks.append(LangchainDocument(page_content=entry['page_content'], metadata=entry.get('metadata', {})))
+    return chunks
+
+
+def _rebuild_index(vector_db, path, num_chunks, dimension):
+    """Build the project's index from the bundle's raw vectors with its own (validated) index type."""
+    vectors = np.memmap(path, dtype='<f4', mode='r', shape=(num_chunks, dimension))
+    for start in range(0, num_chunks, VECTOR_ROWS):
+        if not np.isfinite(vectors[start:start + VECTOR_ROWS]).all():
+            raise BundleError(f'{VECTORS_MEMBER} holds values that are not finite')
+    index = new_index(dimension, vector_db.index_factory or settings.INDEX_FACTORY, num_chunks)
+    return fill_index(index, vectors, VECTOR_ROWS, settings.INDEX_TRAIN_SAMPLE,
+                      vector_db.search_params.get('nprobe') or settings.INDEX_NPROBE)
+
+
+def import_bundle(fileobj, user, name=None):
+    """Create a new project for `user` from a bundle read sequentially from fileobj.
+
+    The chunks are validated and the index is rebuilt from the bundle's
+    vectors, so nothing is re-embedded, and the source documents are created
+    in one bulk insert, already marked processed. Any file that doesn't match
+    its checksum aborts the import and removes what was written. Returns the
+    new VectorDatabase.
+    """
+    try:
+        tar = tarfile.open(fileobj=fileobj, mode='r|*')
+    except tarfile.TarError as e:
+        raise BundleError(f'Not a project bundle: {e}')
+
+    with tar:
+        manifest = _read_manifest(tar)
+        project = _project_fields(manifest)
+        if name:
+            project['name'] = name
+        vector_db = VectorDatabase.objects.create(user=user, **project)
+        # Holds the received index data until the rebuilt index is published
+        build_path = index_store.new_build_path(vector_db)
+        os.makedirs(build_path)
+        documents = {entry['member']: entry for entry in manifest['documents'] if entry.get('member')}
+        text_root = os.path.join(settings.MEDIA_ROOT, 'text', f'user_{user.id}')
+        written = []
+        received = set()
+        try:
+            # tar.next() rather than iterating, which would start over at bundle.json
+            for member in iter(tar.next, None):
+                expected = manifest['files'].get(member.name)
+                if not member.isfile() or expected is None:
+                    raise BundleError(f'Unexpected bundle member {member.name}')
+                source = tar.extractfile(member)
+
+                if member.name in INDEX_MEMBERS:
+                    path = os.path.join(build_path, os.path.basename(member.name))
+                elif member.name in documents:
+                    entry = documents[member.name]
+                    document = Document(user=user, vector_database=vector_db)
+                    entry['file'] = default_storage.get_available_name(user_directory_path(document, os.path.basename(entry['name'])))
+                    path = default_storage.path(entry['file'])
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                elif member.name.startswith('text/'):
+                    path = os.path.join(text_root, os.path.basename(member.name))
+                    if os.path.exists(path):
+                        # This user already has the text extracted from identical content
+                        received.add(member.name)
+                        continue
+                    os.makedirs(text_root, exist_ok=True)
+                else:
+                    raise BundleError(f'Unexpected bundle member {member.name}')
+
+                written.append(path)
+                _copy_member(source, path, expected)
+                received.add(member.name)
+
+            missing = set(manifest['files']) - received
+            if missing:
+                raise BundleError(f'Bundle is truncated; missing {", ".join(sorted(missing))}')
+
+            num_chunks, dimension = manifest['index']['num_chunks'], manifest['index']['dimension']
+            chunks = _read_chunks(os.path.join(build_path, os.path.basename(CHUNKS_MEMBER)), num_chunks)
+            index = _rebuild_index(vector_db, os.path.join(build_path, os.path.basename(VECTORS_MEMBER)), num_chunks, dimension)
+            # The build key named the source project's documents, so a re-ingest here rebuilds
+            manifest_extra = {key: value for key, value in manifest['index'].items() if key not in REBUILT_INDEX_KEYS}
+            manifest_extra['imported_at'] = timezone.now().isoformat()
+            shared_index.publish_project(vector_db, index, chunks, manifest_extra)
+        except BaseException as e:
+            for path in written:
+                if os.path.isfile(path):
+                    os.remove(path)
+            vector_db.delete()
+            if isinstance(e, (tarfile.TarError, OSError)):
+                raise BundleError(f'Could not read bundle: {e}') from e
+            raise
+        finally:
+            shutil.rmtree(build_path, ignore_errors=True)
+
+    Document.objects.bulk_create([
+        Document(
+            user=user,
+            vector_database=vector_db,
+            file=entry['file'],
+            file_size=manifest['files'][member_name]['size'],
+            content_hash=entry['content_hash'],
+            processed=True,
+            **{field: entry.get(field) for field in DOCUMENT_FIELDS if entry.get(field) is not None},
+        )
+        for member_name, entry in documents.items()
+    ])
+    vector_db.refresh_document_stats()
+    logger.info(f"Imported project {vector_db.project_id} from a bundle with {len(documents)} documents")
+    return vector_db
@@ -0,0 +1,106 @@
+import os
+import json
+import pickle
+import shutil
+import hashlib
+import logging
+
+logger = logging.getLogger('vector_search')
+
+CHECKPOINT_VERSION = 1
+# Inside the project's index directory, next to the published versions
+CHECKPOINT_DIRNAME = '.checkpoint'
+STATE_FILENAME = 'state.json'
+CHUNKS_FILENAME = 'chunks.pkl'
+EMBEDDINGS_FILENAME = 'embeddings.npy'
+
+
+def build_key(**inputs):
+    """Stable hash of everything that determines a build's chunks and embeddings."""
+    encoded = json.dumps(inputs, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def _atomic_write(path, data):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class BuildCheckpoint:
+    """Progress of one index build, kept on disk so a retried task can resume.
+
+    Holds the deduplicated chunk list, a float32 .npy memmap of embeddings and
+    state.json recording how many leading rows of that memmap are complete.
+    A checkpoint written for different inputs (another key) is discarded.
+    """
+
+    def __init__(self, path, key):
+        self.path = path
+        self.key = key
+        self.state = self._load_state()
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _load_state(self):
+        try:
+            with open(self._file(STATE_FILENAME)) as f:
+                state = json.load(f)
+        except (FileNotFoundError, ValueError):
+            state = None
+        if state and state.get('version') == CHECKPOINT_VERSION and state.get('key') == self.key:
+            logger.info(f"Resuming build from checkpoint at {state.get('rows_done', 0)} embedded rows")
+            return state
+        if state is not None:
+            logger.info("Discarding checkpoint for a different set of inputs")
+        shutil.rmtree(self.path, ignore_errors=True)
+        return {'version': CHECKPOINT_VERSION, 'key': self.key, 'rows_done': 0}
+
+    def _save_state(self):
+        os.makedirs(self.path, exist_ok=True)
+        _atomic_write(self._file(STATE_FILENAME), json.dumps(self.state).encode('utf-8'))
+
+    @property
+    def rows_done(self):
+        return self.state.get('rows_done', 0)
+
+    def update(self, **values):
+        self.state.update(values)
+        self._save_state()
+
+    def has_chunks(self):
+        return self.state.get('chunks_saved') and os.path.isfile(self._file(CHUNKS_FILENAME))
+
+    def save_chunks(self, chunks, stats):
+        os.makedirs(self.path, exist_ok=True)
+        _atomic_write(self._file(CHUNKS_FILENAME), pickle.dumps(chunks))
+        self.update(chunks_saved=True, num_chunks=len(chunks), rows_done=0, stats=stats)
+
+    def load_chunks(self):
+        with open(self._file(CHUNKS_FILENAME), 'rb') as f:
+            return pickle.load(f)
+
+    def embeddings(self, num_rows, dimension):
+        """The embeddings memmap, created (and progress reset) if missing or the wrong shape."""
+        import numpy as np
+
+        path = self._file(EMBEDDINGS_FILENAME)
+        if os.path.isfile(path):
+            spool = np.load(path, mmap_mode='r+')
+            if spool.shape == (num_rows, dimension) and spool.dtype == np.float32:
+                return spool
+            del spool
+        os.makedirs(self.path, exist_ok=True)
+        self.update(rows_done=0)
+        return np.lib.format.open_memmap(path, mode='w+', dtype='float32', shape=(num_rows, dimension))
+
+    def mark_rows(self, rows_done):
+        # Called only after the rows are flushed, so a crash never records unwritten rows
+        self.update(rows_done=rows_done)
+
+    def clear(self):
+        shutil.rmtree(self.path, ignore_errors=True)
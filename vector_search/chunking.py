@@ -0,0 +1,85 @@
+import logging
+
+logger = logging.getLogger('vector_search')
+
+UNIT_TOKENS = 'tokens'
+UNIT_CHARACTERS = 'characters'
+
+# When looking for a place to end a chunk, only the last part of the window is
+# searched so chunks stay close to the full token budget.
+BOUNDARY_SEARCH_FRACTION = 0.3
+SENTENCE_END = ('.', '!', '?', ':', ';')
+
+
+def _boundary_score(text, offsets, k):
+    """How good a place the gap before token k is to end a chunk."""
+    gap = text[offsets[k - 1][1]:offsets[k][0]]
+    if '\n\n' in gap:
+        return 3
+    if '\n' in gap:
+        return 2
+    if gap and text[offsets[k - 1][1] - 1:offsets[k - 1][1]] in SENTENCE_END:
+        return 1
+    return 0
+
+
+def _windows(text, offsets, size, overlap):
+    n = len(offsets)
+    start = 0
+    while start < n:
+        end = min(start + size, n)
+        if end < n:
+            best, best_score = end, 0
+            floor = max(start + 1, end - int(size * BOUNDARY_SEARCH_FRACTION))
+            for k in range(end, floor - 1, -1):
+                score = _boundary_score(text, offsets, k)
+                if score > best_score:
+                    best, best_score = k, score
+                    if score == 3:
+                        break
+            end = best
+        yield start, end
+        if end >= n:
+            break
+        start = max(end - overlap, start + 1)
+
+
+def token_chunk_documents(documents, tokenizer, chunk_size, chunk_overlap, batch_size=64):
+    """Split LangChain documents into chunks of at most chunk_size tokens.
+
+    Documents are tokenized in batches by the (fast) model tokenizer with
+    offset mappings, so chunk text is sliced straight out of the original
+    string and every chunk fits the embedding model's sequence limit.
+    """
+    from langchain_core.documents import Document as LangchainDocument
+
+    if chunk_overlap >= chunk_size:
+        raise ValueError('chunk_overlap must be smaller than chunk_size')
+
+    chunks = []
+    for batch_start in range(0, len(documents), batch_size):
+        batch = documents[batch_start:batch_start + batch_size]
+        encoded = tokenizer(
+            [doc.page_content for doc in batch],
+            add_special_tokens=False,
+            return_offsets_mapping=True,
+            return_attention_mask=False,
+            return_token_type_ids=False,
+            verbose=False,
+        )
+        for doc, offsets in zip(batch, encoded['offset_mapping']):
+            text = doc.page_content
+            for start, end in _windows(text, offsets, chunk_size, chunk_overlap):
+                char_start, char_end = offsets[start][0], offsets[end - 1][1]
+                metadata = dict(doc.metadata)
+                metadata['start_index'] = char_start
+                metadata['token_count'] = end - start
+                chunks.append(LangchainDocument(page_content=text[char_start:char_end], metadata=metadata))
+
+    logger.info(f"Token chunker created {len(chunks)} chunks of up to {chunk_size} tokens from {len(documents)} documents")
+    return chunks
+
+
+def model_chunk_size(model):
+    # Leave room for the [CLS]/[SEP] tokens the model adds around each input
+    return model.max_seq_length - model.tokenizer.num_special_tokens_to_add(pair=False)
@@ -0,0 +1,161 @@
+import logging
+import threading
+import urllib.parse
+import xml.etree.ElementTree as ET
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from django.conf import settings
+
+logger = logging.getLogger('vector_search')
+
+SITEMAP_NS = '{http://www.sitemaps.org/schemas/sitemap/0.9}'
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class FetchResult:
+    def __init__(self, url, status_code=None, content=None, content_type='', etag='', last_modified='', error=None):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+        self.content_type = content_type
+        self.etag = etag
+        self.last_modified = last_modified
+        self.error = error
+
+    @property
+    def not_modified(self):
+        return self.status_code == 304 and not self.error
+
+    @property
+    def is_html(self):
+        return self.content is not None and 'text/html' in self.content_type.lower()
+
+
+def build_session(pool_size=None):
+    pool_size = pool_size or settings.CRAWL_MAX_WORKERS
+    session = requests.Session()
+    retry = Retry(total=2, backoff_factor=0.5, status_forcelist=[502, 503, 504], allowed_methods=['GET'])
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers['User-Agent'] = settings.CRAWL_USER_AGENT
+    return session
+
+
+def get_session():
+    # Shared per process so single scrapes from the web worker reuse connections too
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = build_session()
+    return _session
+
+
+def safe_filename_for_url(url, extension='.html'):
+    parsed_url = urllib.parse.urlparse(url)
+    safe_filename = f"{parsed_url.netloc}{parsed_url.path}".replace('/', '_')
+    if not safe_filename.endswith(extension):
+        safe_filename += extension
+    return safe_filename
+
+
+def is_valid_url(url):
+    try:
+        result = urllib.parse.urlparse(url)
+    except ValueError:
+        return False
+    return result.scheme in ('http', 'https') and bool(result.netloc)
+
+
+def fetch_page(session, url, etag='', last_modified='', timeout=None):
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    try:
+        response = session.get(url, headers=headers, timeout=timeout or settings.CRAWL_TIMEOUT)
+        if response.status_code == 304:
+            if not headers:
+                # Nothing to be unchanged from: there's no stored copy to keep
+                return FetchResult(url, 304, error='Not Modified returned for an unconditional request')
+            return FetchResult(url, 304, etag=etag, last_modified=last_modified)
+        response.raise_for_status()
+        return FetchResult(
+            url,
+            response.status_code,
+            content=response.text,
+            content_type=response.headers.get('Content-Type', ''),
+            etag=response.headers.get('ETag', ''),
+            last_modified=response.headers.get('Last-Modified', ''),
+        )
+    except requests.RequestException as e:
+        return FetchResult(url, getattr(e.response, 'status_code', None), error=str(e))
+
+
+def _locations(root):
+    # Skips empty <loc> elements rather than failing the whole sitemap
+    for loc in root.iter(f'{SITEMAP_NS}loc'):
+        if loc.text and loc.text.strip():
+            yield loc.text.strip()
+
+
+def parse_sitemap(session, sitemap_url, limit=None, _depth=0):
+    # Follows sitemap indexes one level deep, which covers what sites publish in practice
+    if limit is None:
+        limit = settings.CRAWL_MAX_URLS
+    response = session.get(sitemap_url, timeout=settings.CRAWL_TIMEOUT)
+    response.raise_for_status()
+    root = ET.fromstring(response.content)
+
+    urls = []
+    if root.tag == f'{SITEMAP_NS}sitemapindex':
+        if _depth > 0:
+            return urls
+        for loc in _locations(root):
+            urls.extend(parse_sitemap(session, loc, limit - len(urls), _depth + 1))
+            if len(urls) >= limit:
+                break
+    else:
+        for loc in _locations(root):
+            urls.append(loc)
+            if len(urls) >= limit:
+                break
+    return urls[:limit]
+
+
+def crawl(urls, validators=None, session=None, max_workers=None, per_host=None):
+    """Fetch urls concurrently and return FetchResults in input order.
+
+    validators maps url -> (etag, last_modified) from a previous fetch, so
+    unchanged pages come back as 304 without a body.
+    """
+    validators = validators or {}
+    session = session or build_session(max_workers)
+    max_workers = max_workers or settings.CRAWL_MAX_WORKERS
+    per_host = per_host or settings.CRAWL_PER_HOST_LIMIT
+
+    host_slots = defaultdict(lambda: threading.BoundedSemaphore(per_host))
+    host_slots_lock = threading.Lock()
+
+    def fetch(url):
+        host = urllib.parse.urlparse(url).netloc
+        with host_slots_lock:
+            slot = host_slots[host]
+        with slot:
+            etag, last_modified = validators.get(url, ('', ''))
+            return fetch_page(session, url, etag, last_modified)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(fetch, urls))
+
+    logger.info(f"Crawled {len(urls)} urls: "
+                f"{sum(1 for r in results if r.not_modified)} not modified, "
+                f"{sum(1 for r in results if r.error)} failed")
+    return results
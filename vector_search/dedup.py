@@ -0,0 +1,100 @@
+import re
+import zlib
+import logging
+from collections import defaultdict
+import numpy as np
+
+logger = logging.getLogger('vector_search')
+
+_WORDS = re.compile(r'\w+')
+
+# Universal hashing (a * x + b) mod p over 32-bit shingle hashes. p is the
+# first prime above 2**32; a < 2**31 keeps a * x + b inside uint64.
+_PRIME = np.uint64(4294967311)
+_MAX_HASH = np.uint64(0xFFFFFFFF)
+ROWS_PER_BAND = 4
+
+
+def shingles(text, size=3):
+    words = _WORDS.findall(text.lower())
+    if len(words) < size:
+        return {' '.join(words)} if words else set()
+    return {' '.join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def _permutations(num_perm, seed=1):
+    rng = np.random.RandomState(seed)
+    a = rng.randint(1, 2 ** 31 - 1, size=num_perm, dtype=np.uint64)
+    b = rng.randint(0, 2 ** 32 - 1, size=num_perm, dtype=np.uint64)
+    return a, b
+
+
+def minhash_signature(shingle_set, a, b):
+    if not shingle_set:
+        return np.full(len(a), _MAX_HASH, dtype=np.uint64)
+    hashes = np.fromiter((zlib.crc32(s.encode('utf-8')) for s in shingle_set), dtype=np.uint64, count=len(shingle_set))
+    # (num_perm, num_shingles) -> min over shingles
+    return ((np.outer(a, hashes) + b[:, None]) % _PRIME & _MAX_HASH).min(axis=1)
+
+
+def jaccard(first, second):
+    if not first and not second:
+        return 1.0
+    return len(first & second) / len(first | second)
+
+
+def dedupe_chunks(chunks, threshold=0.9, num_perm=64, text=lambda chunk: chunk.page_content):
+    """Drop chunks that are near-duplicates of an earlier chunk.
+
+    MinHash signatures are bucketed with LSH banding to find candidate pairs
+    cheaply; candidates are then confirmed with the exact Jaccard similarity of
+    their word 3-gram shingles. The first chunk of each group is kept, in
+    order, and records the sources of the copies folded into it.
+
+    Returns (kept_chunks, removed_count).
+    """
+    if not chunks or threshold is None or threshold > 1:
+        return chunks, 0
+
+    a, b = _permutations(num_perm)
+    bands = num_perm // ROWS_PER_BAND
+    buckets = defaultdict(list)
+    kept = []
+    kept_shingles = []
+    removed = 0
+
+    for chunk in chunks:
+        chunk_shingles = shingles(text(chunk))
+        signature = minhash_signature(chunk_shingles, a, b)
+        band_keys = [(band, signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND].tobytes()) for band in range(bands)]
+
+        duplicate_of = None
+        seen = set()
+        for key in band_keys:
+            for candidate in buckets.get(key, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                if jaccard(chunk_shingles, kept_shingles[candidate]) >= threshold:
+                    duplicate_of = candidate
+                    break
+            if duplicate_of is not None:
+                break
+
+        if duplicate_of is None:
+            position = len(kept)
+            kept.append(chunk)
+            kept_shingles.append(chunk_shingles)
+            for key in band_keys:
+                buckets[key].append(position)
+        else:
+            removed += 1
+            original = kept[duplicate_of]
+            source = getattr(chunk, 'metadata', {}).get('source')
+            if source and source != original.metadata.get('source'):
+                duplicate_sources = original.metadata.setdefault('duplicate_sources', [])
+                if source not in duplicate_sources:
+                    duplicate_sources.append(source)
+
+    logger.info(f"Near-duplicate removal kept {len(kept)} of {len(chunks)} chunks (threshold {threshold})")
+    return kept, removed
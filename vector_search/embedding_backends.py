@@ -0,0 +1,175 @@
+import os
+import inspect
+import logging
+import numpy as np
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+logger = logging.getLogger('vector_search')
+
+BACKEND_TORCH = 'torch'
+BACKEND_ONNX = 'onnx'
+BACKEND_ONNX_INT8 = 'onnx-int8'
+BACKENDS = (BACKEND_TORCH, BACKEND_ONNX, BACKEND_ONNX_INT8)
+
+
+def default_backend():
+    return settings.EMBEDDING_BACKEND
+
+
+class TorchEncoder:
+    """The SentenceTransformer model as-is."""
+
+    backend = BACKEND_TORCH
+
+    def __init__(self, model):
+        self.model = model
+        self.tokenizer = model.tokenizer
+        self.max_seq_length = model.max_seq_length
+        self.dimension = model.get_sentence_embedding_dimension()
+
+    def encode(self, texts, batch_size=32):
+        return self.model.encode(texts, batch_size=batch_size, show_progress_bar=False, convert_to_numpy=True)
+
+
+def _last_hidden_state_module(transformer):
+    """Wrap the HF transformer so the exported graph has a single named output."""
+    import torch
+
+    class LastHiddenState(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.transformer = transformer
+
+        def forward(self, input_ids, attention_mask, token_type_ids=None):
+            kwargs = {'input_ids': input_ids, 'attention_mask': attention_mask}
+            if token_type_ids is not None:
+                kwargs['token_type_ids'] = token_type_ids
+            return self.transformer(**kwargs)[0]
+
+    return LastHiddenState()
+
+
+def model_slug(model_name):
+    return model_name.strip('/').replace('/', '__')
+
+
+def onnx_paths(model_name):
+    folder = os.path.join(settings.EMBEDDING_ONNX_DIR, model_slug(model_name))
+    return os.path.join(folder, 'model.onnx'), os.path.join(folder, 'model.int8.onnx')
+
+
+def export_onnx(model, path):
+    """Export the model's transformer to ONNX with dynamic batch and sequence axes."""
+    import torch
+
+    transformer = model[0].auto_model.eval()
+    sample = model.tokenizer(['export sample'], return_tensors='pt')
+    input_names = [name for name in ('input_ids', 'attention_mask', 'token_type_ids') if name in sample]
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names}
+    dynamic_axes['last_hidden_state'] = {0: 'batch', 1: 'sequence'}
+
+    kwargs = {}
+    # Newer torch defaults to the dynamo exporter; the TorchScript one handles HF encoders fine
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        kwargs['dynamo'] = False
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with torch.no_grad():
+        torch.onnx.export(
+            _last_hidden_state_module(transformer),
+            tuple(sample[name] for name in input_names),
+            tmp_path,
+            input_names=input_names,
+            output_names=['last_hidden_state'],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+            **kwargs,
+        )
+    os.replace(tmp_path, path)
+    logger.info(f"Exported ONNX embedding model to {path}")
+
+
+def quantize_onnx(source_path, path):
+    """Dynamic int8 quantization: int8 weights, activations quantized on the fly."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    quantize_dynamic(source_path, tmp_path, weight_type=QuantType.QInt8)
+    os.replace(tmp_path, path)
+    logger.info(f"Wrote int8-quantized ONNX embedding model to {path}")
+
+
+def pooling_mode(pooling):
+    # sentence-transformers 3.x configs carry one flag per mode, later releases a single name
+    config = pooling.get_config_dict()
+    if config.get('pooling_mode_cls_token') or config.get('pooling_mode') == 'cls':
+        return 'cls'
+    if config.get('pooling_mode_mean_tokens') or config.get('pooling_mode') == 'mean':
+        return 'mean'
+    raise ImproperlyConfigured(f"ONNX embedding backend supports mean or CLS pooling, not {config}")
+
+
+class OnnxEncoder:
+    """Runs the exported transformer in ONNX Runtime and applies the model's pooling in numpy."""
+
+    def __init__(self, model, path, backend=BACKEND_ONNX):
+        import onnxruntime
+
+        self.backend = backend
+        self.path = path
+        self.tokenizer = model.tokenizer
+        self.max_seq_length = model.max_seq_length
+        self.dimension = model.get_sentence_embedding_dimension()
+
+        self.pooling_mode = pooling_mode(model[1])
+        self.normalize = any(type(module).__name__ == 'Normalize' for module in model)
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if settings.EMBEDDING_NUM_THREADS:
+            options.intra_op_num_threads = settings.EMBEDDING_NUM_THREADS
+        self.session = onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.input_names = [node.name for node in self.session.get_inputs()]
+
+    def encode(self, texts, batch_size=32):
+        outputs = []
+        for i in range(0, len(texts), batch_size):
+            encoded = self.tokenizer(texts[i:i + batch_size], padding=True, truncation=True,
+                                     max_length=self.max_seq_length, return_tensors='np')
+            feed = {name: encoded[name].astype(np.int64) for name in self.input_names}
+            hidden = self.session.run(None, feed)[0]
+            if self.pooling_mode == 'cls':
+                pooled = hidden[:, 0]
+            else:
+                mask = encoded['attention_mask'][..., None].astype(hidden.dtype)
+                pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            if self.normalize:
+                pooled = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            outputs.append(pooled.astype('float32'))
+        if not outputs:
+            return np.zeros((0, self.dimension), dtype='float32')
+        return np.concatenate(outputs)
+
+
+def build_encoder(model, model_name, backend):
+    """Return an encoder for the SentenceTransformer `model`, exporting ONNX files on first use."""
+    if backend == BACKEND_TORCH:
+        return TorchEncoder(model)
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend '{backend}', expected one of {', '.join(BACKENDS)}")
+
+    try:
+        import onnxruntime  # noqa: F401
+    except ImportError:
+        raise ImproperlyConfigured(f"EMBEDDING_BACKEND '{backend}' needs the onnxruntime and onnx packages")
+
+    fp32_path, int8_path = onnx_paths(model_name)
+    if not os.path.isfile(fp32_path):
+        export_onnx(model, fp32_path)
+    if backend == BACKEND_ONNX_INT8:
+        if not os.path.isfile(int8_path):
+            quantize_onnx(fp32_path, int8_path)
+        return OnnxEncoder(model, int8_path, backend)
+    return OnnxEncoder(model, fp32_path, backend)
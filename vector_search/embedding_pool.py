@@ -0,0 +1,108 @@
+import os
+import time
+import atexit
+import logging
+import threading
+import multiprocessing
+from collections import defaultdict
+from django.conf import settings
+
+logger = logging.getLogger('vector_search')
+
+# One pool per worker process, created on the first large job and kept for the
+# life of the worker so each child loads the model only once. Its children
+# already use every core, so a job holds the lock for its whole run: a job on
+# another thread (the threads pool) waits instead of replacing the pool under it.
+_pool = None
+_pool_key = None
+_pool_lock = threading.Lock()
+
+# Set in each pool child by _init_child
+_encoder = None
+
+
+def pool_size():
+    return max(1, settings.EMBEDDING_POOL_PROCESSES)
+
+
+def should_use_pool(num_chunks):
+    return pool_size() > 1 and num_chunks >= settings.EMBEDDING_POOL_THRESHOLD
+
+
+def _init_child(model_name, backend, threads):
+    global _encoder
+    # Split the cores between children instead of every child using all of
+    # them. OpenMP reads this once, when torch is first imported, so it must be set first.
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+    # Spawned children start from a fresh interpreter
+    import django
+    django.setup()
+    import torch
+    from .vector_db_utils import load_encoder
+
+    torch.set_num_threads(threads)
+    _encoder = load_encoder(model_name, backend)
+
+
+def _encode(job):
+    position, texts = job
+    started = time.perf_counter()
+    embeddings = _encoder.encode(texts, batch_size=len(texts))
+    return position, embeddings, os.getpid(), time.perf_counter() - started
+
+
+def _get_pool_locked(model_name, backend):
+    global _pool, _pool_key
+    key = (model_name, backend)
+    if _pool is not None and _pool_key != key:
+        _shutdown_locked()
+    if _pool is None:
+        processes = pool_size()
+        threads = max(1, (os.cpu_count() or 1) // processes)
+        # spawn, not fork: forking a process that already holds torch threads can deadlock
+        context = multiprocessing.get_context('spawn')
+        _pool = context.Pool(processes, initializer=_init_child, initargs=(model_name, backend, threads))
+        _pool_key = key
+        logger.info(f"Started embedding pool with {processes} processes x {threads} threads for {model_name}")
+    return _pool
+
+
+def _shutdown_locked():
+    global _pool, _pool_key
+    if _pool is not None:
+        _pool.close()
+        _pool.join()
+        _pool = None
+        _pool_key = None
+        logger.info("Stopped embedding pool")
+
+
+def shutdown_pool(**kwargs):
+    # Also used as a Celery signal receiver, hence **kwargs
+    with _pool_lock:
+        _shutdown_locked()
+
+
+atexit.register(shutdown_pool)
+
+
+def encode_batches(texts, batches, model_name, backend):
+    """Encode each batch of text indices in the pool.
+
+    Returns (embeddings, per_process) where embeddings are in the original
+    order of `texts` and per_process maps pid to (chunks, busy seconds).
+    """
+    import numpy as np
+
+    embeddings = None
+    per_process = defaultdict(lambda: [0, 0.0])
+    jobs = ((position, [texts[i] for i in batch]) for position, batch in enumerate(batches))
+    with _pool_lock:
+        pool = _get_pool_locked(model_name, backend)
+        for position, batch_embeddings, pid, seconds in pool.imap_unordered(_encode, jobs):
+            if embeddings is None:
+                embeddings = np.empty((len(texts), batch_embeddings.shape[1]), dtype='float32')
+            embeddings[batches[position]] = batch_embeddings
+            per_process[pid][0] += len(batches[position])
+            per_process[pid][1] += seconds
+    return embeddings, dict(per_process)
@@ -0,0 +1,489 @@
+import os
+import json
+import time
+import uuid
+import pickle
+import shutil
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from django.conf import settings
+from django.utils import timezone
+from . import access_stats
+
+logger = logging.getLogger('vector_search')
+
+INDEX_FILENAME = 'faiss_index'
+CHUNKS_FILENAME = 'chunks.pkl'
+MANIFEST_FILENAME = 'manifest.json'
+CURRENT_FILENAME = 'CURRENT'
+MANIFEST_VERSION = 1
+
+# Loaded (index, chunks) pairs keyed by (project_id, index_version). A new
+# version is a new key, so publishing never needs an explicit invalidation.
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def version_dirname(version):
+    return f'v{version:06d}'
+
+
+def index_storage():
+    """The storage that published versions are uploaded to, or None to serve them from local MEDIA_ROOT."""
+    if not settings.INDEX_STORAGE_BACKEND:
+        return None
+    from django.core.files.storage import storages
+    return storages['indexes']
+
+
+def storage_name(vector_db, version, filename):
+    # The same relative path the VectorDatabase row records, so local and remote layouts match
+    path = os.path.join(vector_db.index_root, version_dirname(version), filename)
+    return os.path.relpath(path, settings.MEDIA_ROOT).replace(os.sep, '/')
+
+
+def upload_version(storage, vector_db, version, version_path):
+    """Copy a published version to the index storage, manifest last so it marks a complete upload."""
+    from django.core.files import File
+
+    for filename in (INDEX_FILENAME, CHUNKS_FILENAME, MANIFEST_FILENAME):
+        name = storage_name(vector_db, version, filename)
+        # A retried upload must overwrite, not get a renamed copy
+        if storage.exists(name):
+            storage.delete(name)
+        with open(os.path.join(version_path, filename), 'rb') as f:
+            saved = storage.save(name, File(f))
+        if saved != name:
+            raise OSError(f'Index storage saved {name} as {saved}')
+    logger.info(f"Uploaded index version {version} for project {vector_db.project_id}")
+
+
+def file_checksum(path):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def _fsync_file(path):
+    with open(path, 'rb') as f:
+        os.fsync(f.fileno())
+
+
+def _fsync_dir(path):
+    # Directory fsync makes the rename durable; not supported everywhere
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def existing_versions(index_root):
+    versions = []
+    if os.path.isdir(index_root):
+        for name in os.listdir(index_root):
+            if name.startswith('v') and name[1:].isdigit():
+                versions.append(int(name[1:]))
+    return sorted(versions)
+
+
+def read_current(index_root):
+    try:
+        with open(os.path.join(index_root, CURRENT_FILENAME)) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def write_current(index_root, dirname):
+    tmp_path = os.path.join(index_root, f'{CURRENT_FILENAME}.{uuid.uuid4().hex}.tmp')
+    with open(tmp_path, 'w') as f:
+        f.write(dirname)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(index_root, CURRENT_FILENAME))
+    _fsync_dir(index_root)
+
+
+def read_manifest(version_path):
+    with open(os.path.join(version_path, MANIFEST_FILENAME)) as f:
+        return json.load(f)
+
+
+def write_build(build_path, index, chunks, manifest_extra=None):
+    """Write index, chunks and manifest into build_path and return the manifest."""
+    import faiss
+
+    os.makedirs(build_path, exist_ok=True)
+    index_path = os.path.join(build_path, INDEX_FILENAME)
+    chunks_path = os.path.join(build_path, CHUNKS_FILENAME)
+    faiss.write_index(index, index_path)
+    with open(chunks_path, 'wb') as f:
+        pickle.dump(chunks, f)
+
+    files = {}
+    for name, path in ((INDEX_FILENAME, index_path), (CHUNKS_FILENAME, chunks_path)):
+        _fsync_file(path)
+        files[name] = {'sha256': file_checksum(path), 'size': os.path.getsize(path)}
+
+    manifest = {
+        'manifest_version': MANIFEST_VERSION,
+        'created_at': timezone.now().isoformat(),
+        'num_chunks': len(chunks),
+        'dimension': index.d,
+        'index_type': type(index).__name__,
+        'files': files,
+    }
+    manifest.update(manifest_extra or {})
+    with open(os.path.join(build_path, MANIFEST_FILENAME), 'w') as f:
+        json.dump(manifest, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    return manifest
+
+
+def publish_index(vector_db, index, chunks, manifest_extra=None):
+    """Publish a new immutable index version for the project and point readers at it.
+
+    The build is written to a private temp directory, renamed into place as
+    v<N>, and only then made current by atomically replacing the CURRENT
+    pointer and updating the VectorDatabase row. Readers always see either the
+    old version or the new one in full.
+    """
+    build_path = new_build_path(vector_db)
+    try:
+        manifest = write_build(build_path, index, chunks, manifest_extra)
+    except Exception:
+        shutil.rmtree(build_path, ignore_errors=True)
+        raise
+    return publish_build(vector_db, build_path, manifest)
+
+
+def new_build_path(vector_db):
+    """A private directory under the project's index root to write a build into."""
+    os.makedirs(vector_db.index_root, exist_ok=True)
+    return os.path.join(vector_db.index_root, f'.build-{uuid.uuid4().hex}')
+
+
+def rename_build(index_root, build_path, manifest, last_version=0):
+    """Move a complete build into index_root as the next v<N>; returns (version, version_path)."""
+    try:
+        # rename() refuses to replace a non-empty directory, so a concurrent
+        # publisher that took the same number just makes us move to the next one.
+        version = max([last_version] + existing_versions(index_root)) + 1
+        while True:
+            manifest['version'] = version
+            with open(os.path.join(build_path, MANIFEST_FILENAME), 'w') as f:
+                json.dump(manifest, f, indent=2)
+            version_path = os.path.join(index_root, version_dirname(version))
+            try:
+                os.rename(build_path, version_path)
+                break
+            except OSError:
+                if not os.path.exists(version_path):
+                    raise
+                version += 1
+        _fsync_dir(index_root)
+    except Exception:
+        shutil.rmtree(build_path, ignore_errors=True)
+        raise
+    return version, version_path
+
+
+def publish_build(vector_db, build_path, manifest):
+    """Publish a complete build directory (index, chunks, manifest) as the project's next version."""
+    index_root = vector_db.index_root
+    version, version_path = rename_build(index_root, build_path, manifest, vector_db.index_version)
+
+    # Other nodes only learn of the version from the row, which is saved after the upload
+    storage = index_storage()
+    if storage is not None:
+        upload_version(storage, vector_db, version, version_path)
+
+    write_current(index_root, version_dirname(version))
+
+    vector_db.index_version = version
+    vector_db.index_file = os.path.relpath(os.path.join(version_path, INDEX_FILENAME), settings.MEDIA_ROOT)
+    vector_db.chunks_file = os.path.relpath(os.path.join(version_path, CHUNKS_FILENAME), settings.MEDIA_ROOT)
+    vector_db.num_chunks = manifest['num_chunks']
+    vector_db.index_size = manifest['files'][INDEX_FILENAME]['size']
+    vector_db.save()
+    logger.info(f"Published index version {version} for project {vector_db.project_id}")
+
+    gc_versions(vector_db)
+    if storage is not None:
+        gc_remote_versions(storage, vector_db)
+    return version, manifest
+
+
+def gc_versions(vector_db, keep=None, grace_seconds=None):
+    """Delete superseded versions once readers have had time to move on.
+
+    The newest `keep` versions are always kept. Older ones are removed only
+    after the version that replaced them has been live for grace_seconds, so a
+    query that read the old row just before the swap can still open its files.
+    """
+    grace_seconds = grace_seconds if grace_seconds is not None else settings.INDEX_GC_GRACE_SECONDS
+    index_root = vector_db.index_root
+    removed = gc_version_dirs(index_root, vector_db.index_version, keep, grace_seconds)
+    now = time.time()
+    versions = existing_versions(index_root)
+
+    # Abandoned builds and embedding spools from crashed workers
+    if os.path.isdir(index_root):
+        for name in os.listdir(index_root):
+            path = os.path.join(index_root, name)
+            if name.startswith('.build-') and now - os.path.getmtime(path) > max(grace_seconds, 3600):
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    os.remove(path)
+
+    # Files from the old unversioned layout next to the project's documents
+    if versions:
+        project_folder = os.path.dirname(index_root)
+        first_manifest = os.path.join(index_root, version_dirname(versions[0]), MANIFEST_FILENAME)
+        if os.path.isfile(first_manifest) and now - os.path.getmtime(first_manifest) >= grace_seconds:
+            for name in (INDEX_FILENAME, CHUNKS_FILENAME):
+                legacy_path = os.path.join(project_folder, name)
+                if os.path.isfile(legacy_path):
+                    os.remove(legacy_path)
+
+    if removed:
+        logger.info(f"Removed index versions {removed} for project {vector_db.project_id}")
+    return removed
+
+
+def gc_version_dirs(index_root, pinned_version=None, keep=None, grace_seconds=None):
+    """The version-directory part of gc_versions; pinned_version and the CURRENT one are never removed."""
+    keep = keep if keep is not None else settings.INDEX_KEEP_VERSIONS
+    grace_seconds = grace_seconds if grace_seconds is not None else settings.INDEX_GC_GRACE_SECONDS
+    versions = existing_versions(index_root)
+    current = read_current(index_root)
+    now = time.time()
+    removed = []
+
+    for position, version in enumerate(versions[:-keep] if keep else versions):
+        dirname = version_dirname(version)
+        if dirname == current or version == pinned_version:
+            continue
+        successor = os.path.join(index_root, version_dirname(versions[position + 1]))
+        try:
+            superseded_at = os.path.getmtime(os.path.join(successor, MANIFEST_FILENAME))
+        except OSError:
+            continue
+        if now - superseded_at >= grace_seconds:
+            shutil.rmtree(os.path.join(index_root, dirname), ignore_errors=True)
+            removed.append(version)
+    return removed
+
+
+def _remote_versions(storage, vector_db):
+    prefix = os.path.relpath(vector_db.index_root, settings.MEDIA_ROOT).replace(os.sep, '/')
+    try:
+        dirs, _ = storage.listdir(prefix)
+    except (OSError, NotImplementedError):
+        return prefix, []
+    return prefix, sorted(int(name[1:]) for name in dirs if name.startswith('v') and name[1:].isdigit())
+
+
+def gc_remote_versions(storage, vector_db, keep=None, grace_seconds=None):
+    """gc_versions for the index storage; the superseded time is the successor's manifest created_at."""
+    keep = keep if keep is not None else settings.INDEX_KEEP_VERSIONS
+    grace_seconds = grace_seconds if grace_seconds is not None else settings.INDEX_GC_GRACE_SECONDS
+    prefix, versions = _remote_versions(storage, vector_db)
+    now = timezone.now()
+    removed = []
+
+    for position, version in enumerate(versions[:-keep] if keep else versions):
+        version_prefix = f'{prefix}/{version_dirname(version)}'
+        # Filesystem storages leave the emptied directory behind
+        filenames = storage.listdir(version_prefix)[1]
+        if version == vector_db.index_version or not filenames:
+            continue
+        try:
+            successor = version_manifest(vector_db, versions[position + 1], storage=storage)
+            superseded_at = datetime.fromisoformat(successor['created_at'])
+        except (OSError, ValueError, KeyError):
+            continue
+        if (now - superseded_at).total_seconds() >= grace_seconds:
+            for filename in filenames:
+                storage.delete(f'{version_prefix}/{filename}')
+            removed.append(version)
+
+    if removed:
+        logger.info(f"Removed stored index versions {removed} for project {vector_db.project_id}")
+    return removed
+
+
+def delete_published(vector_db):
+    # Called when the project is deleted; local files are removed by the model
+    storage = index_storage()
+    if storage is None:
+        return
+    prefix, versions = _remote_versions(storage, vector_db)
+    for version in versions:
+        version_prefix = f'{prefix}/{version_dirname(version)}'
+        for filename in storage.listdir(version_prefix)[1]:
+            storage.delete(f'{version_prefix}/{filename}')
+
+
+def version_manifest(vector_db, version=None, storage=None):
+    """A version's manifest, from the local version directory or else the index storage."""
+    from . import artifact_cache
+
+    version = version if version is not None else vector_db.index_version
+    try:
+        return read_manifest(os.path.join(vector_db.index_root, version_dirname(version)))
+    except FileNotFoundError:
+        storage = storage or index_storage()
+        if storage is None:
+            raise
+        return artifact_cache.fetch_manifest(storage, storage_name(vector_db, version, MANIFEST_FILENAME))
+
+
+def current_build_key(vector_db):
+    # The build key recorded by the task that published the current version, if any
+    from . import shared_index
+
+    if not vector_db.index_version:
+        return None
+    try:
+        manifest = shared_index.project_manifest(vector_db) if vector_db.shared_shard else version_manifest(vector_db)
+    except (OSError, ValueError):
+        return None
+    return manifest.get('build_key')
+
+
+def cache_key(vector_db):
+    return (vector_db.project_id, vector_db.index_version)
+
+
+def _mmap_flags():
+    import faiss
+
+    # IO_FLAG_MMAP_IFC (faiss >= 1.8) maps flat codes and inverted lists in
+    # place; IO_FLAG_MMAP alone covers inverted lists only
+    flags = []
+    if hasattr(faiss, 'IO_FLAG_MMAP_IFC'):
+        flags.append(('mmap_ifc', faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY))
+    flags.append(('mmap', faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY))
+    return flags
+
+
+def read_faiss_index(path, mmap=True):
+    """Read an index, memory-mapped read-only when its format allows.
+
+    A mapped index lives in the page cache, shared by every process that maps
+    the same file, instead of in each process's private memory. That is safe
+    because published version files are never rewritten, and unlinking a
+    mapped file (version GC) leaves existing mappings valid. Returns
+    (index, mode) with mode 'mmap_ifc', 'mmap' or 'read'.
+    """
+    import faiss
+
+    if mmap:
+        for mode, flags in _mmap_flags():
+            try:
+                return faiss.read_index(path, flags), mode
+            except RuntimeError as e:
+                logger.debug(f"Could not {mode} {path}: {str(e).splitlines()[0]}")
+        logger.info(f"Index format of {path} can't be memory-mapped, reading it into memory")
+    return faiss.read_index(path), 'read'
+
+
+def local_paths(vector_db):
+    """Local (index, chunks) paths for the project's current version.
+
+    Versions built on this node are read in place. Otherwise, with an index
+    storage configured, they come through the node's verified artifact cache.
+    """
+    from . import artifact_cache
+
+    index_path = os.path.join(settings.MEDIA_ROOT, vector_db.index_file.name)
+    chunks_path = os.path.join(settings.MEDIA_ROOT, vector_db.chunks_file.name)
+    if vector_db.index_file and os.path.exists(index_path) and os.path.exists(chunks_path):
+        return index_path, chunks_path
+
+    storage = index_storage()
+    if storage is None or not vector_db.index_version:
+        raise FileNotFoundError('Vector database files not found')
+    try:
+        manifest = version_manifest(vector_db, storage=storage)
+    except FileNotFoundError:
+        raise FileNotFoundError('Vector database files not found')
+    paths = []
+    for filename in (INDEX_FILENAME, CHUNKS_FILENAME):
+        info = manifest['files'][filename]
+        name = storage_name(vector_db, vector_db.index_version, filename)
+        paths.append(artifact_cache.fetch(storage, name, info['sha256'], info['size']))
+    return tuple(paths)
+
+
+def _read_files(vector_db):
+    index_path, chunks_path = local_paths(vector_db)
+    index, _ = read_faiss_index(index_path, mmap=settings.INDEX_MMAP)
+    with open(chunks_path, 'rb') as f:
+        chunks = pickle.load(f)
+    return index, chunks
+
+
+def load_index(vector_db):
+    """Return (index, chunks) for the project's current version, cached per process.
+
+    A project kept in a shared index gets a view of its own rows (see shared_index).
+    """
+    from . import shared_index
+
+    state = (vector_db.shared_shard, vector_db.index_version)
+    try:
+        if vector_db.shared_shard:
+            return shared_index.load_index(vector_db)
+        return _load_dedicated(vector_db)
+    except FileNotFoundError:
+        # The row may be stale if a newer version was published and the old one collected
+        vector_db.refresh_from_db(fields=['index_version', 'index_file', 'chunks_file', 'shared_shard'])
+        if (vector_db.shared_shard, vector_db.index_version) == state:
+            raise
+        return load_index(vector_db)
+
+
+def _load_dedicated(vector_db):
+    key = cache_key(vector_db)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    index, chunks = _read_files(vector_db)
+
+    # Evict the coldest projects by access hotness; looked up before taking the lock
+    with _cache_lock:
+        cached_projects = [k[0] for k in _cache if k[0] != key[0]]
+    scores = access_stats.hotness(cached_projects) if len(cached_projects) >= settings.INDEX_CACHE_MAX_ENTRIES else {}
+
+    with _cache_lock:
+        for stale in [k for k in _cache if k[0] == key[0] and k[1] < key[1]]:
+            del _cache[stale]
+        _cache[key] = (index, chunks)
+        while len(_cache) > settings.INDEX_CACHE_MAX_ENTRIES:
+            # min() keeps the first of equal scores, which is the least recently used
+            victim = min((k for k in _cache if k != key), key=lambda k: scores.get(k[0], 0.0))
+            del _cache[victim]
+    return index, chunks
+
+
+def evict(project_id):
+    with _cache_lock:
+        for key in [k for k in _cache if k[0] == project_id]:
+            del _cache[key]
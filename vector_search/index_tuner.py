@@ -0,0 +1,225 @@
+import math
+import time
+import logging
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+from . import index_store
+from .vector_db_utils import MIN_TRAINING_VECTORS, fill_index, get_embeddings, new_index, search_parameters
+
+logger = logging.getLogger('vector_search')
+
+# Picks a project's index type and search parameters from measurements on its
+# own vectors. Queries are a sample of the project's chunk embeddings held out
+# of the candidate indexes (an indexed query always finds itself, which would
+# inflate recall); each candidate's top-k is compared with exact search, and the fastest candidate
+# whose recall@k meets INDEX_TUNE_RECALL wins. Search parameters are swept
+# from cheap to expensive and the sweep stops at the first value that meets
+# the target, since larger values only cost more.
+NPROBE_VALUES = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+EF_SEARCH_VALUES = (16, 32, 64, 128, 256, 512)
+HNSW_M_VALUES = (16, 32)
+# IVF lists need enough points each to train a useful centroid
+MIN_POINTS_PER_LIST = 39
+# A sweep also stops once two more steps have gained less recall than this;
+# PQ candidates level off below the target when quantization is the limit
+MIN_RECALL_GAIN = 0.005
+# Re-indexing is only worth it for a clear win; timings vary from run to run
+REINDEX_MIN_SPEEDUP = 1.2
+
+
+def _power_of_two(value):
+    return 2 ** max(0, round(math.log2(max(value, 1))))
+
+
+def candidates(num_vectors, dimension):
+    """[(factory, search parameter name or None, values to sweep)] worth trying at this size."""
+    found = [('Flat', None, (None,))]
+    if num_vectors < MIN_TRAINING_VECTORS:
+        # new_index() builds these projects flat whatever is configured
+        return found
+    nlists = sorted({_power_of_two(math.sqrt(num_vectors) * scale) for scale in (1, 4)})
+    nlists = [nlist for nlist in nlists if num_vectors // nlist >= MIN_POINTS_PER_LIST]
+    for nlist in nlists:
+        nprobes = tuple(value for value in NPROBE_VALUES if value < nlist)
+        found.append((f'IVF{nlist},Flat', 'nprobe', nprobes))
+        for pq_bytes in (dimension // 4, dimension // 8):
+            if pq_bytes and dimension % pq_bytes == 0:
+                found.append((f'IVF{nlist},PQ{pq_bytes}', 'nprobe', nprobes))
+    for m in HNSW_M_VALUES:
+        found.append((f'HNSW{m},Flat', 'efSearch', EF_SEARCH_VALUES))
+    return found
+
+
+def stored_embeddings(index):
+    """The vectors held by an index that stores them exactly, in id order; None for lossy indexes."""
+    import faiss
+
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIVFFlat):
+        index.make_direct_map()
+    elif not isinstance(index, (faiss.IndexFlat, faiss.IndexHNSWFlat)):
+        return None
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def project_embeddings(vector_db, chunks):
+    # Read privately (not mapped) since an IVF direct map has to be built on it
+    index_path, _ = index_store.local_paths(vector_db)
+    index, _ = index_store.read_faiss_index(index_path, mmap=False)
+    embeddings = stored_embeddings(index)
+    if embeddings is None:
+        logger.info(f"Index of project {vector_db.project_id} is lossy, re-embedding {len(chunks)} chunks for tuning")
+        embeddings = get_embeddings(chunks, vector_db.model_name)
+    return np.ascontiguousarray(embeddings, dtype='float32')
+
+
+def _recall(found, truth):
+    k = truth.shape[1]
+    return float(np.mean([len(set(row) & set(expected)) / k for row, expected in zip(found, truth)]))
+
+
+def _latency_ms(index, queries, k, params):
+    index.search(queries[:1], k, params=params)
+    timings = []
+    # One query per call, as the query endpoint searches
+    for row in range(len(queries)):
+        started = time.perf_counter()
+        index.search(queries[row:row + 1], k, params=params)
+        timings.append(time.perf_counter() - started)
+    return float(np.median(timings)) * 1000
+
+
+def measure(embeddings, queries, truth, factory, param_name, values, k, target):
+    """Build one candidate and sweep its search parameter; returns a result per value tried."""
+    import faiss
+
+    started = time.perf_counter()
+    index = new_index(embeddings.shape[1], factory, len(embeddings))
+    fill_index(index, embeddings, len(embeddings), settings.INDEX_TRAIN_SAMPLE)
+    build_seconds = time.perf_counter() - started
+    size = int(faiss.serialize_index(index).size)
+
+    results = []
+    for value in values:
+        params = {param_name: value} if param_name else {}
+        search_params = search_parameters(index, params)
+        _, found = index.search(queries, k, params=search_params)
+        result = {
+            'index_factory': factory,
+            'search_params': params,
+            'recall': round(_recall(found, truth), 4),
+            'p50_ms': round(_latency_ms(index, queries, k, search_params), 4),
+            'bytes': size,
+            'build_seconds': round(build_seconds, 2),
+        }
+        results.append(result)
+        logger.info(f"Tuning {factory} {params}: recall@{k} {result['recall']:.3f}, p50 {result['p50_ms']:.3f} ms")
+        if result['recall'] >= target:
+            break
+        if len(results) >= 3 and result['recall'] - results[-3]['recall'] < MIN_RECALL_GAIN:
+            break
+    return results
+
+
+def tune(vector_db, recall_target=None, k=None, num_queries=None, apply=True):
+    """Measure the candidate indexes on the project's vectors and keep the cheapest that meets the recall target.
+
+    With apply, the choice is stored on the project; if it needs a different
+    index type, the chunks are re-indexed (not re-embedded) and published as
+    a new version. Returns a report of every measurement and the choice.
+    """
+    import faiss
+
+    recall_target = recall_target or settings.INDEX_TUNE_RECALL
+    k = k or settings.INDEX_TUNE_K
+    num_queries = num_queries or settings.INDEX_TUNE_QUERIES
+
+    _, chunks = index_store.load_index(vector_db)
+    previous = _current_manifest(vector_db)
+    current = _factory_of(vector_db, previous)
+    embeddings = project_embeddings(vector_db, chunks)
+    rng = np.random.default_rng(0)
+    # Very large projects are measured on a sample; the final index still gets every vector
+    sampled = len(embeddings) > settings.INDEX_TUNE_MAX_VECTORS
+    sample = embeddings[np.sort(rng.choice(len(embeddings), settings.INDEX_TUNE_MAX_VECTORS, replace=False))] if sampled else embeddings
+    # At most half the rows become queries; a single-vector project can only query itself
+    order = rng.permutation(len(sample))
+    num_queries = min(num_queries, len(sample) // 2) or len(sample)
+    queries = sample[order[:num_queries]]
+    indexed = sample[np.sort(order[num_queries:])] if num_queries < len(sample) else sample
+    k = min(k, len(indexed))
+
+    exact = faiss.IndexFlatL2(indexed.shape[1])
+    exact.add(indexed)
+    _, truth = exact.search(queries, k)
+    del exact
+
+    results = []
+    chosen = None
+    for factory, param_name, values in candidates(len(indexed), indexed.shape[1]):
+        measured = measure(indexed, queries, truth, factory, param_name, values, k, recall_target)
+        results.extend(measured)
+        passing = [r for r in measured if r['recall'] >= recall_target]
+        if passing and (chosen is None or (passing[0]['p50_ms'], passing[0]['bytes']) < (chosen['p50_ms'], chosen['bytes'])):
+            chosen = passing[0]
+    if chosen is None:
+        # Flat search is exact, so this only happens with a recall target above 1
+        chosen = next(r for r in results if r['index_factory'] == 'Flat')
+    kept = next((r for r in results if r['index_factory'] == current and r['recall'] >= recall_target), None)
+    if kept is not None and kept is not chosen and kept['p50_ms'] <= chosen['p50_ms'] * REINDEX_MIN_SPEEDUP:
+        chosen = kept
+
+    report = {
+        'recall_target': recall_target,
+        'k': k,
+        'num_vectors': len(embeddings),
+        'num_queries': len(queries),
+        'sampled': sampled,
+        'chosen': chosen,
+        'results': results,
+    }
+    logger.info(f"Tuned project {vector_db.project_id}: {chosen['index_factory']} {chosen['search_params']} "
+                f"(recall@{k} {chosen['recall']:.3f}, p50 {chosen['p50_ms']:.3f} ms)")
+    if apply:
+        apply_choice(vector_db, chunks, embeddings, chosen, report, previous)
+    return report
+
+
+def _current_manifest(vector_db):
+    try:
+        return index_store.version_manifest(vector_db)
+    except (OSError, ValueError):
+        # Legacy unversioned layout
+        return {}
+
+
+def _factory_of(vector_db, manifest):
+    # Small projects are built flat whatever factory was asked for
+    if manifest.get('index_type') == 'IndexFlatL2':
+        return 'Flat'
+    return vector_db.index_factory or manifest.get('index_factory')
+
+
+def apply_choice(vector_db, chunks, embeddings, chosen, report, previous):
+    unchanged = _factory_of(vector_db, previous) == chosen['index_factory']
+    vector_db.index_factory = chosen['index_factory']
+    vector_db.search_params = chosen['search_params']
+    vector_db.tuned_at = timezone.now()
+    if unchanged:
+        vector_db.save(update_fields=['index_factory', 'search_params', 'tuned_at'])
+        return None
+
+    # Built again on every vector: the measured candidates left the query rows out
+    index = new_index(embeddings.shape[1], chosen['index_factory'], len(embeddings))
+    fill_index(index, embeddings, len(embeddings), settings.INDEX_TRAIN_SAMPLE)
+    # Same chunks and embeddings, so the build key and the rest of the build record carry over
+    manifest_extra = {key: value for key, value in previous.items()
+                      if key not in ('manifest_version', 'created_at', 'num_chunks', 'dimension', 'index_type', 'files', 'version')}
+    manifest_extra.update({
+        'index_factory': chosen['index_factory'],
+        'search_params': chosen['search_params'],
+        'tuning': {key: report[key] for key in ('recall_target', 'k', 'num_vectors', 'sampled', 'chosen')},
+    })
+    version, _ = index_store.publish_index(vector_db, index, chunks, manifest_extra)
+    return version
@@ -0,0 +1,169 @@
+import time
+import uuid
+import logging
+import redis
+from django.conf import settings
+
+logger = logging.getLogger('vector_search')
+
+# One ingestion run per project at a time. The lock holds "<task id>:<start
+# time>"; a request arriving during a run either joins it or registers a
+# single follow-up run under the pending key, which the running task starts
+# when it releases the lock.
+LOCK_KEY = 'ingest:lock:{project_id}'
+PENDING_KEY = 'ingest:pending:{project_id}'
+
+# Release the lock if we still hold it, handing it straight to the pending
+# follow-up if there is one. Returns the follow-up task id or nil.
+_RELEASE_SCRIPT = """
+local value = redis.call('GET', KEYS[1])
+if not value or string.sub(value, 1, string.len(ARGV[1]) + 1) ~= ARGV[1] .. ':' then
+    return nil
+end
+local pending = redis.call('GET', KEYS[2])
+if pending then
+    redis.call('SET', KEYS[1], pending .. ':' .. ARGV[2], 'EX', ARGV[3])
+    redis.call('DEL', KEYS[2])
+    return pending
+end
+redis.call('DEL', KEYS[1])
+return nil
+"""
+
+# Start a pending follow-up if nobody holds the lock (its run ended before it saw the follow-up)
+_CLAIM_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return nil
+end
+local pending = redis.call('GET', KEYS[2])
+if pending then
+    redis.call('SET', KEYS[1], pending .. ':' .. ARGV[1], 'EX', ARGV[2])
+    redis.call('DEL', KEYS[2])
+end
+return pending
+"""
+
+# Push back the expiry of a lock we still hold
+_EXTEND_SCRIPT = """
+local value = redis.call('GET', KEYS[1])
+if not value or string.sub(value, 1, string.len(ARGV[1]) + 1) ~= ARGV[1] .. ':' then
+    return 0
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+_client = None
+
+
+def get_redis():
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.REDIS_URL, decode_responses=True)
+    return _client
+
+
+def _keys(project_id):
+    return LOCK_KEY.format(project_id=project_id), PENDING_KEY.format(project_id=project_id)
+
+
+def _lock_value(task_id):
+    return f'{task_id}:{time.time()}'
+
+
+def current_run(project_id):
+    """Return (task_id, started_at) of the run holding the lock, or (None, None)."""
+    value = get_redis().get(_keys(project_id)[0])
+    if not value:
+        return None, None
+    task_id, _, started_at = value.rpartition(':')
+    return task_id, float(started_at)
+
+
+def try_acquire(project_id, task_id):
+    """Take the lock for task_id. Also true if task_id already holds it (a retry or redelivery)."""
+    lock_key, _ = _keys(project_id)
+    if get_redis().set(lock_key, _lock_value(task_id), nx=True, ex=settings.INGEST_LOCK_TTL):
+        return True
+    return current_run(project_id)[0] == task_id
+
+
+def extend(project_id, task_id):
+    """Restart the lock's INGEST_LOCK_TTL while task_id runs; false if it no longer holds the lock."""
+    lock_key, _ = _keys(project_id)
+    return bool(get_redis().eval(_EXTEND_SCRIPT, 1, lock_key, task_id, settings.INGEST_LOCK_TTL))
+
+
+def add_follow_up(project_id):
+    """Register one follow-up run and return its task id; concurrent callers share it."""
+    _, pending_key = _keys(project_id)
+    client = get_redis()
+    task_id = str(uuid.uuid4())
+    if client.set(pending_key, task_id, nx=True, ex=settings.INGEST_LOCK_TTL):
+        return task_id
+    return client.get(pending_key) or task_id
+
+
+def release(project_id, task_id):
+    """Release the lock held by task_id; returns the follow-up task id now holding it, if any."""
+    lock_key, pending_key = _keys(project_id)
+    follow_up = get_redis().eval(_RELEASE_SCRIPT, 2, lock_key, pending_key,
+                                 task_id, time.time(), settings.INGEST_LOCK_TTL)
+    if follow_up:
+        logger.info(f"Handing ingestion lock for project {project_id} to follow-up run {follow_up}")
+    return follow_up
+
+
+def start_run(project_id, user_id, task_id):
+    """Enqueue process_documents_task under task_id on the lane that fits the project's size.
+
+    task_id holds the lock. If the task can't be enqueued (e.g. the broker is
+    down) the lock is released rather than left to a run that never starts.
+    """
+    from .models import VectorDatabase
+    from .queues import choose_queue
+    from .tasks import process_documents_task
+
+    try:
+        vector_db = VectorDatabase.objects.get(project_id=project_id)
+        queue = choose_queue(vector_db)
+        process_documents_task.apply_async((project_id, user_id), task_id=task_id, queue=queue)
+    except Exception:
+        logger.exception(f"Could not queue processing of project {project_id}; releasing its ingestion lock")
+        follow_up = release(project_id, task_id)
+        if follow_up:
+            start_run(project_id, user_id, follow_up)
+        raise
+    logger.info(f"Queued processing of project {project_id} as {task_id} on {queue}")
+
+
+def request_run(project_id, user_id, has_new_documents):
+    """Start an ingestion run for the project, or coalesce with the one in flight.
+
+    `has_new_documents(started_at)` tells whether documents were added since
+    the running task started; only then is a follow-up queued.
+    Returns (task_id, state) with state 'started', 'running' or 'queued'.
+    """
+    task_id = str(uuid.uuid4())
+    if try_acquire(project_id, task_id):
+        start_run(project_id, user_id, task_id)
+        return task_id, 'started'
+
+    running_id, started_at = current_run(project_id)
+    if running_id is None:
+        # The run finished between our two reads; try again
+        return request_run(project_id, user_id, has_new_documents)
+    if not has_new_documents(started_at):
+        return running_id, 'running'
+
+    return queue_follow_up(project_id, user_id), 'queued'
+
+
+def queue_follow_up(project_id, user_id):
+    """Register the project's follow-up run, starting it at once if the lock was released meanwhile."""
+    follow_up = add_follow_up(project_id)
+    lock_key, pending_key = _keys(project_id)
+    claimed = get_redis().eval(_CLAIM_SCRIPT, 2, lock_key, pending_key, time.time(), settings.INGEST_LOCK_TTL)
+    if claimed:
+        start_run(project_id, user_id, claimed)
+    return follow_up
@@ -0,0 +1,43 @@
+import os
+import time
+from django.conf import settings
+from ...text_extraction import SUPPORTED_EXTENSIONS, extract_pages
+from ...vector_db_utils import documents_from_pages
+
+# Shared helpers for the benchmark commands; the leading underscore keeps
+# Django from treating this module as a command.
+
+
+def demo_folder():
+    return os.path.join(settings.BASE_DIR, 'demo')
+
+
+def load_corpora(folder=None):
+    """Return {project name: [LangChain documents]} for each project folder under folder."""
+    folder = folder or demo_folder()
+    corpora = {}
+    for name in sorted(os.listdir(folder)):
+        project_path = os.path.join(folder, name)
+        if not os.path.isdir(project_path):
+            continue
+        documents = []
+        for filename in sorted(os.listdir(project_path)):
+            if not filename.lower().endswith(SUPPORTED_EXTENSIONS):
+                continue
+            path = os.path.join(project_path, filename)
+            documents.extend(documents_from_pages(extract_pages(path), path))
+        if documents:
+            corpora[name] = documents
+    return corpora
+
+
+def best_of(repeat, func, *args, **kwargs):
+    """Run func `repeat` times and return (fastest seconds, last result)."""
+    best = None
+    result = None
+    for _ in range(max(1, repeat)):
+        started = time.perf_counter()
+        result = func(*args, **kwargs)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from ... import admission
+from ...ingest_lock import get_redis
+
+
+class Command(BaseCommand):
+    help = 'Show current admission-controlled load and the requests shed with 429, by scope, plan and reason'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Zero the shed counters after printing them')
+
+    def handle(self, *args, **options):
+        for scope, limits in settings.ADMISSION_GLOBAL_LIMITS.items():
+            active, queued = admission.current_load(scope)
+            self.stdout.write(f"{scope:>8}: {active}/{limits['concurrent']} active, {queued}/{limits['queued']} queued")
+
+        counts = admission.shed_counts()
+        if not counts:
+            self.stdout.write('No requests shed')
+        for (scope, plan, reason), count in sorted(counts.items()):
+            self.stdout.write(f"{scope:>8} {plan:>10} {reason:>10}: {count}")
+        if options['reset']:
+            get_redis().delete(admission.SHED_KEY)
@@ -0,0 +1,64 @@
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from ...vector_db_utils import (EMBEDDING_TOKEN_BUDGET, chunk_documents, get_embeddings, length_batches,
+                                load_model, token_lengths)
+from ._corpus import best_of, load_corpora
+
+
+def fixed_batch_embeddings(model, texts, batch_size=32):
+    # The previous get_embeddings: arrival order, a fixed number of chunks per encode() call
+    embeddings = []
+    for i in range(0, len(texts), batch_size):
+        embeddings.extend(model.encode(texts[i:i + batch_size], show_progress_bar=False))
+    return np.array(embeddings)
+
+
+def padding_efficiency(lengths, batches):
+    padded = sum(len(batch) * max(lengths[i] for i in batch) for batch in batches)
+    return sum(lengths) / padded if padded else 1.0
+
+
+class Command(BaseCommand):
+    help = 'Compare fixed-size and length-bucketed embedding batches on the demo corpora'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--folder', help='Folder of project subfolders (defaults to demo/)')
+        parser.add_argument('--model', default=settings.EMBEDDING_MODEL)
+        parser.add_argument('--chunk-unit', default=settings.CHUNK_UNIT)
+        parser.add_argument('--token-budget', type=int, default=EMBEDDING_TOKEN_BUDGET)
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per variant; the fastest is reported')
+
+    def handle(self, *args, **options):
+        model = load_model(options['model'])
+        corpora = load_corpora(options['folder'])
+        chunks = []
+        for name, documents in corpora.items():
+            project_chunks, params = chunk_documents(documents, model, options['chunk_unit'])
+            chunks.extend(project_chunks)
+            self.stdout.write(f"{name}: {len(project_chunks)} chunks")
+        texts = [chunk.page_content for chunk in chunks]
+        if not texts:
+            self.stdout.write('No chunks to embed')
+            return
+
+        # Warm up so neither variant pays for lazy initialisation
+        model.encode(texts[:8], show_progress_bar=False)
+
+        lengths = token_lengths(texts, model)
+        fixed_batches = [list(range(i, min(i + 32, len(texts)))) for i in range(0, len(texts), 32)]
+        bucketed_batches = length_batches(lengths, options['token_budget'])
+
+        fixed_seconds, fixed = best_of(options['repeat'], fixed_batch_embeddings, model, texts)
+        bucketed_seconds, bucketed = best_of(options['repeat'], get_embeddings, chunks, options['model'],
+                                             token_budget=options['token_budget'])
+
+        cosine = (fixed * bucketed).sum(axis=1) / (np.linalg.norm(fixed, axis=1) * np.linalg.norm(bucketed, axis=1))
+        self.stdout.write(f"{len(texts)} chunks, {sum(lengths)} tokens, {params['chunk_unit']} chunking")
+        for label, seconds, batches in (('fixed 32', fixed_seconds, fixed_batches),
+                                        ('bucketed', bucketed_seconds, bucketed_batches)):
+            self.stdout.write(
+                f"{label:>9}: {seconds:7.2f}s  {len(texts) / seconds:8.1f} chunks/s  "
+                f"{len(batches):4d} batches  {padding_efficiency(lengths, batches):.0%} of padded tokens used"
+            )
+        self.stdout.write(f"Speedup: {fixed_seconds / bucketed_seconds:.2f}x, min cosine vs fixed: {cosine.min():.6f}")
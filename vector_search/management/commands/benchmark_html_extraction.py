@@ -0,0 +1,115 @@
+import os
+import time
+import tempfile
+from collections import Counter
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from ... import crawler
+from ...text_extraction import html_to_text, normalize_text
+from ._corpus import best_of
+
+# A line found on at least this share of the pages is treated as site template
+TEMPLATE_LINE_SHARE = 0.5
+
+
+def unstructured_loader(path):
+    from langchain_community.document_loaders import UnstructuredHTMLLoader
+    return '\n\n'.join(doc.page_content for doc in UnstructuredHTMLLoader(path).load())
+
+
+def plain_get_text(path):
+    # What extract_html did before: every text node, nothing removed
+    from bs4 import BeautifulSoup
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        return normalize_text(BeautifulSoup(f, 'html.parser').get_text(separator='\n'))
+
+
+def boilerplate_free(path):
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        return html_to_text(f.read())
+
+
+EXTRACTORS = {
+    'UnstructuredHTMLLoader': unstructured_loader,
+    'bs4 get_text': plain_get_text,
+    'html_to_text': boilerplate_free,
+}
+
+
+def lines_of(text):
+    return {line.strip() for line in text.split('\n') if line.strip()}
+
+
+def words_of(text, skip_lines=()):
+    return {word.lower() for line in text.split('\n') if line.strip() not in skip_lines for word in line.split()}
+
+
+def template_lines(outputs):
+    """Lines repeated across many pages: navigation, footers, cookie banners."""
+    if len(outputs) < 3:
+        return set()
+    counts = Counter(line for text in outputs for line in lines_of(text))
+    return {line for line, count in counts.items() if count >= len(outputs) * TEMPLATE_LINE_SHARE}
+
+
+class Command(BaseCommand):
+    help = 'Compare UnstructuredHTMLLoader, plain BeautifulSoup text and html_to_text on HTML pages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--folder', help='Folder searched recursively for .html files (defaults to MEDIA_ROOT/documents)')
+        parser.add_argument('--url', action='append', default=[], help='Page to fetch and include; repeatable')
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per extractor; the fastest is reported')
+
+    def collect_paths(self, folder, urls, scratch):
+        paths = []
+        for root, _, files in os.walk(folder):
+            paths.extend(os.path.join(root, name) for name in sorted(files) if name.lower().endswith(('.html', '.htm')))
+        for result in crawler.crawl(urls):
+            if result.error or not result.is_html:
+                self.stderr.write(f"Skipping {result.url}: {result.error or 'not HTML'}")
+                continue
+            path = os.path.join(scratch, crawler.safe_filename_for_url(result.url))
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(result.content)
+            paths.append(path)
+        return paths
+
+    def handle(self, *args, **options):
+        folder = options['folder'] or os.path.join(settings.MEDIA_ROOT, 'documents')
+        with tempfile.TemporaryDirectory() as scratch:
+            paths = self.collect_paths(folder, options['url'], scratch)
+            if not paths:
+                raise CommandError(f'No HTML pages found under {folder} and no --url given')
+            self.stdout.write(f"{len(paths)} pages, {sum(os.path.getsize(p) for p in paths) / 1e6:.1f} MB of HTML")
+
+            results = {}
+            for name, extractor in EXTRACTORS.items():
+                started = time.perf_counter()
+                try:
+                    extractor(paths[0])
+                except ImportError as e:
+                    self.stdout.write(f"{name}: unavailable ({e})")
+                    continue
+                # The first call includes importing the extractor's dependencies
+                first_call = time.perf_counter() - started
+                seconds, outputs = best_of(options['repeat'], lambda: [extractor(path) for path in paths])
+                results[name] = (first_call, seconds, outputs)
+
+        # Word recall is measured per page against the first extractor that ran,
+        # ignoring its template lines; below 100% means text was dropped, which
+        # is the point for navigation but not for content.
+        baseline_name, (_, _, baseline) = next(iter(results.items()))
+        baseline_template = template_lines(baseline)
+        baseline_words = [words_of(text, baseline_template) for text in baseline]
+
+        for name, (first_call, seconds, outputs) in results.items():
+            template = template_lines(outputs)
+            chars = sum(len(text) for text in outputs)
+            template_chars = sum(len(line) for text in outputs for line in text.split('\n') if line.strip() in template)
+            recalls = [len(words_of(text) & reference) / len(reference)
+                       for text, reference in zip(outputs, baseline_words) if reference]
+            self.stdout.write(
+                f"{name:24} {len(paths) / seconds:8.1f} pages/s  first call {first_call:6.2f}s  "
+                f"{chars / len(paths):8.0f} chars/page  template lines {template_chars / chars if chars else 0:6.1%}  "
+                f"words kept vs {baseline_name} {sum(recalls) / len(recalls) if recalls else 1:6.1%}"
+            )
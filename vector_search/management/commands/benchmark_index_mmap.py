@@ -0,0 +1,131 @@
+import os
+import time
+import tempfile
+import statistics
+import multiprocessing
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from ...models import VectorDatabase
+
+
+def _memory_mb():
+    # Private (anonymous) pages are per process; file pages of a mapped index are shared
+    memory = {}
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(('RssAnon:', 'RssFile:')):
+                memory[line.split(':')[0]] = int(line.split()[1]) / 1024
+    return memory
+
+
+def _drop_page_cache(path):
+    # Evicts the file's clean pages without needing root, so the next read is cold
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+def _serve(path, mmap, queries, k, ready, results):
+    # One simulated web worker: load, answer one cold and many warm queries, then hold the index
+    import django
+    django.setup()
+    from vector_search.index_store import read_faiss_index
+
+    before = _memory_mb()
+    started = time.perf_counter()
+    index, mode = read_faiss_index(path, mmap=mmap)
+    load_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    index.search(queries[:1], k)
+    cold = time.perf_counter() - started
+    warm = []
+    for query in queries[1:]:
+        started = time.perf_counter()
+        index.search(query[None, :], k)
+        warm.append(time.perf_counter() - started)
+
+    after = _memory_mb()
+    results.put({
+        'mode': mode,
+        'load_seconds': load_seconds,
+        'cold_ms': cold * 1000,
+        'warm_p50_ms': statistics.median(warm) * 1000 if warm else None,
+        'private_mb': after['RssAnon'] - before['RssAnon'],
+        'shared_mb': after['RssFile'] - before['RssFile'],
+    })
+    # Keep the index alive until every worker has reported, as real workers would
+    ready.wait()
+
+
+class Command(BaseCommand):
+    help = 'Compare private and memory-mapped index loading across N worker processes: RSS and cold/warm query latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--project', help='Benchmark this project\'s current index instead of a synthetic one')
+        parser.add_argument('--vectors', type=int, default=200000, help='Size of the synthetic flat index')
+        parser.add_argument('--dimension', type=int, default=384)
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--queries', type=int, default=50)
+        parser.add_argument('-k', type=int, default=5)
+
+    def index_path(self, options, scratch):
+        if options['project']:
+            try:
+                vector_db = VectorDatabase.objects.get(project_id=options['project'])
+            except VectorDatabase.DoesNotExist:
+                raise CommandError(f"Project {options['project']} not found")
+            path = os.path.join(settings.MEDIA_ROOT, vector_db.index_file.name)
+            if not vector_db.index_file or not os.path.exists(path):
+                raise CommandError('The project has no index file')
+            return path
+
+        import faiss
+        index = faiss.IndexFlatL2(options['dimension'])
+        rng = np.random.default_rng(0)
+        for start in range(0, options['vectors'], 50000):
+            rows = min(50000, options['vectors'] - start)
+            index.add(rng.random((rows, options['dimension']), dtype='float32'))
+        path = os.path.join(scratch, 'faiss_index')
+        faiss.write_index(index, path)
+        return path
+
+    def run(self, path, mmap, options, queries):
+        context = multiprocessing.get_context('spawn')
+        ready = context.Event()
+        results = context.Queue()
+        _drop_page_cache(path)
+        workers = [context.Process(target=_serve, args=(path, mmap, queries, options['k'], ready, results))
+                   for _ in range(options['workers'])]
+        for worker in workers:
+            worker.start()
+        reports = [results.get() for _ in workers]
+        ready.set()
+        for worker in workers:
+            worker.join()
+        return reports
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as scratch:
+            path = self.index_path(options, scratch)
+            import faiss
+            dimension = faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY).d
+            queries = np.random.default_rng(1).random((options['queries'] + 1, dimension), dtype='float32')
+            size_mb = os.path.getsize(path) / 2 ** 20
+            self.stdout.write(f"Index {size_mb:.0f} MB on disk, {options['workers']} workers")
+
+            for label, mmap in (('private read', False), ('memory-mapped', True)):
+                reports = self.run(path, mmap, options, queries)
+                private = sum(r['private_mb'] for r in reports)
+                # Mapped pages are counted in every worker's RSS but exist once in the page cache
+                shared = max(r['shared_mb'] for r in reports) if mmap else 0
+                cold = sorted(r['cold_ms'] for r in reports)
+                warm = statistics.median(r['warm_p50_ms'] for r in reports if r['warm_p50_ms'] is not None)
+                self.stdout.write(
+                    f"{label:14} ({reports[0]['mode']:8}) total {private + shared:8.1f} MB "
+                    f"(private {private:.1f}, shared {shared:.1f})  load {max(r['load_seconds'] for r in reports):.2f}s  "
+                    f"cold query {cold[0]:.1f}-{cold[-1]:.1f} ms  warm p50 {warm:.2f} ms"
+                )
@@ -0,0 +1,87 @@
+import os
+import sys
+import json
+import subprocess
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Modules that must only be imported when a request or task actually embeds,
+# searches or parses documents.
+HEAVY_MODULES = ('torch', 'faiss', 'sentence_transformers', 'transformers', 'langchain',
+                 'langchain_community', 'unstructured', 'onnxruntime')
+
+# Each scenario runs in a fresh interpreter and reports on itself, so the
+# numbers are what a newly started process pays.
+_REPORT = """
+import sys, json, time, resource
+started = time.perf_counter()
+{body}
+print(json.dumps({{
+    'seconds': time.perf_counter() - started,
+    'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'heavy': sorted(m for m in {heavy!r} if m in sys.modules),
+}}))
+"""
+
+SCENARIOS = {
+    # What every manage.py invocation pays
+    'manage.py check': """
+import os, runpy
+sys.argv = ['manage.py', 'check']
+runpy.run_path('manage.py', run_name='__main__')
+""",
+    # Gunicorn worker boot: the WSGI app plus all URL routes and views
+    'web worker boot': """
+from vector_search_project.wsgi import application
+from django.urls import get_resolver
+get_resolver().url_patterns
+""",
+    # Celery worker boot: app configuration plus task module discovery
+    'celery worker boot': """
+import django
+django.setup()
+from vector_search_project.celery import app
+app.loader.import_default_modules()
+app.tasks['vector_search.tasks.process_documents_task']
+""",
+}
+
+
+class Command(BaseCommand):
+    help = 'Measure import time, peak RSS and heavy modules loaded by manage.py, web worker and Celery worker startup'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per scenario; the fastest is reported')
+        parser.add_argument('--max-seconds', type=float, help='Fail if any scenario takes longer')
+        parser.add_argument('--max-rss-mb', type=float, help='Fail if any scenario peaks above this RSS')
+        parser.add_argument('--allow-heavy', action='store_true',
+                            help="Don't fail when a scenario imports one of the heavy ML modules")
+
+    def run_scenario(self, body):
+        code = _REPORT.format(body=body, heavy=HEAVY_MODULES)
+        result = subprocess.run([sys.executable, '-c', code], cwd=settings.BASE_DIR, env=os.environ.copy(),
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            raise CommandError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'scenario failed')
+        # manage.py check prints its own message before the report
+        return json.loads(result.stdout.strip().splitlines()[-1])
+
+    def handle(self, *args, **options):
+        failures = []
+        for name, body in SCENARIOS.items():
+            runs = [self.run_scenario(body) for _ in range(max(1, options['repeat']))]
+            seconds = min(run['seconds'] for run in runs)
+            rss_mb = min(run['rss_mb'] for run in runs)
+            heavy = runs[-1]['heavy']
+            self.stdout.write(f"{name:20} {seconds:6.2f}s  peak RSS {rss_mb:7.1f} MB  "
+                              f"heavy modules: {', '.join(heavy) or 'none'}")
+
+            if heavy and not options['allow_heavy']:
+                failures.append(f"{name} imported {', '.join(heavy)}")
+            if options['max_seconds'] is not None and seconds > options['max_seconds']:
+                failures.append(f"{name} took {seconds:.2f}s")
+            if options['max_rss_mb'] is not None and rss_mb > options['max_rss_mb']:
+                failures.append(f"{name} peaked at {rss_mb:.1f} MB")
+
+        if failures:
+            raise CommandError('Startup regression: ' + '; '.join(failures))
@@ -0,0 +1,96 @@
+import time
+import faiss
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from ...embedding_backends import BACKEND_ONNX, BACKEND_ONNX_INT8, BACKEND_TORCH, BACKENDS
+from ...vector_db_utils import chunk_documents, get_embeddings, load_encoder, load_model
+from ._corpus import best_of, load_corpora
+
+
+def cosine(first, second):
+    return (first * second).sum(axis=1) / (np.linalg.norm(first, axis=1) * np.linalg.norm(second, axis=1))
+
+
+def sample_queries(chunks, count, words=12):
+    # Opening words of evenly spaced chunks stand in for user questions
+    step = max(1, len(chunks) // count)
+    return [' '.join(chunk.page_content.split()[:words]) for chunk in chunks[::step][:count]]
+
+
+def search(embeddings, query_embeddings, k):
+    index = faiss.IndexFlatL2(embeddings.shape[1])
+    index.add(np.ascontiguousarray(embeddings, dtype='float32'))
+    return index.search(np.ascontiguousarray(query_embeddings, dtype='float32'), k)[1]
+
+
+def query_latency(encoder, queries):
+    timings = []
+    for query in queries:
+        started = time.perf_counter()
+        encoder.encode([query])
+        timings.append((time.perf_counter() - started) * 1000)
+    return np.percentile(timings, 50), np.percentile(timings, 95)
+
+
+class Command(BaseCommand):
+    help = 'Check ONNX embedding backends against torch (cosine, retrieval recall) and compare latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--folder', help='Folder of project subfolders (defaults to demo/)')
+        parser.add_argument('--model', default=settings.EMBEDDING_MODEL)
+        parser.add_argument('--backends', nargs='+', choices=BACKENDS, default=[BACKEND_ONNX, BACKEND_ONNX_INT8])
+        parser.add_argument('--queries', type=int, default=20, help='Queries per project')
+        parser.add_argument('-k', type=int, default=5)
+        parser.add_argument('--min-cosine', type=float, default=0.99)
+        parser.add_argument('--min-recall', type=float, default=0.9)
+        parser.add_argument('--repeat', type=int, default=1)
+
+    def handle(self, *args, **options):
+        model_name = options['model']
+        k = options['k']
+        backends = [BACKEND_TORCH] + [b for b in options['backends'] if b != BACKEND_TORCH]
+        encoders = {backend: load_encoder(model_name, backend) for backend in backends}
+
+        projects = []
+        for name, documents in load_corpora(options['folder']).items():
+            chunks, _ = chunk_documents(documents, load_model(model_name))
+            projects.append((name, chunks, sample_queries(chunks, options['queries'])))
+        all_queries = [query for _, _, queries in projects for query in queries]
+        num_chunks = sum(len(chunks) for _, chunks, _ in projects)
+
+        results = {}
+        for backend in backends:
+            seconds = 0.0
+            embeddings = {}
+            for name, chunks, queries in projects:
+                elapsed, embeddings[name] = best_of(options['repeat'], get_embeddings, chunks, model_name,
+                                                    backend=backend)
+                seconds += elapsed
+            query_embeddings = {name: encoders[backend].encode(queries) for name, _, queries in projects}
+            p50, p95 = query_latency(encoders[backend], all_queries)
+            results[backend] = (embeddings, query_embeddings, seconds, p50, p95)
+
+        reference_embeddings, reference_queries, torch_seconds = results[BACKEND_TORCH][:3]
+        self.stdout.write(f"{num_chunks} chunks and {len(all_queries)} queries over {len(projects)} projects, k={k}")
+        failures = []
+        for backend in backends:
+            embeddings, query_embeddings, seconds, p50, p95 = results[backend]
+            line = (f"{backend:>9}: ingest {num_chunks / seconds:7.1f} chunks/s ({torch_seconds / seconds:.2f}x)  "
+                    f"query p50 {p50:6.2f}ms p95 {p95:6.2f}ms")
+            if backend != BACKEND_TORCH:
+                cosines = np.concatenate([cosine(reference_embeddings[name], embeddings[name]) for name, _, _ in projects])
+                hits = 0
+                for name, _, _ in projects:
+                    expected = search(reference_embeddings[name], reference_queries[name], k)
+                    found = search(embeddings[name], query_embeddings[name], k)
+                    hits += sum(len(set(e) & set(f)) for e, f in zip(expected, found))
+                recall = hits / (len(all_queries) * k)
+                line += f"  cosine min {cosines.min():.4f} mean {cosines.mean():.4f}  recall@{k} {recall:.3f}"
+                if cosines.min() < options['min_cosine'] or recall < options['min_recall']:
+                    failures.append(backend)
+            self.stdout.write(line)
+
+        if failures:
+            raise CommandError(f"Parity check failed for {', '.join(failures)}")
+        self.stdout.write(self.style.SUCCESS('Parity check passed'))
@@ -0,0 +1,55 @@
+import uuid
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from ... import ingest_lock, shared_index
+from ...models import VectorDatabase
+
+
+class Command(BaseCommand):
+    help = ('Move small projects that still have index files of their own into the shared index shards, '
+            'without re-embedding; new builds are placed there automatically')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--project', action='append', default=[], help='Project to move; repeatable. Default: every small project')
+        parser.add_argument('--dry-run', action='store_true', help='Only list the projects that would move')
+        parser.add_argument('--list', action='store_true', help='Only show the shards on this node')
+
+    def handle(self, *args, **options):
+        if options['list']:
+            for shard, version, projects, vectors, size in shared_index.shard_stats():
+                self.stdout.write(f"{shard}: version {version}, {projects} projects, {vectors} vectors, {size / 2 ** 20:.1f} MB")
+            return
+        if not shared_index.enabled():
+            raise CommandError('The shared index is disabled (SHARED_INDEX_ENABLED, or INDEX_STORAGE_BACKEND is set)')
+
+        projects = (VectorDatabase.objects.filter(shared_shard='', num_chunks__gt=0, num_chunks__lte=settings.SHARED_INDEX_MAX_CHUNKS)
+                    .exclude(index_file=''))
+        if options['project']:
+            projects = projects.filter(project_id__in=options['project'])
+
+        moved = 0
+        for vector_db in projects:
+            if options['dry_run']:
+                self.stdout.write(f"{vector_db.project_id}: {vector_db.num_chunks} chunks")
+                continue
+            # Holds the project's ingestion lock so the move never races a build
+            run_id = f'consolidate-{uuid.uuid4().hex}'
+            if not ingest_lock.try_acquire(vector_db.project_id, run_id):
+                self.stdout.write(f"{vector_db.project_id}: being processed, skipped")
+                continue
+            try:
+                version = shared_index.consolidate(vector_db)
+            except Exception as e:
+                self.stderr.write(f"{vector_db.project_id}: {str(e)}")
+                continue
+            finally:
+                follow_up = ingest_lock.release(vector_db.project_id, run_id)
+                if follow_up:
+                    ingest_lock.start_run(vector_db.project_id, vector_db.user_id, follow_up)
+            if version is None:
+                self.stdout.write(f"{vector_db.project_id}: not a flat index, skipped")
+                continue
+            moved += 1
+            self.stdout.write(f"{vector_db.project_id}: moved to {vector_db.shared_shard} version {version}")
+        if not options['dry_run']:
+            self.stdout.write(f"Moved {moved} projects")
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+from ... import bundles
+from ...models import VectorDatabase
+
+
+class Command(BaseCommand):
+    help = 'Export a project (index vectors, chunks, manifest and optionally its source documents) as a single bundle file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('project_id')
+        parser.add_argument('output', nargs='?', help=f'Defaults to project_<id>{bundles.BUNDLE_EXTENSION}')
+        parser.add_argument('--no-sources', action='store_true', help='Leave out the source documents')
+
+    def handle(self, *args, **options):
+        try:
+            vector_db = VectorDatabase.objects.get(project_id=options['project_id'])
+        except VectorDatabase.DoesNotExist:
+            raise CommandError(f"Project {options['project_id']} not found")
+        output = options['output'] or f'project_{vector_db.project_id}{bundles.BUNDLE_EXTENSION}'
+        try:
+            with open(output, 'wb') as f:
+                size = bundles.export_bundle(vector_db, f, include_sources=not options['no_sources'])
+        except (bundles.BundleError, FileNotFoundError) as e:
+            raise CommandError(str(e))
+        self.stdout.write(f"Wrote {output} ({size / 2 ** 20:.1f} MB)")
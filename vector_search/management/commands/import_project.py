@@ -0,0 +1,25 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from ... import bundles
+
+
+class Command(BaseCommand):
+    help = 'Create a project for a user from a bundle written by export_project, without re-embedding'
+
+    def add_arguments(self, parser):
+        parser.add_argument('bundle')
+        parser.add_argument('--user', required=True, help='Username of the new project\'s owner')
+        parser.add_argument('--name', help='Name for the new project instead of the exported one')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['user']} not found")
+        try:
+            with open(options['bundle'], 'rb') as f:
+                vector_db = bundles.import_bundle(f, user, name=options['name'])
+        except (bundles.BundleError, FileNotFoundError) as e:
+            raise CommandError(str(e))
+        self.stdout.write(f"Imported project {vector_db.project_id} ({vector_db.name}): "
+                          f"{vector_db.num_documents} documents, {vector_db.num_chunks} chunks")
@@ -0,0 +1,34 @@
+import math
+from datetime import datetime, timezone
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from ... import access_stats
+from ...warmup import prewarm
+
+
+class Command(BaseCommand):
+    help = ("Load the hottest projects' indexes and models. Run on deploy to fill this node's artifact cache, "
+            "page cache and model files before traffic arrives; Gunicorn workers warm their own memory with "
+            "PREWARM_ON_START.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=settings.PREWARM_TOP_PROJECTS)
+        parser.add_argument('--memory-mb', type=int, default=settings.PREWARM_MEMORY_MB)
+        parser.add_argument('--list', action='store_true', help='Only show the ranking and access stats')
+
+    def handle(self, *args, **options):
+        if options['list']:
+            ranked = access_stats.hottest(options['top'])
+            scores = access_stats.hotness(ranked)
+            # Scores are log2: show each relative to the hottest
+            top_score = max(scores.values(), default=0.0)
+            for project_id in ranked:
+                stats = access_stats.project_stats(project_id)
+                last = (datetime.fromtimestamp(stats['last_access'], timezone.utc).isoformat(timespec='seconds')
+                        if stats['last_access'] else 'never')
+                relative = 2 ** (scores[project_id] - top_score) if scores[project_id] > -math.inf else 0.0
+                self.stdout.write(f"{project_id}: {stats['queries']} queries, last {last}, hotness {relative:.3f}")
+            return
+
+        for project_id, size, seconds in prewarm(options['top'], options['memory_mb'] * 1024 * 1024):
+            self.stdout.write(f"{project_id}: {size / 2 ** 20:.1f} MB in {seconds:.2f}s")
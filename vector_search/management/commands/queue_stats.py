@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from ...queues import QUEUE_BULK, QUEUE_FAST, queue_wait_stats
+
+
+class Command(BaseCommand):
+    help = 'Show recorded queue-wait times for the ingestion queues'
+
+    def add_arguments(self, parser):
+        parser.add_argument('queues', nargs='*', default=[QUEUE_FAST, QUEUE_BULK, 'celery'])
+
+    def handle(self, *args, **options):
+        for queue in options['queues']:
+            stats = queue_wait_stats(queue)
+            if not stats['count']:
+                self.stdout.write(f"{queue:>12}: no samples")
+                continue
+            self.stdout.write(f"{queue:>12}: {stats['count']} tasks, p50 {stats['p50_seconds']:.2f}s, p95 {stats['p95_seconds']:.2f}s")
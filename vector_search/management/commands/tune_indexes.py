@@ -0,0 +1,55 @@
+import uuid
+from django.core.management.base import BaseCommand, CommandError
+from ... import ingest_lock
+from ...index_tuner import tune
+from ...models import VectorDatabase
+from ...queues import QUEUE_BULK
+from ...tasks import tune_index_task
+
+
+class Command(BaseCommand):
+    help = ('Pick each project\'s index type and search parameters (flat, IVF, HNSW, IVF-PQ) as the fastest '
+            'that reaches the recall target, measured on the project\'s own vectors')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--project', action='append', default=[], help='Project to tune; repeatable. Default: every project with an index')
+        parser.add_argument('--min-chunks', type=int, default=0, help='Skip projects with fewer chunks')
+        parser.add_argument('--recall', type=float, help='recall@k target instead of INDEX_TUNE_RECALL')
+        parser.add_argument('--dry-run', action='store_true', help='Measure and report here without storing the choice')
+        parser.add_argument('--sync', action='store_true', help='Tune here instead of queueing a task per project')
+
+    def handle(self, *args, **options):
+        projects = VectorDatabase.objects.exclude(index_file='').filter(num_chunks__gte=options['min_chunks'])
+        if options['project']:
+            projects = projects.filter(project_id__in=options['project'])
+            if not projects:
+                raise CommandError('No matching project with an index')
+
+        for vector_db in projects:
+            if not (options['dry_run'] or options['sync']):
+                task = tune_index_task.apply_async((vector_db.project_id, options['recall']), queue=QUEUE_BULK)
+                self.stdout.write(f"{vector_db.project_id}: queued {task.id}")
+                continue
+
+            if options['dry_run']:
+                report = tune(vector_db, recall_target=options['recall'], apply=False)
+            else:
+                # Holds the project's ingestion lock, as tune_index_task does, so a re-index never races a build
+                run_id = f'tune-{uuid.uuid4().hex}'
+                if not ingest_lock.try_acquire(vector_db.project_id, run_id):
+                    self.stdout.write(f"{vector_db.project_id}: being processed, skipped")
+                    continue
+                try:
+                    report = tune(vector_db, recall_target=options['recall'])
+                finally:
+                    follow_up = ingest_lock.release(vector_db.project_id, run_id)
+                    if follow_up:
+                        ingest_lock.start_run(vector_db.project_id, vector_db.user_id, follow_up)
+            self.stdout.write(f"{vector_db.project_id}: {report['num_vectors']} vectors, "
+                              f"recall@{report['k']} target {report['recall_target']}"
+                              f"{' (measured on a sample)' if report['sampled'] else ''}")
+            for result in report['results']:
+                marker = '*' if result is report['chosen'] else ' '
+                self.stdout.write(f"  {marker} {result['index_factory']:18} {str(result['search_params']):20} "
+                                  f"recall {result['recall']:.3f}  p50 {result['p50_ms']:7.3f} ms  "
+                                  f"{result['bytes'] / 2 ** 20:8.1f} MB  build {result['build_seconds']:.1f}s")
@@ -0,0 +1,28 @@
+import time
+import logging
+
+logger = logging.getLogger('vector_search')
+
+
+class RequestTimingMiddleware:
+    """Report total, authentication and admission wait time per request as a Server-Timing header and a log line.
+
+    Authentication runs inside the DRF view; the auth classes in
+    authentication.py add their time to request.auth_seconds, and
+    AdmissionControlMixin its queue wait to request.admission_seconds.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        response = self.get_response(request)
+        total_ms = (time.perf_counter() - started) * 1000
+        auth_ms = getattr(request, 'auth_seconds', 0.0) * 1000
+        admission_ms = getattr(request, 'admission_seconds', 0.0) * 1000
+
+        response['Server-Timing'] = f'auth;dur={auth_ms:.1f}, admission;dur={admission_ms:.1f}, total;dur={total_ms:.1f}'
+        logger.info(f"{request.method} {request.path} {response.status_code} total={total_ms:.1f}ms "
+                    f"auth={auth_ms:.1f}ms admission={admission_ms:.1f}ms")
+        return response
@@ -0,0 +1,113 @@
+# Generated by Django 4.2.16 on 2026-10-19 13:23
+
+import os
+import pickle
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+import vector_search.models
+
+
+def count_chunks(index_path, chunks_path):
+    """Vectors in the index, read from its header, else the length of the chunks file; 0 if neither can be read."""
+    try:
+        import faiss
+    except ImportError:
+        faiss = None
+    if faiss is not None and index_path and os.path.isfile(index_path):
+        # Memory-mapped, so only the pages touched are read, not the whole index
+        flags = [getattr(faiss, 'IO_FLAG_MMAP_IFC', faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY, faiss.IO_FLAG_MMAP, 0]
+        for flag in flags:
+            try:
+                return faiss.read_index(index_path, flag).ntotal
+            except RuntimeError:
+                continue
+    if chunks_path and os.path.isfile(chunks_path):
+        try:
+            with open(chunks_path, 'rb') as f:
+                return len(pickle.load(f))
+        except Exception:
+            # Unreadable, or LangChain is not installed
+            pass
+    return 0
+
+
+def backfill_stats(apps, schema_editor):
+    Document = apps.get_model('vector_search', 'Document')
+    VectorDatabase = apps.get_model('vector_search', 'VectorDatabase')
+
+    for doc in Document.objects.exclude(file='').iterator():
+        path = os.path.join(settings.MEDIA_ROOT, doc.file.name)
+        if os.path.isfile(path):
+            Document.objects.filter(pk=doc.pk).update(file_size=os.path.getsize(path))
+
+    for vector_db in VectorDatabase.objects.all().iterator():
+        stats = Document.objects.filter(vector_database_id=vector_db.pk).aggregate(
+            num_documents=Count('document_id'),
+            total_bytes=Sum('file_size'),
+        )
+        index_path = os.path.join(settings.MEDIA_ROOT, vector_db.index_file.name) if vector_db.index_file else None
+        chunks_path = os.path.join(settings.MEDIA_ROOT, vector_db.chunks_file.name) if vector_db.chunks_file else None
+        VectorDatabase.objects.filter(pk=vector_db.pk).update(
+            num_documents=stats['num_documents'],
+            num_chunks=count_chunks(index_path, chunks_path),
+            total_bytes=stats['total_bytes'] or 0,
+            index_size=os.path.getsize(index_path) if index_path and os.path.isfile(index_path) else 0,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vector_search', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='file_size',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='vectordatabase',
+            name='approvedDomains',
+            field=models.TextField(default=''),
+        ),
+        migrations.AddField(
+            model_name='vectordatabase',
+            name='description',
+            field=models.TextField(default=''),
+        ),
+        migrations.AddField(
+            model_name='vectordatabase',
+            name='index_size',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='vectordatabase',
+            name='introPrompt',
+            field=models.TextField(default="I'm a helpful assistant. How can I help you today?"),
+        ),
+        migrations.AddField(
+            model_name='vectordatabase',
+            name='num_chunks',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='vectordatabase',
+            name='num_documents',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='vectordatabase',
+            name='total_bytes',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='document',
+            name='file',
+            field=models.FileField(max_length=255, upload_to=vector_search.models.user_directory_path),
+        ),
+        migrations.RunPython(backfill_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.16 on 2026-10-19 13:25
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import vector_search.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('vector_search', '0002_project_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=64),
+        ),
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('upload_id', models.CharField(default=vector_search.models.upload_session_id, editable=False, max_length=32, primary_key=True, serialize=False)),
+                ('filename', models.CharField(max_length=255)),
+                ('total_size', models.BigIntegerField()),
+                ('received_bytes', models.BigIntegerField(default=0)),
+                ('expected_hash', models.CharField(blank=True, default='', max_length=64)),
+                ('content_hash', models.CharField(blank=True, default='', max_length=64)),
+                ('status', models.CharField(choices=[('uploading', 'Uploading'), ('complete', 'Complete'), ('failed', 'Failed')], default='uploading', max_length=16)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('document', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='vector_search.document')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('vector_database', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='vector_search.vectordatabase')),
+            ],
+        ),
+    ]
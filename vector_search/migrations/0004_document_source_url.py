@@ -0,0 +1,28 @@
+# Generated by Django 4.2.16 on 2026-10-19 13:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vector_search', '0003_chunked_uploads'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='etag',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='last_modified',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='source_url',
+            field=models.URLField(blank=True, default='', max_length=2048),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.16 on 2026-10-19 13:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vector_search', '0004_document_source_url'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='page_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='text_length',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-19 13:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vector_search', '0005_document_text_artifact'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vectordatabase',
+            name='index_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
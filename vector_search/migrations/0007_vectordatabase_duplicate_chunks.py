@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-19 13:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vector_search', '0006_vectordatabase_index_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vectordatabase',
+            name='duplicate_chunks',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
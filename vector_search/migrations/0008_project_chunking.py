@@ -0,0 +1,45 @@
+# Generated by Django 4.2.16 on 2026-10-19 13:33
+
+from django.db import migrations, models
+
+
+def pin_existing_projects(apps, schema_editor):
+    # Projects indexed before this change were built with 1000/200 character chunks
+    VectorDatabase = apps.get_model('vector_search', 'VectorDatabase')
+    VectorDatabase.objects.exclude(index_file='').update(
+        embedding_model='all-MiniLM-L6-v2',
+        chunk_unit='characters',
+        chunk_size=1000,
+        chunk_overlap=200,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vector_search', '0007_vectordatabase_duplicate_chunks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vectordatabase',
+            name='chunk_overlap',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='vectordatabase',
+            name='chunk_size',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='vectordatabase',
+            name='chunk_unit',
+            field=models.CharField(blank=True, default='', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='vectordatabase',
+            name='embedding_model',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.RunPython(pin_existing_projects, migrations.RunPython.noop),
+    ]
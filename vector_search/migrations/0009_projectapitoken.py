@@ -0,0 +1,30 @@
+# Generated by Django 4.2.16 on 2026-10-19 15:02
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import vector_search.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('vector_search', '0008_project_chunking'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProjectAPIToken',
+            fields=[
+                ('token_id', models.CharField(default=vector_search.models.short_uuid, editable=False, max_length=8, primary_key=True, serialize=False)),
+                ('name', models.CharField(blank=True, default='', max_length=255)),
+                ('prefix', models.CharField(max_length=16)),
+                ('key_hash', models.CharField(max_length=64, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('vector_database', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='api_tokens', to='vector_search.vectordatabase')),
+            ],
+        ),
+    ]
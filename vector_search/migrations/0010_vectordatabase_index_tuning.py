@@ -0,0 +1,28 @@
+# Generated by Django 4.2.16 on 2026-10-19 14:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vector_search', '0009_projectapitoken'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vectordatabase',
+            name='index_factory',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='vectordatabase',
+            name='search_params',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='vectordatabase',
+            name='tuned_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-19 14:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vector_search', '0010_vectordatabase_index_tuning'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vectordatabase',
+            name='shared_shard',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=64),
+        ),
+    ]
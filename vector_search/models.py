@@ -1,7 +1,12 @@
-from django.db import models
+from django.db import models, transaction
+from django.conf import settings
 from django.contrib.auth.models import User
 import uuid
 import os
+import shutil
+import hashlib
+import secrets
+from django.db.models import Count, Sum
 from django.db.models.signals import post_delete
 from django.dispatch import receiver
 
@@ -20,10 +25,37 @@ class Document(models.Model):
     uploaded_at = models.DateTimeField(auto_now_add=True)
     processed = models.BooleanField(default=False)
     vector_database = models.ForeignKey('VectorDatabase', on_delete=models.CASCADE, null=True, blank=True)
+    file_size = models.BigIntegerField(default=0)
+    # SHA-256 of the file contents, used to deduplicate uploads
+    content_hash = models.CharField(max_length=64, blank=True, default='', db_index=True)
+    # Scraped pages remember their origin and HTTP validators for conditional re-fetch
+    source_url = models.URLField(max_length=2048, blank=True, default='')
+    etag = models.CharField(max_length=255, blank=True, default='')
+    last_modified = models.CharField(max_length=64, blank=True, default='')
+    # Set once the normalized text artifact has been extracted (see text_extraction)
+    text_length = models.PositiveIntegerField(null=True, blank=True)
+    page_count = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return f"{self.user.username} - {self.file.name} : {self.uploaded_at}"
 
+    @property
+    def text_artifact_path(self):
+        # Keyed by content hash so deduplicated documents share one extraction.
+        # Callers add the .txt / .json suffix.
+        if not self.content_hash:
+            return None
+        return os.path.join(settings.MEDIA_ROOT, 'text', f'user_{self.user_id}', self.content_hash)
+
+    def save(self, *args, **kwargs):
+        # Record the size once so listings never have to stat the file
+        if self.file and not self.file_size:
+            try:
+                self.file_size = self.file.size
+            except (OSError, ValueError):
+                self.file_size = 0
+        super(Document, self).save(*args, **kwargs)
+
     def delete(self, *args, **kwargs):
         self.delete_file()
         super(Document, self).delete(*args, **kwargs)
@@ -32,10 +64,23 @@ class Document(models.Model):
         if self.file:
             if os.path.isfile(self.file.path):
                 os.remove(self.file.path)
+        self.delete_text_artifact()
+
+    def delete_text_artifact(self):
+        base_path = self.text_artifact_path
+        if not base_path:
+            return
+        if Document.objects.filter(user_id=self.user_id, content_hash=self.content_hash).exclude(pk=self.pk).exists():
+            return
+        for suffix in ('.txt', '.json'):
+            if os.path.isfile(base_path + suffix):
+                os.remove(base_path + suffix)
 
 @receiver(post_delete, sender=Document)
 def delete_document_file(sender, instance, **kwargs):
     instance.delete_file()
+    if instance.vector_database_id:
+        refresh_project_stats(instance.vector_database_id)
 
 class VectorDatabase(models.Model):
     project_id = models.CharField(max_length=8, primary_key=True, default=short_uuid, editable=False)
@@ -49,19 +94,72 @@ class VectorDatabase(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     documents = models.ManyToManyField(Document, related_name='vector_databases')
+    # Denormalized stats, kept current at upload, ingest and delete time
+    num_documents = models.PositiveIntegerField(default=0)
+    num_chunks = models.PositiveIntegerField(default=0)
+    total_bytes = models.BigIntegerField(default=0)
+    index_size = models.BigIntegerField(default=0)
+    duplicate_chunks = models.PositiveIntegerField(default=0)  # Near-duplicates dropped at the last ingest
+    # Fixed at the first ingest so re-ingests and queries use the same model and chunking
+    embedding_model = models.CharField(max_length=255, blank=True, default='')
+    chunk_unit = models.CharField(max_length=16, blank=True, default='')
+    chunk_size = models.PositiveIntegerField(null=True, blank=True)
+    chunk_overlap = models.PositiveIntegerField(null=True, blank=True)
+    # Bumped on every publish; 0 means the legacy unversioned layout
+    index_version = models.PositiveIntegerField(default=0)
+    # Chosen by the index tuner (tune_indexes); blank/empty means the INDEX_FACTORY and INDEX_NPROBE defaults
+    index_factory = models.CharField(max_length=255, blank=True, default='')
+    search_params = models.JSONField(default=dict, blank=True)
+    tuned_at = models.DateTimeField(null=True, blank=True)
+    # Set while the project's vectors live in a shared index shard instead of index_file (see shared_index);
+    # index_version is then the shard's version
+    shared_shard = models.CharField(max_length=64, blank=True, default='', db_index=True)
 
     def __str__(self):
         return f"{self.user.username} - {self.name} : {self.created_at}"
 
-    def delete(self, *args, **kwargs):
-        self.delete_files()
-        super(VectorDatabase, self).delete(*args, **kwargs)
+    @property
+    def model_name(self):
+        return self.embedding_model or settings.EMBEDDING_MODEL
 
+    @property
+    def index_root(self):
+        return os.path.join(settings.MEDIA_ROOT, 'documents', f'user_{self.user_id}', f'project_{self.project_id}', 'index')
+
+    def refresh_document_stats(self):
+        stats = refresh_project_stats(self.project_id)
+        self.num_documents = stats['num_documents']
+        self.total_bytes = stats['total_bytes']
+        return stats
+
+    # Files are removed by the post_delete signal below, once per deleted row
     def delete_files(self):
         for field in [self.index_file, self.chunks_file]:
             if field:
                 if os.path.isfile(field.path):
                     os.remove(field.path)
+        if os.path.isdir(self.index_root):
+            shutil.rmtree(self.index_root, ignore_errors=True)
+        from .index_store import delete_published
+        from .access_stats import forget
+        delete_published(self)
+        if self.shared_shard:
+            # Rewriting the shard copies all of it, so it's left to a worker; until then
+            # the project's rows are only unused (no row points at them any more)
+            from .tasks import prune_shard_task
+            shard = self.shared_shard
+            transaction.on_commit(lambda: prune_shard_task.delay(shard))
+        forget(self.project_id)
+
+def refresh_project_stats(project_id):
+    # One aggregate query plus one UPDATE; avoids touching updated_at
+    stats = Document.objects.filter(vector_database_id=project_id).aggregate(
+        num_documents=Count('document_id'),
+        total_bytes=Sum('file_size'),
+    )
+    stats['total_bytes'] = stats['total_bytes'] or 0
+    VectorDatabase.objects.filter(project_id=project_id).update(**stats)
+    return stats
 
 @receiver(post_delete, sender=VectorDatabase)
 def delete_vector_database_files(sender, instance, **kwargs):
@@ -75,4 +173,84 @@ def delete_user_files(sender, instance, **kwargs):
     
     # Delete VectorDatabase files
     for vector_db in VectorDatabase.objects.filter(user=instance):
-        vector_db.delete_files()
\ No newline at end of file
+        vector_db.delete_files()
+
+def upload_session_id():
+    return uuid.uuid4().hex
+
+class UploadSession(models.Model):
+    STATUS_UPLOADING = 'uploading'
+    STATUS_COMPLETE = 'complete'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_UPLOADING, 'Uploading'),
+        (STATUS_COMPLETE, 'Complete'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    upload_id = models.CharField(max_length=32, primary_key=True, default=upload_session_id, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    vector_database = models.ForeignKey(VectorDatabase, on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255)
+    total_size = models.BigIntegerField()
+    received_bytes = models.BigIntegerField(default=0)
+    # Optional client-declared SHA-256, checked against the hash computed while streaming
+    expected_hash = models.CharField(max_length=64, blank=True, default='')
+    content_hash = models.CharField(max_length=64, blank=True, default='')
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_UPLOADING)
+    document = models.ForeignKey(Document, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user.username} - {self.filename} : {self.received_bytes}/{self.total_size}"
+
+    @property
+    def part_path(self):
+        return os.path.join(settings.MEDIA_ROOT, 'uploads', f'user_{self.user_id}', f'{self.upload_id}.part')
+
+    def delete_part(self):
+        if os.path.isfile(self.part_path):
+            os.remove(self.part_path)
+
+@receiver(post_delete, sender=UploadSession)
+def delete_upload_session_part(sender, instance, **kwargs):
+    instance.delete_part()
+
+API_TOKEN_PREFIX = 'qq_'
+
+class ProjectAPIToken(models.Model):
+    """A machine-client credential that can only query its own project.
+
+    Only the SHA-256 of the key is stored; the key itself is shown once, when
+    the token is created.
+    """
+    token_id = models.CharField(max_length=8, primary_key=True, default=short_uuid, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    vector_database = models.ForeignKey(VectorDatabase, on_delete=models.CASCADE, related_name='api_tokens')
+    name = models.CharField(max_length=255, blank=True, default='')
+    # First characters of the key, so listings can tell tokens apart
+    prefix = models.CharField(max_length=16)
+    key_hash = models.CharField(max_length=64, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.user.username} - {self.vector_database_id} : {self.prefix}"
+
+    @staticmethod
+    def hash_key(key):
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def issue(cls, vector_db, name=''):
+        """Create a token for the project; returns (token, key)."""
+        key = API_TOKEN_PREFIX + secrets.token_urlsafe(32)
+        token = cls.objects.create(
+            user_id=vector_db.user_id,
+            vector_database=vector_db,
+            name=name,
+            prefix=key[:len(API_TOKEN_PREFIX) + 6],
+            key_hash=cls.hash_key(key),
+        )
+        return token, key
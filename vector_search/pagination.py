@@ -0,0 +1,15 @@
+from rest_framework.pagination import CursorPagination
+
+
+class ProjectCursorPagination(CursorPagination):
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    ordering = ('-created_at', '-project_id')
+
+
+class DocumentCursorPagination(CursorPagination):
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    ordering = ('-uploaded_at', '-document_id')
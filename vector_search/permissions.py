@@ -0,0 +1,14 @@
+from rest_framework.permissions import BasePermission
+from .models import ProjectAPIToken
+
+
+class ProjectTokenScope(BasePermission):
+    """Keep requests authenticated with a ProjectAPIToken to the token's own project."""
+    message = 'This API token is not valid for this project.'
+
+    def has_permission(self, request, view):
+        if not isinstance(request.auth, ProjectAPIToken):
+            return True
+        project_id = request.data.get('project_id') or request.query_params.get('project_id')
+        return project_id == request.auth.vector_database_id
+
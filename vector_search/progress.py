@@ -0,0 +1,177 @@
+import json
+import time
+import uuid
+import hashlib
+import secrets
+import logging
+import threading
+from django.conf import settings
+from .ingest_lock import get_redis
+
+logger = logging.getLogger('vector_search')
+
+# Task state changes are published on a per-task channel and the latest one is
+# also stored, so a client that subscribes late still starts from the current
+# state instead of waiting for the next change.
+CHANNEL = 'task:progress:{task_id}'
+LAST_KEY = 'task:progress:last:{task_id}'
+# Open streams by id, scored by when they expire unless renewed: a worker that
+# is killed mid-stream drops out of the count instead of leaving it inflated
+CONNECTIONS_KEY = 'metrics:sse_streams'
+# Stream tickets by hash: a stream URL carries one of these instead of an
+# access token, so what ends up in access logs can't be replayed
+TICKET_KEY = 'task:progress:ticket:{digest}'
+TERMINAL_STATES = ('SUCCESS', 'FAILURE', 'REVOKED')
+
+_local_connections = 0
+_local_lock = threading.Lock()
+
+
+def publish(task_id, state, **data):
+    if not task_id:
+        return
+    payload = json.dumps({'task_id': task_id, 'state': state, 'time': time.time(), **data}, default=str)
+    try:
+        client = get_redis()
+        client.set(LAST_KEY.format(task_id=task_id), payload, ex=settings.TASK_PROGRESS_TTL)
+        client.publish(CHANNEL.format(task_id=task_id), payload)
+    except Exception as e:
+        # Progress is best effort and must never fail the task itself
+        logger.warning(f"Could not publish progress for task {task_id}: {str(e)}")
+
+
+def task_publisher(task_id):
+    """A progress(stage, done, total) callback for long-running steps."""
+    last = {'at': 0.0}
+
+    def progress(stage, done=None, total=None):
+        now = time.monotonic()
+        # Skip intermediate updates that arrive faster than clients can use them
+        if done is not None and total and done < total and now - last['at'] < 0.5:
+            return
+        last['at'] = now
+        publish(task_id, 'PROGRESS', stage=stage, done=done, total=total)
+
+    return progress
+
+
+def _ticket_key(ticket):
+    return TICKET_KEY.format(digest=hashlib.sha256(ticket.encode('utf-8')).hexdigest())
+
+
+def issue_ticket(user_id, task_id):
+    """A random ticket that opens task_id's stream once, within SSE_TICKET_TTL seconds."""
+    ticket = secrets.token_urlsafe(32)
+    get_redis().set(_ticket_key(ticket), f'{user_id}:{task_id}', ex=settings.SSE_TICKET_TTL)
+    return ticket
+
+
+def redeem_ticket(ticket):
+    """(user_id, task_id) the ticket was issued for, or None if it's unknown, expired or already used."""
+    pipe = get_redis().pipeline()
+    pipe.get(_ticket_key(ticket))
+    pipe.delete(_ticket_key(ticket))
+    value, _ = pipe.execute()
+    if not value:
+        return None
+    user_id, _, task_id = value.partition(':')
+    return user_id, task_id
+
+
+def _fallback_state(task_id):
+    # Nothing published yet (or it expired): ask the result backend once
+    from celery.result import AsyncResult
+
+    result = AsyncResult(task_id)
+    data = {'task_id': task_id, 'state': result.state}
+    if result.ready():
+        data['result'] = result.result if isinstance(result.result, dict) else str(result.result)
+    return json.dumps(data, default=str)
+
+
+def _event(payload):
+    state = json.loads(payload).get('state', 'message')
+    return f"event: {state.lower()}\ndata: {payload}\n\n", state
+
+
+def connection_count():
+    try:
+        client = get_redis()
+        client.zremrangebyscore(CONNECTIONS_KEY, '-inf', time.time())
+        return client.zcard(CONNECTIONS_KEY)
+    except Exception:
+        return None
+
+
+def local_connection_count():
+    return _local_connections
+
+
+def _track(delta):
+    global _local_connections
+    with _local_lock:
+        _local_connections += delta
+
+
+def _renew(stream_id):
+    now = time.time()
+    try:
+        pipe = get_redis().pipeline()
+        # Three heartbeats of grace: a renewal is late while an event is being written
+        pipe.zadd(CONNECTIONS_KEY, {stream_id: now + 3 * settings.SSE_HEARTBEAT_SECONDS})
+        pipe.zremrangebyscore(CONNECTIONS_KEY, '-inf', now)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Could not update SSE connection count: {str(e)}")
+
+
+def _remove(stream_id):
+    try:
+        get_redis().zrem(CONNECTIONS_KEY, stream_id)
+    except Exception as e:
+        logger.warning(f"Could not update SSE connection count: {str(e)}")
+
+
+def stream(task_id):
+    """Yield Server-Sent Events for the task until it finishes or the stream times out.
+
+    Subscribes before reading the stored state so no change can slip in
+    between. Comment lines keep idle connections alive through proxies.
+    """
+    client = get_redis()
+    pubsub = client.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(CHANNEL.format(task_id=task_id))
+    stream_id = uuid.uuid4().hex
+    _track(1)
+    _renew(stream_id)
+    try:
+        yield f"retry: {settings.SSE_RETRY_MS}\n\n"
+        payload = client.get(LAST_KEY.format(task_id=task_id)) or _fallback_state(task_id)
+        event, state = _event(payload)
+        yield event
+        if state in TERMINAL_STATES:
+            return
+
+        deadline = time.monotonic() + settings.SSE_MAX_SECONDS
+        renew_at = time.monotonic() + settings.SSE_HEARTBEAT_SECONDS
+        while time.monotonic() < deadline:
+            if time.monotonic() >= renew_at:
+                _renew(stream_id)
+                renew_at = time.monotonic() + settings.SSE_HEARTBEAT_SECONDS
+            message = pubsub.get_message(timeout=settings.SSE_HEARTBEAT_SECONDS)
+            if message is None:
+                yield ": keepalive\n\n"
+                continue
+            event, state = _event(message['data'])
+            yield event
+            if state in TERMINAL_STATES:
+                return
+        # The client reconnects (with a fresh ticket if it used one) and picks up the stored state
+        yield "event: timeout\ndata: {}\n\n"
+    finally:
+        _track(-1)
+        _remove(stream_id)
+        try:
+            pubsub.close()
+        except Exception:
+            pass
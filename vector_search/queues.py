@@ -0,0 +1,76 @@
+import time
+import logging
+from django.conf import settings
+from .ingest_lock import get_redis
+
+logger = logging.getLogger('vector_search')
+
+# Interactive ingestion (a few small documents) and large rebuilds run on
+# separate queues served by separate workers, so a big reprocess can't hold
+# up someone waiting on a single upload.
+QUEUE_FAST = 'ingest_fast'
+QUEUE_BULK = 'ingest_bulk'
+
+ACTIVE_KEY = 'ingest:active:{user_id}'
+QUEUE_WAIT_KEY = 'metrics:queue_wait:{queue}'
+QUEUE_WAIT_SAMPLES = 1000
+
+# Per-user semaphore: a sorted set of task ids scored by when their slot
+# expires, so slots held by crashed workers free themselves.
+_ACQUIRE_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+if redis.call('ZSCORE', KEYS[1], ARGV[2]) or redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[3]) then
+    redis.call('ZADD', KEYS[1], ARGV[4], ARGV[2])
+    redis.call('EXPIRE', KEYS[1], ARGV[5])
+    return 1
+end
+return 0
+"""
+
+
+def choose_queue(vector_db):
+    """Route a rebuild by the size of the whole project, since every run re-embeds all of it."""
+    if (vector_db.num_documents <= settings.INGEST_FAST_MAX_DOCUMENTS
+            and vector_db.total_bytes <= settings.INGEST_FAST_MAX_BYTES):
+        return QUEUE_FAST
+    return QUEUE_BULK
+
+
+def try_start_user_run(user_id, task_id):
+    """Take one of the user's INGEST_MAX_ACTIVE_PER_USER run slots; true if already held by task_id."""
+    now = time.time()
+    ttl = settings.INGEST_LOCK_TTL
+    return bool(get_redis().eval(_ACQUIRE_SCRIPT, 1, ACTIVE_KEY.format(user_id=user_id),
+                                 now, task_id, settings.INGEST_MAX_ACTIVE_PER_USER, now + ttl, ttl))
+
+
+def finish_user_run(user_id, task_id):
+    get_redis().zrem(ACTIVE_KEY.format(user_id=user_id), task_id)
+
+
+def record_queue_wait(task, seconds):
+    """Log the time a task spent queued and keep the latest samples per queue in Redis."""
+    queue = (task.request.delivery_info or {}).get('routing_key') or 'celery'
+    task.request.queue_wait = seconds
+    logger.info(f"Task {task.name}[{task.request.id}] waited {seconds:.2f}s in queue {queue}")
+    try:
+        key = QUEUE_WAIT_KEY.format(queue=queue)
+        pipe = get_redis().pipeline()
+        pipe.lpush(key, f'{time.time():.0f}:{seconds:.3f}')
+        pipe.ltrim(key, 0, QUEUE_WAIT_SAMPLES - 1)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Could not record queue wait: {str(e)}")
+
+
+def queue_wait_stats(queue):
+    """Count, median and p95 of the recorded queue waits for a queue."""
+    waits = sorted(float(sample.split(':')[1]) for sample in get_redis().lrange(QUEUE_WAIT_KEY.format(queue=queue), 0, -1))
+    if not waits:
+        return {'queue': queue, 'count': 0}
+    return {
+        'queue': queue,
+        'count': len(waits),
+        'p50_seconds': waits[len(waits) // 2],
+        'p95_seconds': waits[min(len(waits) - 1, int(len(waits) * 0.95))],
+    }
@@ -0,0 +1,352 @@
+import os
+import uuid
+import pickle
+import shutil
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+from django.conf import settings
+from django.db.models import Sum
+from redis.exceptions import LockError
+from . import index_store
+from .ingest_lock import get_redis
+from .models import VectorDatabase
+
+logger = logging.getLogger('vector_search')
+
+# Small projects don't get index files of their own. They share a flat index
+# (a shard) with other projects of the same embedding dimension, each project
+# holding one contiguous block of rows, plus one chunks file per shard. A query
+# searches only its project's block through a per-call ID range selector, so a
+# loaded (memory-mapped, read-only) shard is never modified, and flat search
+# with a range selector scans only the rows in the range.
+#
+# Shards are versioned like project indexes: immutable v<N> directories and a
+# CURRENT pointer. Adding, replacing or removing a project writes the shard's
+# next version under a Redis lock, then points every member's row at it. That
+# rewrite copies the whole shard (all its vectors and chunks), so its cost
+# grows with SHARED_INDEX_SHARD_VECTORS, and changes to one shard are
+# serialized. A publish that can't get the lock within SHARED_INDEX_LOCK_WAIT
+# gives the project a dedicated index instead of failing the build.
+SHARED_ROOT_DIRNAME = 'shared_index'
+LOCK_KEY = 'shared_index:lock:{shard}'
+# Entries of the project's build record that describe the shard rather than the project
+LAYOUT_KEYS = ('start', 'count')
+
+# Loaded (index, chunks, manifest) keyed by (shard, version)
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def enabled():
+    # Shards live on the local MEDIA_ROOT only, so not with a remote index storage
+    return settings.SHARED_INDEX_ENABLED and not settings.INDEX_STORAGE_BACKEND
+
+
+def accepts(index, num_chunks):
+    """Whether a freshly built project index goes into a shard rather than being published on its own."""
+    import faiss
+
+    if not enabled() or not 0 < num_chunks <= settings.SHARED_INDEX_MAX_CHUNKS:
+        return False
+    return isinstance(faiss.downcast_index(index), faiss.IndexFlatL2)
+
+
+def shard_root(shard):
+    return os.path.join(settings.MEDIA_ROOT, SHARED_ROOT_DIRNAME, shard)
+
+
+def shard_names():
+    root = os.path.join(settings.MEDIA_ROOT, SHARED_ROOT_DIRNAME)
+    return sorted(os.listdir(root)) if os.path.isdir(root) else []
+
+
+class ProjectIndex:
+    """One project's rows of a shard, searched like an index of its own.
+
+    Result ids are relative to the project's first row, so they index its
+    slice of the shard's chunks.
+    """
+
+    def __init__(self, index, start, count):
+        import faiss
+
+        self.index = index
+        self.start = start
+        self.ntotal = count
+        self.d = index.d
+        # Kept on the instance: the parameters only hold a pointer to the selector
+        self.selector = faiss.IDSelectorRange(start, start + count)
+        self.params = faiss.SearchParameters(sel=self.selector)
+
+    def search(self, x, k, params=None):
+        # Shards are flat, so tuned search parameters have nothing to apply to
+        distances, ids = self.index.search(x, k, params=self.params)
+        return distances, np.where(ids >= 0, ids - self.start, -1)
+
+
+def _version_path(shard, version):
+    return os.path.join(shard_root(shard), index_store.version_dirname(version))
+
+
+def _read_version(shard, version, mmap):
+    version_path = _version_path(shard, version)
+    manifest = index_store.read_manifest(version_path)
+    index, _ = index_store.read_faiss_index(os.path.join(version_path, index_store.INDEX_FILENAME), mmap=mmap)
+    with open(os.path.join(version_path, index_store.CHUNKS_FILENAME), 'rb') as f:
+        chunks = pickle.load(f)
+    return index, chunks, manifest
+
+
+def _entry(manifest, vector_db):
+    entry = manifest['projects'].get(vector_db.project_id)
+    if entry is None:
+        raise FileNotFoundError(f'Project {vector_db.project_id} is not in shard {vector_db.shared_shard} '
+                                f'version {vector_db.index_version}')
+    return entry
+
+
+def load_index(vector_db):
+    """(ProjectIndex, chunks) for a project kept in a shard; shards are cached per process."""
+    key = (vector_db.shared_shard, vector_db.index_version)
+    with _cache_lock:
+        loaded = _cache.get(key)
+        if loaded is not None:
+            _cache.move_to_end(key)
+
+    if loaded is None:
+        loaded = _read_version(*key, mmap=settings.INDEX_MMAP)
+        with _cache_lock:
+            for stale in [k for k in _cache if k[0] == key[0] and k[1] < key[1]]:
+                del _cache[stale]
+            _cache[key] = loaded
+            while len(_cache) > settings.SHARED_INDEX_CACHE_ENTRIES:
+                _cache.popitem(last=False)
+
+    index, chunks, manifest = loaded
+    entry = _entry(manifest, vector_db)
+    start, count = entry['start'], entry['count']
+    return ProjectIndex(index, start, count), chunks[start:start + count]
+
+
+def project_manifest(vector_db):
+    """The project's build record in its shard, shaped like a project version manifest (without files)."""
+    manifest = index_store.read_manifest(_version_path(vector_db.shared_shard, vector_db.index_version))
+    entry = _entry(manifest, vector_db)
+    project = {key: value for key, value in entry.items() if key not in LAYOUT_KEYS}
+    project.update({
+        'manifest_version': manifest['manifest_version'],
+        'created_at': manifest['created_at'],
+        'num_chunks': entry['count'],
+        'dimension': manifest['dimension'],
+        'index_type': manifest['index_type'],
+        'version': manifest['version'],
+    })
+    return project
+
+
+def project_build(vector_db):
+    """(flat index, chunks, manifest) of the project's rows as a standalone build, e.g. for export."""
+    import faiss
+
+    index, chunks, manifest = _read_version(vector_db.shared_shard, vector_db.index_version, mmap=True)
+    entry = _entry(manifest, vector_db)
+    start, count = entry['start'], entry['count']
+    own = faiss.IndexFlatL2(index.d)
+    own.add(index.reconstruct_n(start, count))
+    return own, chunks[start:start + count], project_manifest(vector_db)
+
+
+def choose_shard(vector_db, dimension, num_chunks):
+    """The project's shard if it still has room, else the fullest shard with room, else a new one."""
+    prefix = f'd{dimension}-'
+    sizes = dict(VectorDatabase.objects.filter(shared_shard__startswith=prefix)
+                 .exclude(project_id=vector_db.project_id)
+                 .values_list('shared_shard').annotate(Sum('num_chunks')))
+    room = settings.SHARED_INDEX_SHARD_VECTORS - num_chunks
+    if vector_db.shared_shard.startswith(prefix) and sizes.get(vector_db.shared_shard, 0) <= room:
+        return vector_db.shared_shard
+    with_room = [shard for shard, size in sizes.items() if size <= room]
+    if with_room:
+        return max(with_room, key=lambda shard: (sizes[shard], shard))
+    numbers = [int(name[len(prefix):]) for name in set(sizes) | set(shard_names())
+               if name.startswith(prefix) and name[len(prefix):].isdigit()]
+    return f'{prefix}{max(numbers, default=0) + 1:04d}'
+
+
+def _rewrite(shard, add=None, remove=()):
+    """Write the shard's next version with `add` = (vector_db, embeddings, chunks, build record) in and `remove` out.
+
+    Projects whose rows no longer name the shard (deleted ones, say) are
+    dropped too. Returns the new version, or None if
+    nothing changed. Raises LockError if another rewrite holds the shard
+    for longer than SHARED_INDEX_LOCK_WAIT.
+    """
+    import faiss
+
+    root = shard_root(shard)
+    os.makedirs(root, exist_ok=True)
+    lock = get_redis().lock(LOCK_KEY.format(shard=shard), timeout=settings.SHARED_INDEX_LOCK_TIMEOUT,
+                            blocking_timeout=settings.SHARED_INDEX_LOCK_WAIT)
+    with lock:
+        members = set(VectorDatabase.objects.filter(shared_shard=shard).values_list('project_id', flat=True))
+        members -= set(remove)
+        if add is not None:
+            members.discard(add[0].project_id)
+
+        current = index_store.read_current(root)
+        old_projects = {}
+        if current:
+            old_index, old_chunks, old_manifest = _read_version(shard, int(current[1:]), mmap=True)
+            old_projects = old_manifest['projects']
+        kept = sorted((entry['start'], project_id) for project_id, entry in old_projects.items() if project_id in members)
+        if add is None and len(kept) == len(old_projects):
+            return None
+
+        parts, chunks, projects = [], [], {}
+        for start, project_id in kept:
+            entry = old_projects[project_id]
+            # Copied out of the mapped version; the loaded shard itself is never written to
+            parts.append(old_index.reconstruct_n(start, entry['count']))
+            projects[project_id] = dict(entry, start=len(chunks))
+            chunks.extend(old_chunks[start:start + entry['count']])
+        if add is not None:
+            vector_db, embeddings, add_chunks, record = add
+            parts.append(embeddings)
+            projects[vector_db.project_id] = dict(record, start=len(chunks), count=len(add_chunks))
+            chunks.extend(add_chunks)
+
+        if not projects:
+            # Nobody left; a query that read a stale row re-reads it when the files are gone
+            shutil.rmtree(root, ignore_errors=True)
+            logger.info(f"Removed empty shared index shard {shard}")
+            return None
+
+        index = faiss.IndexFlatL2(int(shard.split('-')[0][1:]))
+        index.add(np.ascontiguousarray(np.concatenate(parts), dtype='float32'))
+        build_path = os.path.join(root, f'.build-{uuid.uuid4().hex}')
+        try:
+            manifest = index_store.write_build(build_path, index, chunks, {'shard': shard, 'projects': projects})
+        except Exception:
+            shutil.rmtree(build_path, ignore_errors=True)
+            raise
+        version, _ = index_store.rename_build(root, build_path, manifest)
+        index_store.write_current(root, index_store.version_dirname(version))
+
+        if add is not None:
+            vector_db.shared_shard = shard
+            vector_db.index_version = version
+            vector_db.index_file = ''
+            vector_db.chunks_file = ''
+            vector_db.num_chunks = len(add_chunks)
+            vector_db.index_size = embeddings.nbytes
+            vector_db.save()
+        VectorDatabase.objects.filter(shared_shard=shard).update(index_version=version)
+        index_store.gc_version_dirs(root)
+
+    logger.info(f"Published shared index shard {shard} version {version}: {len(projects)} projects, {index.ntotal} vectors")
+    return version
+
+
+def _retire_dedicated(vector_db):
+    # Its own index versions are no longer read; a query that read the old row
+    # finds them gone and index_store.load_index re-reads the row
+    index_root = vector_db.index_root
+    for version in index_store.existing_versions(index_root):
+        shutil.rmtree(os.path.join(index_root, index_store.version_dirname(version)), ignore_errors=True)
+    for path in (os.path.join(index_root, index_store.CURRENT_FILENAME),
+                 os.path.join(os.path.dirname(index_root), index_store.INDEX_FILENAME),
+                 os.path.join(os.path.dirname(index_root), index_store.CHUNKS_FILENAME)):
+        if os.path.isfile(path):
+            os.remove(path)
+    index_store.evict(vector_db.project_id)
+
+
+def publish(vector_db, index, chunks, manifest_extra=None):
+    """Store a project's freshly built flat index in a shard instead of publishing it on its own.
+
+    The counterpart of index_store.publish_index for projects accepted by
+    accepts(); returns the shard version the project's row now points at.
+    """
+    embeddings = np.ascontiguousarray(index.reconstruct_n(0, index.ntotal), dtype='float32')
+    previous = vector_db.shared_shard
+    shard = choose_shard(vector_db, index.d, len(chunks))
+    version = _rewrite(shard, add=(vector_db, embeddings, chunks, dict(manifest_extra or {})))
+    if previous and previous != shard:
+        remove(vector_db, previous)
+    _retire_dedicated(vector_db)
+    logger.info(f"Project {vector_db.project_id} is stored in shared index shard {shard} version {version}")
+    return version
+
+
+def remove(vector_db, shard=None):
+    """Drop the project from its shard (or `shard`); best effort, a later rewrite drops it anyway."""
+    shard = shard or vector_db.shared_shard
+    if not shard:
+        return
+    try:
+        _rewrite(shard, remove=[vector_db.project_id])
+    except Exception as e:
+        logger.warning(f"Could not remove project {vector_db.project_id} from shard {shard}: {str(e)}")
+
+
+def prune(shard):
+    """Drop deleted projects' rows from the shard; best effort, a later rewrite drops them anyway."""
+    try:
+        _rewrite(shard)
+    except Exception as e:
+        logger.warning(f"Could not prune shard {shard}: {str(e)}")
+
+
+def publish_project(vector_db, index, chunks, manifest_extra=None):
+    """Publish a freshly built project index: into a shard if accepts() it, else on its own.
+
+    A project that no longer qualifies leaves its shard for a dedicated
+    index, and so does one whose shard stays busy past SHARED_INDEX_LOCK_WAIT
+    (consolidate_indexes moves it back later). Returns the version the
+    project's row points at.
+    """
+    if accepts(index, len(chunks)):
+        try:
+            return publish(vector_db, index, chunks, manifest_extra)
+        except LockError as e:
+            logger.warning(f"Shared index shard busy, publishing project {vector_db.project_id} on its own: {str(e)}")
+    previous_shard = vector_db.shared_shard
+    vector_db.shared_shard = ''
+    version, _ = index_store.publish_index(vector_db, index, chunks, manifest_extra)
+    if previous_shard:
+        remove(vector_db, previous_shard)
+    return version
+
+
+def consolidate(vector_db):
+    """Move a project's dedicated index into a shard without re-embedding; returns the version or None if it doesn't qualify."""
+    index_path, chunks_path = index_store.local_paths(vector_db)
+    index, _ = index_store.read_faiss_index(index_path, mmap=False)
+    with open(chunks_path, 'rb') as f:
+        chunks = pickle.load(f)
+    if not accepts(index, len(chunks)):
+        return None
+    try:
+        previous = index_store.version_manifest(vector_db)
+    except (OSError, ValueError):
+        # Legacy unversioned layout
+        previous = {}
+    # The build record carries over, so a re-ingest of the same documents is still recognised
+    manifest_extra = {key: value for key, value in previous.items()
+                      if key not in ('manifest_version', 'created_at', 'num_chunks', 'dimension', 'index_type', 'files', 'version')}
+    return publish(vector_db, index, chunks, manifest_extra)
+
+
+def shard_stats():
+    """[(shard, version, projects, vectors, bytes)] for every shard on this node."""
+    stats = []
+    for shard in shard_names():
+        current = index_store.read_current(shard_root(shard))
+        if not current:
+            continue
+        manifest = index_store.read_manifest(os.path.join(shard_root(shard), current))
+        size = sum(info['size'] for info in manifest['files'].values())
+        stats.append((shard, manifest['version'], len(manifest['projects']), manifest['num_chunks'], size))
+    return stats
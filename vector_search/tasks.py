@@ -1,17 +1,75 @@
 from celery import shared_task
-from .vector_db_utils import create_vector_database
+from celery.exceptions import Retry
+from .vector_db_utils import create_vector_database, load_model, resolve_chunking
 import os
-import faiss
-import pickle
+import time
 from django.conf import settings
 from .models import Document, VectorDatabase
+from .text_extraction import ensure_text_artifact, html_to_text, read_pages
+from .index_store import current_build_key
+from .checkpoint import CHECKPOINT_DIRNAME, BuildCheckpoint, build_key
+from . import ingest_lock, progress, queues, shared_index
 from vector_search_project.celery import app
 import logging
 logger = logging.getLogger('vector_search')
 
-@app.task
-def process_documents_task(project_id, user_id):
-    logger.info(f"Starting process_documents_task for project_id={project_id}, user_id={user_id}")
+@app.task(bind=True, acks_late=True, reject_on_worker_lost=True, max_retries=settings.PROCESS_MAX_RETRIES)
+def process_documents_task(self, project_id, user_id, deferrals=0):
+    # Only one run per project at a time. Retries and redeliveries keep the
+    # task id, so they re-enter the lock they already hold.
+    task_id = self.request.id
+    if not ingest_lock.try_acquire(project_id, task_id):
+        follow_up = ingest_lock.queue_follow_up(project_id, user_id)
+        logger.info(f"Project {project_id} is already being processed, queued follow-up run {follow_up}")
+        return {'message': 'Another run for this project is in progress; a follow-up run is queued', 'task_id': follow_up}
+
+    retrying = False
+    try:
+        if not queues.try_start_user_run(user_id, task_id):
+            # The user already has their share of runs going; step aside so
+            # other users' jobs get the worker, and try again later
+            logger.info(f"Deferring processing of project {project_id}: user {user_id} is at the active run limit")
+            raise self.retry(countdown=settings.INGEST_FAIRNESS_DELAY, max_retries=self.request.retries + 1,
+                             kwargs={'deferrals': deferrals + 1})
+        result = _process_documents(self, project_id, user_id, deferrals)
+        if isinstance(result, dict):
+            result['queue_wait_seconds'] = getattr(self.request, 'queue_wait', None)
+        return result
+    except Retry:
+        # Keep the lock for the retry
+        retrying = True
+        raise
+    finally:
+        if not retrying:
+            queues.finish_user_run(user_id, task_id)
+            follow_up = ingest_lock.release(project_id, task_id)
+            if follow_up:
+                ingest_lock.start_run(project_id, user_id, follow_up)
+
+def _renewing_lock(report, project_id, user_id, task_id):
+    """Wrap a progress callback so a build running past INGEST_LOCK_TTL keeps its lock and run slot."""
+    last = {'at': time.monotonic()}
+
+    def progress(stage, done=None, total=None):
+        now = time.monotonic()
+        if now - last['at'] >= settings.INGEST_LOCK_TTL / 10:
+            last['at'] = now
+            try:
+                if not ingest_lock.extend(project_id, task_id):
+                    logger.warning(f"Run {task_id} no longer holds the ingestion lock for project {project_id}")
+                queues.try_start_user_run(user_id, task_id)
+            except Exception as e:
+                logger.warning(f"Could not renew the ingestion lock for project {project_id}: {str(e)}")
+        report(stage, done, total)
+
+    return progress
+
+def _process_documents(task, project_id, user_id, deferrals=0):
+    # Safe to run more than once for the same inputs: progress is checkpointed
+    # under the project's index directory, documents are only marked processed
+    # once their index is published, and a build that was already published
+    # (e.g. a redelivery after a crash before the ack) is recognised by its key.
+    logger.info(f"Starting process_documents_task for project_id={project_id}, user_id={user_id} (attempt {task.request.retries + 1})")
     try:
         vector_db = VectorDatabase.objects.get(project_id=project_id, user_id=user_id)
         documents = Document.objects.filter(user_id=user_id, processed=False, vector_database=vector_db)
@@ -23,52 +81,221 @@ def process_documents_task(project_id, user_id):
         project_folder = f'project_{project_id}'
         folder_path = os.path.join(settings.MEDIA_ROOT, 'documents', user_folder, project_folder)
         os.makedirs(folder_path, exist_ok=True)
-        
-        processed_docs = []
+        logger.info(f"folder_path: {folder_path}")
 
-        logger.info("folder_path: ", folder_path)
-        for doc in documents:
+        # Text is extracted once per document and cached, so documents parsed
+        # by an earlier attempt are not parsed again
+        report = _renewing_lock(progress.task_publisher(task.request.id), project_id, user_id, task.request.id)
+        extracted = []
+        included = []
+        project_documents = list(Document.objects.filter(vector_database=vector_db).order_by('uploaded_at', 'document_id'))
+        for position, doc in enumerate(project_documents):
+            report('extracting', position, len(project_documents))
             try:
-                doc.processed = True
-                doc.save()
-                processed_docs.append(doc)
+                meta = ensure_text_artifact(doc)
             except Exception as e:
-                doc.processed = False
-                doc.save()
-                raise Exception(f"Error processing document {doc.id}: {str(e)}")
-        
-        index, chunks = create_vector_database(folder_path)
+                logger.error(f"Error extracting text from {doc.file.name}: {str(e)}")
+                continue
+            if meta is not None:
+                extracted.append((doc.file.path, read_pages(doc, meta)))
+                included.append(doc)
+
+        threshold = settings.CHUNK_DEDUP_THRESHOLD if settings.CHUNK_DEDUP_ENABLED else None
+        # Resolved up front so the build key doesn't change once they are stored on the project
+        build_params = resolve_chunking(
+            load_model(vector_db.model_name),
+            vector_db.chunk_unit or settings.CHUNK_UNIT,
+            vector_db.chunk_size or settings.CHUNK_SIZE or None,
+            # The default overlap depends on the unit, so an unset one is left to resolve_chunking
+            vector_db.chunk_overlap if vector_db.chunk_overlap is not None else settings.CHUNK_OVERLAP,
+        )
+        build_params['model_name'] = vector_db.model_name
+        key = build_key(
+            documents=[(str(doc.document_id), doc.content_hash, doc.file.name) for doc in included],
+            dedup_threshold=threshold,
+            embedding_backend=settings.EMBEDDING_BACKEND,
+            index_factory=settings.INDEX_FACTORY,
+            **build_params,
+        )
+        if current_build_key(vector_db) == key:
+            Document.objects.filter(pk__in=[doc.pk for doc in included]).update(processed=True)
+            logger.info(f"Index for project {project_id} is already built from these documents")
+            return {
+                "success": True,
+                "message": "Documents processed successfully",
+                "index_version": vector_db.index_version,
+                "num_chunks": vector_db.num_chunks,
+                "duplicate_chunks_removed": vector_db.duplicate_chunks,
+            }
 
+        os.makedirs(vector_db.index_root, exist_ok=True)
+        checkpoint = BuildCheckpoint(os.path.join(vector_db.index_root, CHECKPOINT_DIRNAME), key)
+        build_stats = {}
+        index, chunks = create_vector_database(
+            folder_path,
+            extracted=extracted,
+            dedup_threshold=threshold,
+            stats=build_stats,
+            # A tuned project keeps its index type and parameters; the build key stays on the
+            # global default because the tuner re-indexes without changing chunks or embeddings
+            index_factory=vector_db.index_factory or settings.INDEX_FACTORY,
+            memory_budget=settings.INDEX_BUILD_MEMORY_MB * 1024 * 1024,
+            spool_dir=vector_db.index_root,
+            train_size=settings.INDEX_TRAIN_SAMPLE,
+            nprobe=vector_db.search_params.get('nprobe') or settings.INDEX_NPROBE,
+            checkpoint=checkpoint,
+            checkpoint_rows=settings.INDEX_CHECKPOINT_ROWS,
+            progress=report,
+            **build_params,
+        )
 
         if index is None or chunks is None:
-            for doc in processed_docs:
-                doc.processed = False
-                doc.save()
+            checkpoint.clear()
             return {'error': 'Failed to create vector database. Check the logs for more information.'}
         
-        index_path = os.path.join(folder_path, 'faiss_index')
-        chunks_path = os.path.join(folder_path, 'chunks.pkl')
-        
-        faiss.write_index(index, index_path)
-        with open(chunks_path, 'wb') as f:
-            pickle.dump(chunks, f)
-        
-        relative_index_path = os.path.relpath(index_path, settings.MEDIA_ROOT)
-        relative_chunks_path = os.path.relpath(chunks_path, settings.MEDIA_ROOT)
-        
-        vector_db.index_file = relative_index_path
-        vector_db.chunks_file = relative_chunks_path
-        vector_db.save()
+        # Written to a fresh versioned directory and swapped in atomically, so
+        # queries running meanwhile keep reading the previous version intact.
+        vector_db.duplicate_chunks = build_stats.get('duplicates_removed', 0)
+        vector_db.embedding_model = vector_db.model_name
+        vector_db.chunk_unit = build_stats['chunking']['chunk_unit']
+        vector_db.chunk_size = build_stats['chunking']['chunk_size']
+        vector_db.chunk_overlap = build_stats['chunking']['chunk_overlap']
+        report('publishing')
+        manifest_extra = {
+            'build_key': key,
+            'index_factory': vector_db.index_factory or settings.INDEX_FACTORY,
+            'search_params': vector_db.search_params,
+            'embedding_model': vector_db.embedding_model,
+            'embedding_backend': build_stats.get('embedding_backend'),
+            'build_mode': build_stats.get('build_mode'),
+            'chunking': build_stats['chunking'],
+            'dedup_threshold': threshold,
+            'chunks_created': build_stats.get('chunks_created', len(chunks)),
+            'duplicate_chunks_removed': vector_db.duplicate_chunks,
+        }
+        # Past SHARED_INDEX_MAX_CHUNKS a project gets its own index and leaves its shard
+        version = shared_index.publish_project(vector_db, index, chunks, manifest_extra)
+        Document.objects.filter(pk__in=[doc.pk for doc in included]).update(processed=True)
+        checkpoint.clear()
+        vector_db.refresh_document_stats()
         
         logger.info("process_documents_task completed successfully")
-        return {"success": True, "message": "Documents processed successfully"}
+        return {
+            "success": True,
+            "message": "Documents processed successfully",
+            "index_version": version,
+            "num_chunks": len(chunks),
+            "duplicate_chunks_removed": vector_db.duplicate_chunks,
+            "resumed_from_row": build_stats.get('resumed_from_row', 0),
+            "embedding_throughput": build_stats.get('embedding_throughput'),
+        }
+    except VectorDatabase.DoesNotExist:
+        return {"error": "Vector database not found"}
     except Exception as e:
         logger.exception(f"Error in process_documents_task: {str(e)}")
-        for doc in Document.objects.filter(user_id=user_id, vector_database=vector_db):
-            doc.processed = False
-            doc.save()
+        # Deferrals for fairness are retries too, but don't count as failures
+        failures = task.request.retries - deferrals
+        if failures < task.max_retries:
+            # The checkpoint is kept, so the retry resumes instead of starting over
+            raise task.retry(exc=e, countdown=settings.PROCESS_RETRY_DELAY * 2 ** failures,
+                             max_retries=task.request.retries + 1)
         return {"error": f"Failed to process documents: {str(e)}"}
 
+@app.task
+def crawl_urls_task(project_id, user_id, urls=None, sitemap_url=None):
+    from . import crawler, uploads
+    logger.info(f"Starting crawl_urls_task for project_id={project_id}, user_id={user_id}")
+    try:
+        vector_db = VectorDatabase.objects.select_related('user').get(project_id=project_id, user_id=user_id)
+        session = crawler.build_session()
+
+        urls = list(urls or [])
+        if sitemap_url:
+            urls.extend(crawler.parse_sitemap(session, sitemap_url))
+        # Keep first occurrence order while dropping repeats and invalid entries
+        urls = [url for url in dict.fromkeys(urls) if crawler.is_valid_url(url)][:settings.CRAWL_MAX_URLS]
+        if not urls:
+            return {'error': 'No valid URLs to crawl'}
+
+        existing = {
+            doc.source_url: doc
+            for doc in Document.objects.filter(vector_database=vector_db, source_url__in=urls)
+        }
+        validators = {url: (doc.etag, doc.last_modified) for url, doc in existing.items()}
+        results = crawler.crawl(urls, validators=validators, session=session)
+
+        summary = {'created': 0, 'changed': 0, 'unchanged': 0, 'failed': []}
+        for result in results:
+            if result.error:
+                summary['failed'].append({'url': result.url, 'error': result.error})
+            elif result.not_modified:
+                summary['unchanged'] += 1
+            elif not result.is_html:
+                summary['failed'].append({'url': result.url, 'error': 'The URL does not point to an HTML page'})
+            else:
+                # Only the page's main text is stored, so ingestion never parses HTML
+                text = html_to_text(result.content)
+                if not text:
+                    summary['failed'].append({'url': result.url, 'error': 'No text content was found on the page'})
+                    continue
+                document = existing.get(result.url)
+                document, changed = uploads.store_scraped_page(
+                    vector_db.user, vector_db, result.url, crawler.safe_filename_for_url(result.url, '.txt'),
+                    text, result.etag, result.last_modified, document=document,
+                )
+                if not changed:
+                    summary['unchanged'] += 1
+                elif result.url in existing:
+                    summary['changed'] += 1
+                else:
+                    summary['created'] += 1
+
+        vector_db.refresh_document_stats()
+
+        # Only new or changed pages are left unprocessed, so only they trigger a re-index
+        if summary['created'] or summary['changed']:
+            summary['process_task_id'], summary['process_state'] = ingest_lock.request_run(
+                project_id, user_id, has_new_documents=lambda started_at: True)
+
+        logger.info(f"crawl_urls_task completed: {summary['created']} created, {summary['changed']} changed, "
+                    f"{summary['unchanged']} unchanged, {len(summary['failed'])} failed")
+        return {'success': True, **summary}
+    except Exception as e:
+        logger.exception(f"Error in crawl_urls_task: {str(e)}")
+        return {'error': f'Failed to crawl URLs: {str(e)}'}
+
+@app.task(bind=True)
+def tune_index_task(self, project_id, recall_target=None):
+    # Holds the project's ingestion lock so a re-index never races a build
+    from .index_tuner import tune
+    task_id = self.request.id
+    if not ingest_lock.try_acquire(project_id, task_id):
+        return {'message': 'The project is being processed; tune it once that finishes'}
+    try:
+        vector_db = VectorDatabase.objects.get(project_id=project_id)
+        if vector_db.shared_shard:
+            return {'message': 'The project is small enough to be kept in the shared index, which is searched exactly'}
+        if not vector_db.index_file:
+            return {'error': 'The project has no index to tune'}
+        report = tune(vector_db, recall_target=recall_target)
+        return {'success': True, 'index_version': vector_db.index_version, **report}
+    except VectorDatabase.DoesNotExist:
+        return {'error': 'Vector database not found'}
+    except Exception as e:
+        logger.exception(f"Error in tune_index_task: {str(e)}")
+        return {'error': f'Failed to tune index: {str(e)}'}
+    finally:
+        follow_up = ingest_lock.release(project_id, task_id)
+        if follow_up:
+            vector_db = VectorDatabase.objects.filter(project_id=project_id).first()
+            if vector_db is not None:
+                ingest_lock.start_run(project_id, vector_db.user_id, follow_up)
+
+@app.task
+def prune_shard_task(shard):
+    # Queued when a project in the shard is deleted
+    shared_index.prune(shard)
+
 @app.task
 def test_task(x, y):
     logger.info(f"Starting test_task with arguments: x={x}, y={y}")
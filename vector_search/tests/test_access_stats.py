@@ -0,0 +1,63 @@
+import math
+from unittest import mock
+from django.test import SimpleTestCase, override_settings
+from .. import access_stats
+from .utils import FakeRedisMixin
+
+DAY = 24 * 3600
+
+
+@override_settings(ACCESS_HOTNESS_HALF_LIFE=DAY, ACCESS_STATS_FLUSH_SECONDS=3600)
+class HotnessTests(FakeRedisMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        access_stats.flush()
+        # Nothing left over for the next test, or for the flush at exit
+        self.addCleanup(access_stats.flush)
+        self.now = access_stats.HOTNESS_EPOCH + 30 * DAY
+        patcher = mock.patch.object(access_stats.time, 'time', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def record(self, project_id, times=1):
+        for _ in range(times):
+            access_stats.record_access(project_id)
+
+    def test_queries_are_counted_and_weighted_by_age(self):
+        self.record('old', 4)
+        self.now += DAY
+        self.record('new', 2)
+        access_stats.flush()
+        scores = access_stats.hotness(['old', 'new', 'unknown'])
+        # Four queries a half-life ago weigh as much as two now
+        self.assertAlmostEqual(scores['old'], scores['new'])
+        self.assertAlmostEqual(scores['new'], 31 + 1)
+        self.assertEqual(scores['unknown'], -math.inf)
+        self.assertEqual(access_stats.project_stats('old')['queries'], 4)
+
+    def test_unflushed_queries_are_added_to_stored_scores(self):
+        self.record('project', 2)
+        access_stats.flush()
+        self.record('project', 2)
+        self.assertAlmostEqual(access_stats.hotness(['project'])['project'], 30 + 2)
+        access_stats.flush()
+        self.assertAlmostEqual(access_stats.hotness(['project'])['project'], 30 + 2)
+        self.record('other', 8)
+        self.assertEqual(access_stats.hottest(2), ['project'])
+
+    def test_scores_stay_in_range_far_from_the_epoch(self):
+        # 2 ** 36500 would overflow a float
+        self.now = access_stats.HOTNESS_EPOCH + 36500 * DAY
+        self.record('project')
+        self.now += DAY
+        self.record('recent')
+        access_stats.flush()
+        scores = access_stats.hotness(['project', 'recent'])
+        self.assertAlmostEqual(scores['project'], 36500)
+        self.assertAlmostEqual(scores['recent'], 36501)
+        self.assertEqual(access_stats.hottest(1), ['recent'])
+
+    def test_recording_never_raises(self):
+        with mock.patch.object(access_stats, '_log_weight', side_effect=OverflowError), \
+                self.assertLogs('vector_search', 'WARNING'):
+            access_stats.record_access('project')
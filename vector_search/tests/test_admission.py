@@ -0,0 +1,130 @@
+import time
+from unittest import mock
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+from .. import admission
+from ..models import VectorDatabase
+from .utils import FakeRedisMixin
+
+LIMITS = {'query': {'concurrent': 32, 'queued': 64}}
+PLANS = {'default': {'query': {'concurrent': 4, 'queued': 8}}}
+
+
+@override_settings(ADMISSION_GLOBAL_LIMITS=LIMITS, ADMISSION_PLANS=PLANS, ADMISSION_QUEUE_TIMEOUT=10, ADMISSION_SLOT_TTL=120)
+class AdmissionTests(FakeRedisMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.arrival = time.time() + 60
+        self.arrivals = {}
+
+    def attempt(self, user, token=None):
+        """(result, token) of one attempt; a new token arrives after every earlier one."""
+        if token is None:
+            token = f'{user}-{len(self.arrivals):03d}'
+            self.arrival += 0.001
+            self.arrivals[token] = self.arrival
+        return admission.try_acquire('query', user, 'default', token, self.arrivals[token]), token
+
+    def fill(self, user, count):
+        tokens = []
+        for _ in range(count):
+            result, token = self.attempt(user)
+            self.assertEqual(result, 1)
+            tokens.append(token)
+        return tokens
+
+    def test_user_limited_waiter_does_not_block_other_users(self):
+        self.fill('a', 4)
+        self.assertEqual(self.attempt('a')[0], 0)
+        # 28 global slots are free, so b is not held back by a's waiter
+        self.assertEqual(self.attempt('b')[0], 1)
+        self.assertEqual(admission.current_load('query'), (5, 0))
+
+    def test_user_limited_waiters_take_no_global_queue_places(self):
+        for user in 'abcdefgh':
+            self.fill(user, 4)
+            for _ in range(8):
+                self.assertEqual(self.attempt(user)[0], 0)
+        # All 32 slots are taken and 64 requests wait, each on its own user's limit,
+        # so the global queue is still empty and other users queue rather than get a 429
+        self.assertEqual(admission.current_load('query'), (32, 0))
+        self.assertEqual(self.attempt('i')[0], 0)
+        self.assertEqual(self.attempt('j')[0], 0)
+
+    def test_user_queue_is_bounded(self):
+        self.fill('a', 4)
+        for _ in range(8):
+            self.assertEqual(self.attempt('a')[0], 0)
+        self.assertEqual(self.attempt('a')[0], -1)
+
+    def test_global_queue_is_fifo_and_bounded(self):
+        with override_settings(ADMISSION_GLOBAL_LIMITS={'query': {'concurrent': 2, 'queued': 2}}):
+            slots = self.fill('a', 2)
+            _, first = self.attempt('b')
+            _, second = self.attempt('c')
+            self.assertEqual(self.attempt('d')[0], -1)
+            admission.Slot('query', 'a', slots[0]).release()
+            # The later waiter can't overtake the earlier one
+            self.assertEqual(self.attempt('c', second)[0], 0)
+            self.assertEqual(self.attempt('b', first)[0], 1)
+            self.assertEqual(self.attempt('c', second)[0], 0)
+
+    def test_same_user_waiters_keep_their_order(self):
+        slots = self.fill('a', 4)
+        _, first = self.attempt('a')
+        _, second = self.attempt('a')
+        admission.Slot('query', 'a', slots[0]).release()
+        self.assertEqual(self.attempt('a', second)[0], 0)
+        self.assertEqual(self.attempt('a', first)[0], 1)
+        self.assertEqual(self.attempt('a', second)[0], 0)
+
+    def test_waiter_no_longer_user_limited_joins_the_global_queue_by_arrival(self):
+        with override_settings(ADMISSION_GLOBAL_LIMITS={'query': {'concurrent': 5, 'queued': 4}}):
+            slots = self.fill('a', 4)
+            _, a_waiter = self.attempt('a')
+            self.fill('b', 1)
+            _, b_waiter = self.attempt('b')
+            self.assertEqual(admission.current_load('query'), (5, 1))
+            admission.Slot('query', 'a', slots[0]).release()
+            # a's waiter now waits on the global limit, placed ahead of b's by arrival
+            self.assertEqual(self.attempt('a', a_waiter)[0], 0)
+            self.assertEqual(admission.current_load('query'), (4, 2))
+            self.assertEqual(self.attempt('b', b_waiter)[0], 0)
+            self.assertEqual(self.attempt('a', a_waiter)[0], 1)
+
+    def test_dead_waiter_lapses_after_the_queue_timeout(self):
+        with override_settings(ADMISSION_GLOBAL_LIMITS={'query': {'concurrent': 1, 'queued': 1}}):
+            slot, = self.fill('a', 1)
+            self.assertEqual(self.attempt('b')[0], 0)
+            self.assertEqual(self.attempt('c')[0], -1)
+            admission.Slot('query', 'a', slot).release()
+            with mock.patch.object(admission.time, 'time', return_value=self.arrival + 1):
+                self.assertEqual(self.attempt('c')[0], 1)
+
+    def test_acquire_sheds_when_the_queue_is_full(self):
+        with override_settings(ADMISSION_GLOBAL_LIMITS={'query': {'concurrent': 1, 'queued': 0}}):
+            slot = admission.acquire('query', 'a', 'default')
+            with self.assertRaises(admission.Overloaded):
+                admission.acquire('query', 'b', 'default')
+            slot.release()
+            admission.acquire('query', 'b', 'default').release()
+        self.assertEqual(admission.shed_counts(), {('query', 'default', 'queue_full'): 1})
+
+
+class PreviewScopeTests(FakeRedisMixin, TestCase):
+    def test_preview_is_not_held_up_by_uploads(self):
+        user = User.objects.create_user('reader')
+        vector_db = VectorDatabase.objects.create(user=user, name='Busy')
+        # Every ingest slot of the user is taken
+        slots = [admission.acquire('ingest', f'user:{user.pk}', 'default') for _ in range(2)]
+        client = APIClient()
+        client.force_authenticate(user)
+        with override_settings(ADMISSION_QUEUE_TIMEOUT=0):
+            response = client.post(reverse('document_preview'),
+                                   {'document_id': 'missing', 'project_id': vector_db.project_id}, format='json')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(admission.current_load('ingest'), (2, 0))
+        for slot in slots:
+            slot.release()
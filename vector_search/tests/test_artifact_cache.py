@@ -0,0 +1,134 @@
+import os
+import glob
+import time
+import hashlib
+import shutil
+import tempfile
+from unittest import mock
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.test import SimpleTestCase, TestCase, override_settings
+from .. import artifact_cache, index_store
+from ..models import VectorDatabase
+from .utils import FakeRedisMixin, TempMediaMixin
+
+
+class TempCacheMixin:
+    """A fresh INDEX_CACHE_DIR and a FileSystemStorage standing in for the remote index storage."""
+
+    def setUp(self):
+        super().setUp()
+        root = tempfile.mkdtemp(prefix='qq-cache-')
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        self.remote_root = os.path.join(root, 'remote')
+        self.storage = FileSystemStorage(location=self.remote_root)
+        cache = override_settings(INDEX_CACHE_DIR=os.path.join(root, 'cache'))
+        cache.enable()
+        self.addCleanup(cache.disable)
+
+    def put(self, name, data):
+        self.storage.save(name, ContentFile(data))
+        return hashlib.sha256(data).hexdigest()
+
+
+class ArtifactCacheTests(TempCacheMixin, SimpleTestCase):
+    def test_fetch_downloads_and_verifies(self):
+        sha256 = self.put('p/v000001/faiss_index', b'index bytes')
+        path = artifact_cache.fetch(self.storage, 'p/v000001/faiss_index', sha256, 11)
+        self.assertEqual(path, os.path.join(settings.INDEX_CACHE_DIR, sha256[:2], sha256))
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'index bytes')
+
+    def test_fetch_hit_does_not_touch_the_storage(self):
+        sha256 = self.put('a', b'data')
+        artifact_cache.fetch(self.storage, 'a', sha256)
+        with mock.patch.object(self.storage, 'open', side_effect=AssertionError('downloaded again')):
+            # Identical content under another name is the same entry
+            artifact_cache.fetch(self.storage, 'b', sha256)
+
+    def test_checksum_mismatch_leaves_nothing_behind(self):
+        self.put('a', b'tampered')
+        expected = hashlib.sha256(b'original').hexdigest()
+        with self.assertRaises(artifact_cache.ChecksumMismatch):
+            artifact_cache.fetch(self.storage, 'a', expected)
+        entry = os.path.join(settings.INDEX_CACHE_DIR, expected[:2])
+        self.assertEqual([name for name in os.listdir(entry) if not name.endswith('.lock')], [])
+
+    def test_size_mismatch_is_rejected(self):
+        sha256 = self.put('a', b'data')
+        with self.assertRaises(artifact_cache.ChecksumMismatch):
+            artifact_cache.fetch(self.storage, 'a', sha256, size=5)
+
+    def test_fetch_manifest_is_cached(self):
+        self.put('p/v000001/manifest.json', b'{"version": 1}')
+        self.assertEqual(artifact_cache.fetch_manifest(self.storage, 'p/v000001/manifest.json'), {'version': 1})
+        self.storage.delete('p/v000001/manifest.json')
+        self.assertEqual(artifact_cache.fetch_manifest(self.storage, 'p/v000001/manifest.json'), {'version': 1})
+
+    def test_evict_removes_least_recently_used(self):
+        paths = []
+        for i, data in enumerate((b'a' * 10, b'b' * 10, b'c' * 10)):
+            paths.append(artifact_cache.fetch(self.storage, str(i), self.put(str(i), data)))
+            os.utime(paths[-1], (time.time() - 100 + i, time.time() - 100 + i))
+        # Using the oldest entry makes it the most recently used
+        artifact_cache.fetch(self.storage, '0', hashlib.sha256(b'a' * 10).hexdigest())
+        removed = artifact_cache.evict(keep=paths[1], max_bytes=20)
+        self.assertEqual(removed, [paths[2]])
+        self.assertTrue(os.path.isfile(paths[0]))
+        self.assertTrue(os.path.isfile(paths[1]))
+
+
+@override_settings(INDEX_STORAGE_BACKEND='django.core.files.storage.FileSystemStorage', INDEX_CACHE_MAX_BYTES=2 ** 30)
+class RemoteIndexTests(TempCacheMixin, FakeRedisMixin, TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        storages = dict(settings.STORAGES, indexes={'BACKEND': 'django.core.files.storage.FileSystemStorage',
+                                                   'OPTIONS': {'location': self.remote_root}})
+        override = override_settings(STORAGES=storages)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.vector_db = VectorDatabase.objects.create(user=User.objects.create_user('owner'), name='Remote')
+
+    def publish(self, count):
+        import faiss
+        from langchain_core.documents import Document as LangchainDocument
+
+        index = faiss.IndexFlatL2(4)
+        index.add(np.random.default_rng(count).random((count, 4), dtype='float32'))
+        chunks = [LangchainDocument(page_content=f'chunk {i}') for i in range(count)]
+        version, _ = index_store.publish_index(self.vector_db, index, chunks)
+        return version
+
+    def test_other_node_loads_through_the_cache(self):
+        version = self.publish(3)
+        name = index_store.storage_name(self.vector_db, version, index_store.INDEX_FILENAME)
+        self.assertTrue(os.path.isfile(os.path.join(self.remote_root, name)))
+
+        # Another node: nothing under its MEDIA_ROOT
+        shutil.rmtree(self.vector_db.index_root)
+        index_store.evict(self.vector_db.project_id)
+        index, chunks = index_store.load_index(self.vector_db)
+        self.assertEqual((index.ntotal, len(chunks)), (3, 3))
+        for path in index_store.local_paths(self.vector_db):
+            self.assertTrue(path.startswith(settings.INDEX_CACHE_DIR))
+        self.assertEqual(index_store.version_manifest(self.vector_db)['num_chunks'], 3)
+
+    def test_corrupted_remote_artifact_is_not_loaded(self):
+        version = self.publish(3)
+        shutil.rmtree(self.vector_db.index_root)
+        index_store.evict(self.vector_db.project_id)
+        name = index_store.storage_name(self.vector_db, version, index_store.CHUNKS_FILENAME)
+        with open(os.path.join(self.remote_root, name), 'ab') as f:
+            f.write(b'appended')
+        with self.assertRaises(artifact_cache.ChecksumMismatch):
+            index_store.load_index(self.vector_db)
+
+    def test_delete_removes_stored_versions(self):
+        self.publish(3)
+        self.publish(4)
+        self.assertTrue(glob.glob(os.path.join(self.remote_root, '**', index_store.INDEX_FILENAME), recursive=True))
+        self.vector_db.delete()
+        self.assertEqual([name for _, _, names in os.walk(self.remote_root) for name in names], [])
@@ -0,0 +1,137 @@
+import re
+import base64
+from unittest import mock
+from django.contrib.auth import base_user
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from .. import authentication
+from ..models import ProjectAPIToken, VectorDatabase
+from .utils import FakeRedisMixin
+
+SERVER_TIMING = re.compile(r'^auth;dur=\d+\.\d, admission;dur=\d+\.\d, total;dur=\d+\.\d$')
+
+
+class AuthenticationTests(FakeRedisMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        for cache in (authentication._users, authentication._credentials, authentication._api_tokens,
+                      authentication._group_names):
+            cache.discard(lambda key, value: True)
+            self.addCleanup(cache.discard, lambda key, value: True)
+        self.user = User.objects.create_user('owner', password='secret')
+        self.client = APIClient()
+
+    def profile(self, **headers):
+        return self.client.get(reverse('user_profile'), **headers)
+
+    def bearer(self, user=None):
+        return {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(user or self.user)}'}
+
+    def basic(self, password='secret'):
+        credentials = base64.b64encode(f'owner:{password}'.encode()).decode()
+        return {'HTTP_AUTHORIZATION': f'Basic {credentials}'}
+
+    def test_jwt_user_is_cached(self):
+        headers = self.bearer()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.profile(**headers).status_code, 200)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.profile(**headers).json()['username'], 'owner')
+
+    @override_settings(AUTH_CACHE_TTL=0)
+    def test_jwt_cache_entries_expire(self):
+        headers = self.bearer()
+        self.profile(**headers)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.profile(**headers).status_code, 200)
+
+    def test_deactivated_user_is_rejected_at_once(self):
+        headers = self.bearer()
+        self.assertEqual(self.profile(**headers).status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.profile(**headers).status_code, 401)
+
+    def test_jwt_of_a_deleted_user(self):
+        headers = self.bearer()
+        self.user.delete()
+        self.assertEqual(self.profile(**headers).status_code, 401)
+
+    def test_basic_credentials_are_verified_once(self):
+        with mock.patch.object(base_user, 'check_password', wraps=base_user.check_password) as check_password:
+            self.assertEqual(self.profile(**self.basic()).status_code, 200)
+            self.assertEqual(self.profile(**self.basic()).status_code, 200)
+        self.assertEqual(check_password.call_count, 1)
+        # Only an HMAC of the credentials is kept
+        self.assertNotIn('secret', repr(authentication._credentials._entries))
+
+    def test_wrong_basic_password_is_not_cached(self):
+        self.assertEqual(self.profile(**self.basic('wrong')).status_code, 401)
+        self.assertEqual(self.profile(**self.basic('wrong')).status_code, 401)
+        self.assertEqual(self.profile(**self.basic()).status_code, 200)
+
+    def test_password_change_invalidates_cached_basic_credentials(self):
+        self.assertEqual(self.profile(**self.basic()).status_code, 200)
+        self.user.set_password('changed')
+        self.user.save()
+        self.assertEqual(self.profile(**self.basic()).status_code, 401)
+        self.assertEqual(self.profile(**self.basic('changed')).status_code, 200)
+
+    @override_settings(AUTH_CACHE_TTL=0)
+    def test_basic_cache_entries_expire(self):
+        self.profile(**self.basic())
+        with mock.patch.object(base_user, 'check_password', wraps=base_user.check_password) as check_password:
+            self.assertEqual(self.profile(**self.basic()).status_code, 200)
+        self.assertEqual(check_password.call_count, 1)
+
+    def test_server_timing_header(self):
+        response = self.profile(**self.bearer())
+        self.assertRegex(response['Server-Timing'], SERVER_TIMING)
+        # Also on responses that never reach a view
+        self.assertRegex(self.client.get('/no-such-page/')['Server-Timing'], SERVER_TIMING)
+
+
+class ProjectTokenTests(FakeRedisMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        authentication._api_tokens.discard(lambda key, value: True)
+        self.addCleanup(authentication._api_tokens.discard, lambda key, value: True)
+        self.user = User.objects.create_user('owner')
+        self.vector_db = VectorDatabase.objects.create(user=self.user, name='Tokened')
+        self.other_db = VectorDatabase.objects.create(user=self.user, name='Other')
+        self.token, self.key = ProjectAPIToken.issue(self.vector_db)
+        self.client = APIClient()
+
+    def query(self, project_id, key=None):
+        # No query text: a request that gets past authentication is answered 400
+        return self.client.post(reverse('query_documents'), {'project_id': project_id}, format='json',
+                                HTTP_AUTHORIZATION=f'Token {key or self.key}')
+
+    def test_key_is_stored_hashed(self):
+        self.assertEqual(self.token.key_hash, ProjectAPIToken.hash_key(self.key))
+        self.assertNotIn(self.key, [str(value) for value in ProjectAPIToken.objects.values_list().get()])
+        self.assertEqual(self.query(self.vector_db.project_id).status_code, 400)
+        # The stored hash is not a key
+        self.assertEqual(self.query(self.vector_db.project_id, key=self.token.key_hash).status_code, 401)
+        self.assertEqual(self.query(self.vector_db.project_id, key=self.key + 'x').status_code, 401)
+
+    def test_last_used_is_recorded(self):
+        self.query(self.vector_db.project_id)
+        self.token.refresh_from_db()
+        self.assertIsNotNone(self.token.last_used_at)
+
+    def test_token_is_limited_to_its_project(self):
+        self.assertEqual(self.query(self.other_db.project_id).status_code, 403)
+        self.assertEqual(self.query(None).status_code, 403)
+
+    def test_token_is_not_accepted_by_other_views(self):
+        response = self.client.get(reverse('user_profile'), HTTP_AUTHORIZATION=f'Token {self.key}')
+        self.assertEqual(response.status_code, 401)
+
+    def test_revoked_token_is_rejected_at_once(self):
+        self.assertEqual(self.query(self.vector_db.project_id).status_code, 400)
+        self.token.delete()
+        self.assertEqual(self.query(self.vector_db.project_id).status_code, 401)
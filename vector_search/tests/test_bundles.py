@@ -0,0 +1,132 @@
+import io
+import os
+import json
+import pickle
+import hashlib
+import pathlib
+import numpy as np
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from .. import bundles, index_store
+from ..models import VectorDatabase
+from .utils import FakeRedisMixin, TempMediaMixin
+
+
+class Touch:
+    """Unpickling this creates `path`: proof that a pickle from the bundle was loaded."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __reduce__(self):
+        return pathlib.Path.touch, (pathlib.Path(self.path),)
+
+
+def _chunks(count):
+    from langchain_core.documents import Document as LangchainDocument
+
+    return [LangchainDocument(page_content=f'chunk {i}', metadata={'source': 'doc.txt', 'start_index': i * 10})
+            for i in range(count)]
+
+
+def _bundle(manifest, members):
+    manifest['files'] = {name: {'sha256': hashlib.sha256(data).hexdigest(), 'size': len(data)} for name, data in members}
+    return io.BytesIO(b''.join(bundles.iter_bundle(manifest, members)))
+
+
+@override_settings(SHARED_INDEX_ENABLED=False)
+class BundleTests(FakeRedisMixin, TempMediaMixin, TestCase):
+    def setUp(self):
+        import faiss
+
+        super().setUp()
+        self.user = User.objects.create_user('owner', password='x')
+        self.vector_db = VectorDatabase.objects.create(user=self.user, name='Source', embedding_model='test-model')
+        self.vectors = np.random.default_rng(0).random((20, 8), dtype='float32')
+        index = faiss.IndexFlatL2(8)
+        index.add(self.vectors)
+        index_store.publish_index(self.vector_db, index, _chunks(20), {'index_factory': 'Flat'})
+        self.marker = os.path.join(self.media_root, 'unpickled')
+
+    def _manifest(self, num_chunks=20, dimension=8, **project):
+        return {
+            'bundle_format': bundles.BUNDLE_FORMAT,
+            'project': dict({'name': 'Imported'}, **project),
+            'index': {'num_chunks': num_chunks, 'dimension': dimension},
+            'documents': [],
+        }
+
+    def _chunks_json(self, count=20):
+        return json.dumps([{'page_content': c.page_content, 'metadata': c.metadata} for c in _chunks(count)]).encode()
+
+    def _import(self, fileobj):
+        return bundles.import_bundle(fileobj, self.user)
+
+    def test_round_trip(self):
+        data = io.BytesIO()
+        bundles.export_bundle(self.vector_db, data)
+        data.seek(0)
+        copy = self._import(data)
+
+        self.assertNotEqual(copy.project_id, self.vector_db.project_id)
+        self.assertEqual((copy.num_chunks, copy.embedding_model), (20, 'test-model'))
+        index, chunks = index_store.load_index(copy)
+        self.assertEqual([c.page_content for c in chunks], [c.page_content for c in _chunks(20)])
+        self.assertEqual(chunks[3].metadata, {'source': 'doc.txt', 'start_index': 30})
+        np.testing.assert_array_equal(index.reconstruct_n(0, 20), self.vectors)
+
+    def test_round_trip_into_shared_index(self):
+        data = io.BytesIO()
+        bundles.export_bundle(self.vector_db, data)
+        data.seek(0)
+        with override_settings(SHARED_INDEX_ENABLED=True):
+            copy = self._import(data)
+            self.assertTrue(copy.shared_shard)
+            index, chunks = index_store.load_index(copy)
+        self.assertEqual(len(chunks), 20)
+        _, ids = index.search(self.vectors[5:6], 1)
+        self.assertEqual(ids[0][0], 5)
+
+    def test_pickled_chunks_are_rejected(self):
+        members = [(bundles.VECTORS_MEMBER, self.vectors.astype('<f4').tobytes()),
+                   (bundles.CHUNKS_MEMBER, pickle.dumps(Touch(self.marker)))]
+        with self.assertRaises(bundles.BundleError):
+            self._import(_bundle(self._manifest(), members))
+        self.assertFalse(os.path.exists(self.marker))
+        self.assertEqual(VectorDatabase.objects.count(), 1)
+
+    def test_format_1_bundle_with_pickle_is_rejected(self):
+        manifest = dict(self._manifest(), bundle_format=1)
+        members = [('index/faiss_index', b'\0' * 64), ('index/chunks.pkl', pickle.dumps(Touch(self.marker)))]
+        with self.assertRaises(bundles.BundleError):
+            self._import(_bundle(manifest, members))
+        self.assertFalse(os.path.exists(self.marker))
+        self.assertEqual(VectorDatabase.objects.count(), 1)
+
+    def test_unexpected_member_is_rejected(self):
+        members = [(bundles.VECTORS_MEMBER, self.vectors.astype('<f4').tobytes()),
+                   (bundles.CHUNKS_MEMBER, self._chunks_json()),
+                   ('index/chunks.pkl', pickle.dumps(Touch(self.marker)))]
+        with self.assertRaises(bundles.BundleError):
+            self._import(_bundle(self._manifest(), members))
+        self.assertFalse(os.path.exists(self.marker))
+
+    def test_vectors_must_match_the_manifest(self):
+        members = [(bundles.VECTORS_MEMBER, self.vectors[:10].astype('<f4').tobytes()),
+                   (bundles.CHUNKS_MEMBER, self._chunks_json())]
+        with self.assertRaises(bundles.BundleError):
+            self._import(_bundle(self._manifest(), members))
+
+    def test_malformed_chunks_are_rejected(self):
+        chunks = json.dumps([{'page_content': 1}] * 20).encode()
+        members = [(bundles.VECTORS_MEMBER, self.vectors.astype('<f4').tobytes()), (bundles.CHUNKS_MEMBER, chunks)]
+        with self.assertRaises(bundles.BundleError):
+            self._import(_bundle(self._manifest(), members))
+        self.assertEqual(VectorDatabase.objects.count(), 1)
+
+    def test_unknown_index_type_is_dropped(self):
+        members = [(bundles.VECTORS_MEMBER, self.vectors.astype('<f4').tobytes()),
+                   (bundles.CHUNKS_MEMBER, self._chunks_json())]
+        manifest = self._manifest(index_factory='IVF1048576,Flat', search_params={'nprobe': 4, 'other': 'x'})
+        copy = self._import(_bundle(manifest, members))
+        self.assertEqual((copy.index_factory, copy.search_params), ('', {'nprobe': 4}))
@@ -0,0 +1,80 @@
+import re
+from django.test import SimpleTestCase
+from langchain_core.documents import Document as LangchainDocument
+from ..chunking import UNIT_CHARACTERS, UNIT_TOKENS, token_chunk_documents
+from ..dedup import dedupe_chunks, jaccard, shingles
+from ..vector_db_utils import resolve_chunking
+
+
+def whitespace_tokenizer(texts, **kwargs):
+    # Stands in for a fast tokenizer: one token per word, with character offsets
+    return {'offset_mapping': [[match.span() for match in re.finditer(r'\S+', text)] for text in texts]}
+
+
+def chunk(text, source='a.txt'):
+    return LangchainDocument(page_content=text, metadata={'source': source})
+
+
+class TokenChunkingTests(SimpleTestCase):
+    def test_chunks_respect_the_token_budget_and_overlap(self):
+        text = ' '.join(f'w{i}' for i in range(100))
+        chunks = token_chunk_documents([chunk(text)], whitespace_tokenizer, chunk_size=20, chunk_overlap=5)
+        self.assertTrue(all(c.metadata['token_count'] <= 20 for c in chunks))
+        words = [c.page_content.split() for c in chunks]
+        for previous, current in zip(words, words[1:]):
+            self.assertEqual(previous[-5:], current[:5])
+        self.assertEqual(words[-1][-1], 'w99')
+
+    def test_chunk_text_is_sliced_from_the_original(self):
+        text = 'alpha  beta\tgamma delta epsilon zeta'
+        chunks = token_chunk_documents([chunk(text)], whitespace_tokenizer, chunk_size=3, chunk_overlap=1)
+        for c in chunks:
+            start = c.metadata['start_index']
+            self.assertEqual(text[start:start + len(c.page_content)], c.page_content)
+            self.assertEqual(c.metadata['source'], 'a.txt')
+
+    def test_paragraph_breaks_are_preferred(self):
+        first = ' '.join(f'a{i}' for i in range(15))
+        text = first + '\n\n' + ' '.join(f'b{i}' for i in range(15))
+        chunks = token_chunk_documents([chunk(text)], whitespace_tokenizer, chunk_size=18, chunk_overlap=0)
+        self.assertEqual(chunks[0].page_content, first)
+
+    def test_overlap_must_be_smaller_than_size(self):
+        with self.assertRaises(ValueError):
+            token_chunk_documents([chunk('a b c')], whitespace_tokenizer, chunk_size=4, chunk_overlap=4)
+
+    def test_default_overlap_depends_on_the_unit(self):
+        self.assertEqual(resolve_chunking(None, UNIT_TOKENS, 256)['chunk_overlap'], 32)
+        self.assertEqual(resolve_chunking(None, UNIT_CHARACTERS), {'chunk_unit': UNIT_CHARACTERS, 'chunk_size': 1000,
+                                                                   'chunk_overlap': 200})
+        self.assertEqual(resolve_chunking(None, UNIT_CHARACTERS, None, 0)['chunk_overlap'], 0)
+
+
+class DedupTests(SimpleTestCase):
+    base = ('The quick brown fox jumps over the lazy dog while the farmer watches from the porch '
+            'and the sun sets slowly behind the distant hills of the quiet valley')
+
+    def test_near_duplicates_are_dropped_in_order(self):
+        chunks = [
+            chunk(self.base, 'a.txt'),
+            chunk('Something entirely different about databases and vector search indexes', 'a.txt'),
+            chunk(self.base + ' today', 'b.txt'),
+        ]
+        kept, removed = dedupe_chunks(chunks, threshold=0.8)
+        self.assertEqual(removed, 1)
+        self.assertEqual([c.page_content for c in kept], [chunks[0].page_content, chunks[1].page_content])
+        self.assertEqual(kept[0].metadata['duplicate_sources'], ['b.txt'])
+
+    def test_threshold_above_one_disables_dedup(self):
+        chunks = [chunk(self.base), chunk(self.base)]
+        self.assertEqual(dedupe_chunks(chunks, threshold=1.1), (chunks, 0))
+
+    def test_exact_copies_are_removed_at_threshold_one(self):
+        kept, removed = dedupe_chunks([chunk(self.base), chunk(self.base)], threshold=1.0)
+        self.assertEqual((len(kept), removed), (1, 1))
+
+    def test_shingles_and_jaccard(self):
+        self.assertEqual(shingles('One two'), {'one two'})
+        self.assertEqual(shingles('a b c d'), {'a b c', 'b c d'})
+        self.assertEqual(jaccard({'x'}, {'x', 'y'}), 0.5)
+        self.assertEqual(jaccard(set(), set()), 1.0)
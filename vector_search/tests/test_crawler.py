@@ -0,0 +1,114 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from django.test import SimpleTestCase
+from .. import crawler
+
+ETAG = '"v1"'
+PAGE = b'<html><body><p>Hello</p></body></html>'
+
+
+class Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body=b'', content_type='text/html; charset=utf-8', headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if body:
+            self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        base = f'http://{self.headers["Host"]}'
+        if self.path.split('?')[0] == '/page':
+            if self.headers.get('If-None-Match') == ETAG:
+                self._send(304, headers={'ETag': ETAG})
+            else:
+                self._send(200, PAGE, headers={'ETag': ETAG, 'Last-Modified': 'Mon, 19 Oct 2026 10:00:00 GMT'})
+        elif self.path == '/always_304':
+            self._send(304)
+        elif self.path == '/sitemap_index.xml':
+            body = (f'<?xml version="1.0"?><sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+                    f'<sitemap><loc>{base}/sitemap1.xml</loc></sitemap>'
+                    f'<sitemap><loc>{base}/sitemap2.xml</loc></sitemap></sitemapindex>')
+            self._send(200, body.encode(), 'application/xml')
+        elif self.path == '/sitemap_empty_loc.xml':
+            body = (f'<?xml version="1.0"?><urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+                    f'<url><loc></loc></url><url><loc> </loc></url><url><loc>{base}/p1-0</loc></url></urlset>')
+            self._send(200, body.encode(), 'application/xml')
+        elif self.path in ('/sitemap1.xml', '/sitemap2.xml'):
+            number = self.path[8]
+            urls = ''.join(f'<url><loc>{base}/p{number}-{i}</loc></url>' for i in range(3))
+            body = f'<?xml version="1.0"?><urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{urls}</urlset>'
+            self._send(200, body.encode(), 'application/xml')
+        else:
+            self._send(404, b'missing')
+
+
+class CrawlerTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        cls.base = f'http://127.0.0.1:{cls.server.server_address[1]}'
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.session = crawler.build_session(pool_size=2)
+
+    def test_fetch_returns_content_and_validators(self):
+        result = crawler.fetch_page(self.session, f'{self.base}/page')
+        self.assertEqual(result.status_code, 200)
+        self.assertTrue(result.is_html)
+        self.assertIn('Hello', result.content)
+        self.assertEqual(result.etag, ETAG)
+        self.assertTrue(result.last_modified)
+
+    def test_conditional_get_is_not_modified(self):
+        result = crawler.fetch_page(self.session, f'{self.base}/page', etag=ETAG, last_modified='x')
+        self.assertTrue(result.not_modified)
+        self.assertIsNone(result.content)
+        # The stored validators are carried over for the next fetch
+        self.assertEqual((result.etag, result.last_modified), (ETAG, 'x'))
+
+    def test_unconditional_not_modified_is_an_error(self):
+        result = crawler.fetch_page(self.session, f'{self.base}/always_304')
+        self.assertFalse(result.not_modified)
+        self.assertIsNotNone(result.error)
+
+    def test_errors_are_reported_not_raised(self):
+        result = crawler.fetch_page(self.session, f'{self.base}/missing')
+        self.assertEqual(result.status_code, 404)
+        self.assertIsNotNone(result.error)
+
+    def test_crawl_keeps_input_order(self):
+        urls = [f'{self.base}/page', f'{self.base}/missing', f'{self.base}/page?again']
+        results = crawler.crawl(urls, validators={urls[2]: (ETAG, '')}, session=self.session, max_workers=3, per_host=2)
+        self.assertEqual([r.url for r in results], urls)
+        self.assertEqual([r.status_code for r in results], [200, 404, 304])
+
+    def test_sitemap_index_is_followed(self):
+        urls = crawler.parse_sitemap(self.session, f'{self.base}/sitemap_index.xml')
+        self.assertEqual(urls, [f'{self.base}/p{n}-{i}' for n in (1, 2) for i in range(3)])
+
+    def test_sitemap_limit(self):
+        urls = crawler.parse_sitemap(self.session, f'{self.base}/sitemap_index.xml', limit=4)
+        self.assertEqual(len(urls), 4)
+
+    def test_sitemap_empty_locations_are_skipped(self):
+        urls = crawler.parse_sitemap(self.session, f'{self.base}/sitemap_empty_loc.xml')
+        self.assertEqual(urls, [f'{self.base}/p1-0'])
+
+    def test_url_validation(self):
+        self.assertTrue(crawler.is_valid_url('https://example.com/a'))
+        self.assertFalse(crawler.is_valid_url('ftp://example.com/a'))
+        self.assertFalse(crawler.is_valid_url('not a url'))
@@ -0,0 +1,86 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from django.test import SimpleTestCase, override_settings
+from .. import embedding_backends
+
+try:
+    import onnx  # noqa: F401
+    import onnxruntime  # noqa: F401
+except ImportError:
+    onnxruntime = None
+
+WORDS = ('the quick brown fox jumps over lazy dog a vector index search query document chunk '
+         'embedding model galileo apollo moon telescope war edo period japan artificial intelligence').split()
+TEXTS = [
+    'the quick brown fox jumps over the lazy dog',
+    'galileo and the telescope',
+    'apollo moon',
+    'a vector index search query over document chunk embedding',
+    'edo period japan',
+    'artificial intelligence model',
+    'unknownword war',
+]
+
+
+def tiny_model(folder):
+    """A small randomly initialised BERT sentence-transformer with mean pooling and normalization, built offline."""
+    import torch
+    from sentence_transformers import SentenceTransformer, models
+    from transformers import BertConfig, BertModel, BertTokenizerFast
+
+    vocab_path = os.path.join(folder, 'vocab.txt')
+    with open(vocab_path, 'w') as f:
+        f.write('\n'.join(['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]'] + list(WORDS)))
+    torch.manual_seed(0)
+    config = BertConfig(vocab_size=len(WORDS) + 5, hidden_size=32, num_hidden_layers=2, num_attention_heads=2,
+                        intermediate_size=64, max_position_embeddings=64)
+    BertModel(config).save_pretrained(folder)
+    BertTokenizerFast(vocab_file=vocab_path).save_pretrained(folder)
+
+    transformer = models.Transformer(folder, max_seq_length=32)
+    pooling = models.Pooling(transformer.get_word_embedding_dimension(), pooling_mode='mean')
+    return SentenceTransformer(modules=[transformer, pooling, models.Normalize()], device='cpu')
+
+
+def cosine(a, b):
+    return (a * b).sum(axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+
+
+@unittest.skipIf(onnxruntime is None, 'needs onnxruntime and onnx')
+class OnnxParityTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.folder = tempfile.mkdtemp(prefix='qq-model-')
+        cls.model = tiny_model(cls.folder)
+        cls.expected = embedding_backends.TorchEncoder(cls.model).encode(TEXTS, batch_size=3)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.folder, ignore_errors=True)
+        super().tearDownClass()
+
+    def encoder(self, backend):
+        with override_settings(EMBEDDING_ONNX_DIR=os.path.join(self.folder, 'onnx'), EMBEDDING_NUM_THREADS=1):
+            return embedding_backends.build_encoder(self.model, 'tiny/bert', backend)
+
+    def test_onnx_matches_torch(self):
+        encoder = self.encoder(embedding_backends.BACKEND_ONNX)
+        self.assertEqual((encoder.pooling_mode, encoder.normalize, encoder.dimension), ('mean', True, 32))
+        # Batches of 3 pad some texts, which pooling must ignore
+        embeddings = encoder.encode(TEXTS, batch_size=3)
+        self.assertEqual((embeddings.shape, embeddings.dtype), (self.expected.shape, np.float32))
+        np.testing.assert_allclose(embeddings, self.expected, atol=1e-4)
+        np.testing.assert_allclose(np.linalg.norm(embeddings, axis=1), 1, atol=1e-5)
+
+    def test_int8_is_close_to_torch(self):
+        encoder = self.encoder(embedding_backends.BACKEND_ONNX_INT8)
+        self.assertTrue(encoder.path.endswith('model.int8.onnx'))
+        embeddings = encoder.encode(TEXTS, batch_size=3)
+        self.assertGreater(cosine(embeddings, self.expected).min(), 0.999)
+
+    def test_empty_input(self):
+        self.assertEqual(self.encoder(embedding_backends.BACKEND_ONNX).encode([]).shape, (0, 32))
@@ -0,0 +1,65 @@
+import threading
+from unittest import mock
+import numpy as np
+from django.test import SimpleTestCase, override_settings
+from .. import embedding_pool
+
+
+class FakePool:
+    """Stands in for a spawned pool: encodes in the calling thread, pausing while `gate` is closed."""
+    gate = None
+
+    def __init__(self, processes, initializer, initargs):
+        self.key = initargs[:2]
+        self.closed = False
+
+    def imap_unordered(self, func, jobs):
+        for position, texts in jobs:
+            if FakePool.gate is not None:
+                FakePool.gate.wait(5)
+            assert not self.closed, 'pool shut down while a job was using it'
+            yield position, np.full((len(texts), 2), len(self.key[0]), dtype='float32'), 1, 0.0
+
+    def close(self):
+        self.closed = True
+
+    def join(self):
+        pass
+
+
+@override_settings(EMBEDDING_POOL_PROCESSES=2)
+class EmbeddingPoolTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(embedding_pool.multiprocessing, 'get_context',
+                                    return_value=mock.Mock(Pool=FakePool))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(embedding_pool.shutdown_pool)
+
+    def test_other_model_waits_for_the_running_job(self):
+        FakePool.gate = threading.Event()
+        self.addCleanup(setattr, FakePool, 'gate', None)
+        results = {}
+
+        def run(model_name):
+            results[model_name] = embedding_pool.encode_batches(['a', 'b', 'c'], [[0, 1], [2]], model_name, 'torch')
+
+        first = threading.Thread(target=run, args=('model',))
+        first.start()
+        # Asks for a different model while the first job is still encoding
+        second = threading.Thread(target=run, args=('other-model',))
+        second.start()
+        second.join(0.2)
+        FakePool.gate.set()
+        first.join(5)
+        second.join(5)
+
+        np.testing.assert_array_equal(results['model'][0], np.full((3, 2), 5))
+        np.testing.assert_array_equal(results['other-model'][0], np.full((3, 2), 11))
+        self.assertEqual(embedding_pool._pool_key, ('other-model', 'torch'))
+
+    def test_pool_is_reused_for_the_same_model(self):
+        embedding_pool.encode_batches(['a'], [[0]], 'model', 'torch')
+        pool = embedding_pool._pool
+        embedding_pool.encode_batches(['b'], [[0]], 'model', 'torch')
+        self.assertIs(embedding_pool._pool, pool)
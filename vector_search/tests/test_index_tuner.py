@@ -0,0 +1,148 @@
+from io import StringIO
+from unittest import mock
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from .. import index_store, index_tuner, ingest_lock
+from ..models import VectorDatabase
+from ..vector_db_utils import MIN_TRAINING_VECTORS
+from .utils import FakeRedisMixin, TempMediaMixin
+
+
+class MeasureTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        import faiss
+
+        super().setUpClass()
+        # Clustered, like embeddings of related chunks
+        rng = np.random.default_rng(0)
+        centers = rng.random((32, 16), dtype='float32') * 4
+        rows = MIN_TRAINING_VECTORS + 200
+        vectors = (centers[rng.integers(0, 32, rows)] + rng.normal(0, 0.3, (rows, 16))).astype('float32')
+        cls.queries, cls.indexed = vectors[:200], vectors[200:]
+        exact = faiss.IndexFlatL2(16)
+        exact.add(cls.indexed)
+        _, cls.truth = exact.search(cls.queries, 5)
+
+    def test_candidates_by_size(self):
+        self.assertEqual(index_tuner.candidates(MIN_TRAINING_VECTORS - 1, 32), [('Flat', None, (None,))])
+        found = {factory: values for factory, _, values in index_tuner.candidates(20000, 32)}
+        self.assertEqual(set(found), {'Flat', 'IVF128,Flat', 'IVF128,PQ8', 'IVF128,PQ4', 'IVF512,Flat',
+                                      'IVF512,PQ8', 'IVF512,PQ4', 'HNSW16,Flat', 'HNSW32,Flat'})
+        # nprobe never reaches the number of lists, where IVF is just a slower flat search
+        self.assertEqual(max(found['IVF128,Flat']), 64)
+        # Too few vectors per list for 512 lists
+        self.assertNotIn('IVF512,Flat', {factory for factory, _, _ in index_tuner.candidates(15000, 32)})
+
+    def measure(self, factory, target):
+        values = tuple(value for value in index_tuner.NPROBE_VALUES if value < 128)
+        results = index_tuner.measure(self.indexed, self.queries, self.truth, factory, 'nprobe', values, 5, target)
+        return results, values
+
+    def test_sweep_stops_at_the_target(self):
+        results, values = self.measure('IVF128,Flat', 0.9)
+        self.assertLess(len(results), len(values))
+        self.assertGreaterEqual(results[-1]['recall'], 0.9)
+        self.assertTrue(all(result['recall'] < 0.9 for result in results[:-1]))
+        self.assertEqual([result['search_params']['nprobe'] for result in results], list(values[:len(results)]))
+
+    def test_sweep_stops_when_recall_levels_off(self):
+        # Quantization caps PQ4 well below an unreachable target
+        results, values = self.measure('IVF128,PQ4', 1.5)
+        self.assertLess(len(results), len(values))
+        self.assertLess(results[-1]['recall'] - results[-3]['recall'], index_tuner.MIN_RECALL_GAIN)
+
+
+def _result(factory, p50_ms, recall=1.0):
+    return {'index_factory': factory, 'search_params': {}, 'recall': recall, 'p50_ms': p50_ms,
+            'bytes': 1, 'build_seconds': 0.0}
+
+
+@override_settings(SHARED_INDEX_ENABLED=False, INDEX_STORAGE_BACKEND='', INDEX_TUNE_QUERIES=50)
+class TuneTests(FakeRedisMixin, TempMediaMixin, TestCase):
+    CANDIDATES = [('Flat', None, (None,)), ('IVF64,Flat', 'nprobe', (8,)), ('HNSW16,Flat', 'efSearch', (32,))]
+
+    def setUp(self):
+        import faiss
+        from langchain_core.documents import Document as LangchainDocument
+
+        super().setUp()
+        self.vector_db = VectorDatabase.objects.create(user=User.objects.create_user('owner'), name='Tuned')
+        self.vectors = np.random.default_rng(1).random((300, 8), dtype='float32')
+        index = faiss.IndexFlatL2(8)
+        index.add(self.vectors)
+        chunks = [LangchainDocument(page_content=f'chunk {i}') for i in range(300)]
+        index_store.publish_index(self.vector_db, index, chunks, {'build_key': 'key1'})
+        self.vector_db.refresh_from_db()
+
+    def tune(self, timings, apply=False):
+        calls = []
+
+        def measure(embeddings, queries, truth, factory, param_name, values, k, target):
+            calls.append((embeddings, queries))
+            return [_result(factory, timings[factory])]
+
+        with mock.patch.object(index_tuner, 'candidates', return_value=self.CANDIDATES), \
+                mock.patch.object(index_tuner, 'measure', side_effect=measure):
+            report = index_tuner.tune(self.vector_db, apply=apply)
+        return report, calls
+
+    def test_queries_are_held_out_of_the_measured_index(self):
+        report, calls = self.tune({'Flat': 2.0, 'IVF64,Flat': 1.5, 'HNSW16,Flat': 1.0})
+        indexed, queries = calls[0]
+        self.assertEqual((len(indexed), len(queries), report['num_queries']), (250, 50, 50))
+        self.assertEqual(set(map(bytes, indexed)) & set(map(bytes, queries)), set())
+        self.assertEqual(set(map(bytes, indexed)) | set(map(bytes, queries)), set(map(bytes, self.vectors)))
+
+    def test_fastest_passing_candidate_is_chosen(self):
+        report, _ = self.tune({'Flat': 2.0, 'IVF64,Flat': 1.5, 'HNSW16,Flat': 1.0})
+        self.assertEqual(report['chosen']['index_factory'], 'HNSW16,Flat')
+
+    def test_current_index_is_kept_without_a_clear_speedup(self):
+        with mock.patch.object(index_tuner, '_factory_of', return_value='IVF64,Flat'):
+            report, _ = self.tune({'Flat': 2.0, 'IVF64,Flat': 1.1, 'HNSW16,Flat': 1.0})
+            self.assertEqual(report['chosen']['index_factory'], 'IVF64,Flat')
+            report, _ = self.tune({'Flat': 2.0, 'IVF64,Flat': 1.3, 'HNSW16,Flat': 1.0})
+            self.assertEqual(report['chosen']['index_factory'], 'HNSW16,Flat')
+
+    def test_same_index_type_only_saves_the_choice(self):
+        # Faster alternatives, but not by REINDEX_MIN_SPEEDUP over the current flat index
+        report, _ = self.tune({'Flat': 1.1, 'IVF64,Flat': 1.0, 'HNSW16,Flat': 1.0}, apply=True)
+        self.assertEqual(report['chosen']['index_factory'], 'Flat')
+        self.vector_db.refresh_from_db()
+        self.assertEqual((self.vector_db.index_version, self.vector_db.index_factory), (1, 'Flat'))
+        self.assertIsNotNone(self.vector_db.tuned_at)
+
+    def test_other_index_type_is_published_as_a_new_version(self):
+        import faiss
+
+        self.tune({'Flat': 2.0, 'IVF64,Flat': 1.5, 'HNSW16,Flat': 1.0}, apply=True)
+        self.vector_db.refresh_from_db()
+        self.assertEqual((self.vector_db.index_version, self.vector_db.index_factory), (2, 'HNSW16,Flat'))
+        index, chunks = index_store.load_index(self.vector_db)
+        self.assertIsInstance(faiss.downcast_index(index), faiss.IndexHNSWFlat)
+        # Every vector, including the ones held out as queries, in chunk order
+        self.assertEqual((index.ntotal, len(chunks)), (300, 300))
+        _, ids = index.search(self.vectors[:10], 1)
+        self.assertEqual(list(ids[:, 0]), list(range(10)))
+        manifest = index_store.version_manifest(self.vector_db)
+        self.assertEqual((manifest['build_key'], manifest['tuning']['chosen']['index_factory']), ('key1', 'HNSW16,Flat'))
+
+    @mock.patch('vector_search.management.commands.tune_indexes.tune')
+    def test_sync_command_holds_the_ingest_lock(self, tune):
+        tune.return_value = {'num_vectors': 300, 'recall_target': 0.95, 'k': 5, 'sampled': False,
+                             'chosen': None, 'results': []}
+        ingest_lock.try_acquire(self.vector_db.project_id, 'ingest-run')
+        out = StringIO()
+        call_command('tune_indexes', '--sync', '--project', self.vector_db.project_id, stdout=out)
+        self.assertIn('being processed, skipped', out.getvalue())
+        tune.assert_not_called()
+
+        ingest_lock.release(self.vector_db.project_id, 'ingest-run')
+        tune.side_effect = lambda *args, **kwargs: (
+            self.assertTrue(ingest_lock.current_run(self.vector_db.project_id)[0].startswith('tune-')) or tune.return_value)
+        call_command('tune_indexes', '--sync', '--project', self.vector_db.project_id, stdout=StringIO())
+        tune.assert_called_once()
+        self.assertEqual(ingest_lock.current_run(self.vector_db.project_id), (None, None))
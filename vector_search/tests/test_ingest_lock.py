@@ -0,0 +1,125 @@
+import time
+from unittest import mock
+from django.test import SimpleTestCase, override_settings
+from .. import ingest_lock, queues
+from .utils import FakeRedisMixin
+
+
+@mock.patch.object(ingest_lock, 'start_run')
+class IngestLockTests(FakeRedisMixin, SimpleTestCase):
+    def test_one_run_per_project(self, start_run):
+        self.assertTrue(ingest_lock.try_acquire('p1', 'task-a'))
+        # Retries and redeliveries keep the task id and re-enter the lock
+        self.assertTrue(ingest_lock.try_acquire('p1', 'task-a'))
+        self.assertFalse(ingest_lock.try_acquire('p1', 'task-b'))
+        self.assertTrue(ingest_lock.try_acquire('p2', 'task-b'))
+        self.assertEqual(ingest_lock.current_run('p1')[0], 'task-a')
+
+    def test_release_frees_the_lock(self, start_run):
+        ingest_lock.try_acquire('p1', 'task-a')
+        self.assertIsNone(ingest_lock.release('p1', 'task-a'))
+        self.assertEqual(ingest_lock.current_run('p1'), (None, None))
+
+    def test_only_the_holder_can_release(self, start_run):
+        ingest_lock.try_acquire('p1', 'task-a')
+        ingest_lock.release('p1', 'task-b')
+        self.assertEqual(ingest_lock.current_run('p1')[0], 'task-a')
+
+    def test_follow_ups_coalesce_and_take_over_the_lock(self, start_run):
+        ingest_lock.try_acquire('p1', 'task-a')
+        first = ingest_lock.queue_follow_up('p1', 1)
+        second = ingest_lock.queue_follow_up('p1', 1)
+        self.assertEqual(first, second)
+        start_run.assert_not_called()
+
+        self.assertEqual(ingest_lock.release('p1', 'task-a'), first)
+        self.assertEqual(ingest_lock.current_run('p1')[0], first)
+
+    def test_follow_up_starts_when_the_run_already_ended(self, start_run):
+        follow_up = ingest_lock.queue_follow_up('p1', 1)
+        start_run.assert_called_once_with('p1', 1, follow_up)
+        self.assertEqual(ingest_lock.current_run('p1')[0], follow_up)
+
+    def test_request_run_states(self, start_run):
+        task_id, state = ingest_lock.request_run('p1', 1, lambda started_at: False)
+        self.assertEqual(state, 'started')
+        start_run.assert_called_once_with('p1', 1, task_id)
+
+        self.assertEqual(ingest_lock.request_run('p1', 1, lambda started_at: False), (task_id, 'running'))
+        follow_up, state = ingest_lock.request_run('p1', 1, lambda started_at: True)
+        self.assertEqual(state, 'queued')
+        self.assertNotEqual(follow_up, task_id)
+
+    def test_extend_only_by_the_holder(self, start_run):
+        ingest_lock.try_acquire('p1', 'task-a')
+        lock_key = ingest_lock.LOCK_KEY.format(project_id='p1')
+        self.redis.expire(lock_key, 10)
+        self.assertFalse(ingest_lock.extend('p1', 'task-b'))
+        self.assertLessEqual(self.redis.ttl(lock_key), 10)
+        self.assertTrue(ingest_lock.extend('p1', 'task-a'))
+        self.assertGreater(self.redis.ttl(lock_key), 10)
+        self.assertFalse(ingest_lock.extend('p2', 'task-a'))
+
+
+class StartRunTests(FakeRedisMixin, SimpleTestCase):
+    @mock.patch('vector_search.queues.choose_queue', return_value='ingest_fast')
+    @mock.patch('vector_search.models.VectorDatabase.objects')
+    def test_lock_is_released_when_the_task_cannot_be_queued(self, objects, choose_queue):
+        from ..tasks import process_documents_task
+
+        with mock.patch.object(process_documents_task, 'apply_async', side_effect=OSError('broker down')):
+            with self.assertRaises(OSError):
+                ingest_lock.request_run('p1', 1, lambda started_at: False)
+        self.assertEqual(ingest_lock.current_run('p1'), (None, None))
+
+        with mock.patch.object(process_documents_task, 'apply_async') as apply_async:
+            task_id, state = ingest_lock.request_run('p1', 1, lambda started_at: False)
+        self.assertEqual(state, 'started')
+        self.assertEqual(apply_async.call_args.kwargs['task_id'], task_id)
+
+    @override_settings(INGEST_LOCK_TTL=100)
+    def test_progress_of_a_long_build_renews_the_lock(self):
+        from .. import tasks
+
+        ingest_lock.try_acquire('p1', 'task-a')
+        lock_key = ingest_lock.LOCK_KEY.format(project_id='p1')
+        report = mock.Mock()
+        with mock.patch.object(tasks.time, 'monotonic', return_value=0):
+            progress = tasks._renewing_lock(report, 'p1', 1, 'task-a')
+        self.redis.expire(lock_key, 5)
+        with mock.patch.object(tasks.time, 'monotonic', return_value=5):
+            progress('embedding', 1, 10)
+        self.assertLessEqual(self.redis.ttl(lock_key), 5)
+        with mock.patch.object(tasks.time, 'monotonic', return_value=20):
+            progress('embedding', 2, 10)
+        self.assertGreater(self.redis.ttl(lock_key), 5)
+        self.assertEqual(self.redis.zrange(queues.ACTIVE_KEY.format(user_id=1), 0, -1), ['task-a'])
+        self.assertEqual(report.call_count, 2)
+
+
+@override_settings(INGEST_MAX_ACTIVE_PER_USER=2)
+class UserRunSlotTests(FakeRedisMixin, SimpleTestCase):
+    def test_runs_per_user_are_limited(self):
+        self.assertTrue(queues.try_start_user_run(1, 'a'))
+        self.assertTrue(queues.try_start_user_run(1, 'b'))
+        self.assertFalse(queues.try_start_user_run(1, 'c'))
+        # A retry of a task that holds a slot keeps it; other users are unaffected
+        self.assertTrue(queues.try_start_user_run(1, 'a'))
+        self.assertTrue(queues.try_start_user_run(2, 'c'))
+
+        queues.finish_user_run(1, 'a')
+        self.assertTrue(queues.try_start_user_run(1, 'c'))
+
+    def test_slots_of_dead_workers_expire(self):
+        self.assertTrue(queues.try_start_user_run(1, 'a'))
+        self.assertTrue(queues.try_start_user_run(1, 'b'))
+        later = time.time() + ingest_lock.settings.INGEST_LOCK_TTL + 1
+        with mock.patch.object(queues.time, 'time', return_value=later):
+            self.assertTrue(queues.try_start_user_run(1, 'c'))
+
+    def test_choose_queue_by_project_size(self):
+        small = mock.Mock(num_documents=1, total_bytes=1000)
+        large = mock.Mock(num_documents=1000, total_bytes=1000)
+        self.assertEqual(queues.choose_queue(small), queues.QUEUE_FAST)
+        self.assertEqual(queues.choose_queue(large), queues.QUEUE_BULK)
+
@@ -0,0 +1,80 @@
+import json
+import time
+from unittest import mock
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+from .. import progress
+from .utils import FakeRedisMixin
+
+
+class ConnectionCountTests(FakeRedisMixin, SimpleTestCase):
+    def start(self, state):
+        self.redis.set(progress.LAST_KEY.format(task_id='t1'), json.dumps({'task_id': 't1', 'state': state}))
+        events = progress.stream('t1')
+        # The retry hint, then the stored state
+        next(events)
+        next(events)
+        return events
+
+    def test_open_streams_are_counted_until_closed(self):
+        first, second = self.start('PROGRESS'), self.start('PROGRESS')
+        self.assertEqual((progress.connection_count(), progress.local_connection_count()), (2, 2))
+        first.close()
+        self.assertEqual((progress.connection_count(), progress.local_connection_count()), (1, 1))
+        second.close()
+        self.assertEqual(progress.connection_count(), 0)
+
+    def test_finished_stream_is_not_counted(self):
+        events = self.start('SUCCESS')
+        self.assertEqual(list(events), [])
+        self.assertEqual(progress.connection_count(), 0)
+
+    def test_stream_of_a_killed_worker_expires(self):
+        # Registered long ago and never renewed or removed
+        with mock.patch.object(progress.time, 'time', return_value=time.time() - 3600):
+            progress._renew('killed')
+        events = self.start('PROGRESS')
+        self.assertEqual(progress.connection_count(), 1)
+        self.assertNotIn('killed', self.redis.zrange(progress.CONNECTIONS_KEY, 0, -1))
+        events.close()
+
+
+class StreamTicketTests(FakeRedisMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('streamer')
+        self.redis.set(progress.LAST_KEY.format(task_id='t1'), json.dumps({'task_id': 't1', 'state': 'SUCCESS'}))
+
+    def ticket(self, task_id='t1'):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post(reverse('task_progress_ticket'), {'task_id': task_id}, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.json()['ticket']
+
+    def open(self, ticket, task_id='t1'):
+        return APIClient().get(reverse('task_progress'), {'task_id': task_id, 'ticket': ticket},
+                               HTTP_ACCEPT='text/event-stream')
+
+    def test_ticket_opens_one_stream(self):
+        ticket = self.ticket()
+        response = self.open(ticket)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('event: success', b''.join(response.streaming_content).decode())
+        # Only a hash of the ticket is stored
+        self.assertEqual(self.redis.keys(f'*{ticket}*'), [])
+        self.assertEqual(self.open(ticket).status_code, 401)
+
+    def test_ticket_is_for_one_task(self):
+        self.assertEqual(self.open(self.ticket('t2')).status_code, 401)
+
+    def test_unknown_or_missing_ticket(self):
+        self.assertEqual(self.open('made-up').status_code, 401)
+        self.assertEqual(APIClient().get(reverse('task_progress'), {'task_id': 't1'}).status_code, 401)
+
+    @override_settings(SSE_TICKET_TTL=30)
+    def test_ticket_expires(self):
+        self.ticket()
+        self.assertTrue(0 < self.redis.ttl(self.redis.keys(progress.TICKET_KEY.format(digest='*'))[0]) <= 30)
@@ -0,0 +1,136 @@
+import os
+from unittest import mock
+import numpy as np
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from .. import index_store, shared_index
+from ..models import VectorDatabase
+from .utils import FakeRedisMixin, TempMediaMixin
+
+DIMENSION = 8
+
+
+def _build(count, seed):
+    import faiss
+    from langchain_core.documents import Document as LangchainDocument
+
+    vectors = np.random.default_rng(seed).random((count, DIMENSION), dtype='float32')
+    index = faiss.IndexFlatL2(DIMENSION)
+    index.add(vectors)
+    return index, [LangchainDocument(page_content=f'{seed}:{i}') for i in range(count)], vectors
+
+
+@override_settings(SHARED_INDEX_ENABLED=True, INDEX_STORAGE_BACKEND='', SHARED_INDEX_MAX_CHUNKS=50,
+                   SHARED_INDEX_SHARD_VECTORS=100)
+class SharedIndexTests(FakeRedisMixin, TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('owner')
+
+    def project(self, count, seed):
+        vector_db = VectorDatabase.objects.create(user=self.user, name=f'p{seed}')
+        index, chunks, vectors = _build(count, seed)
+        self.assertTrue(shared_index.accepts(index, len(chunks)))
+        shared_index.publish(vector_db, index, chunks, {'build_key': f'key{seed}'})
+        return vector_db, vectors
+
+    def delete(self, vector_db):
+        shard = vector_db.shared_shard
+        with mock.patch('vector_search.tasks.prune_shard_task.delay') as delay, \
+                self.captureOnCommitCallbacks(execute=True):
+            vector_db.delete()
+        delay.assert_called_once_with(shard)
+        # What the task does
+        shared_index.prune(shard)
+
+    def assertSearchesOwnRows(self, vector_db, vectors, seed):
+        vector_db.refresh_from_db()
+        index, chunks = index_store.load_index(vector_db)
+        self.assertEqual((index.ntotal, len(chunks)), (len(vectors), len(vectors)))
+        _, ids = index.search(vectors, 1)
+        self.assertEqual(list(ids[:, 0]), list(range(len(vectors))))
+        self.assertEqual(chunks[-1].page_content, f'{seed}:{len(vectors) - 1}')
+        # Asking for more results than the project has never reaches another project's rows
+        _, ids = index.search(vectors[:1], len(vectors) + 5)
+        self.assertEqual(sorted(ids[0][:len(vectors)]), list(range(len(vectors))))
+        self.assertTrue((ids[0][len(vectors):] == -1).all())
+
+    def test_add_replace_remove_round_trip(self):
+        first, first_vectors = self.project(10, 1)
+        second, second_vectors = self.project(20, 2)
+        first.refresh_from_db()
+        self.assertEqual(first.shared_shard, second.shared_shard)
+        self.assertEqual(first.shared_shard, f'd{DIMENSION}-0001')
+        self.assertEqual((first.index_version, second.index_version), (2, 2))
+        self.assertEqual((first.index_file.name, first.num_chunks), ('', 10))
+        self.assertSearchesOwnRows(first, first_vectors, 1)
+        self.assertSearchesOwnRows(second, second_vectors, 2)
+        self.assertEqual(index_store.current_build_key(second), 'key2')
+
+        # Re-ingest of the first project with different content
+        index, chunks, first_vectors = _build(15, 3)
+        shared_index.publish(first, index, chunks)
+        self.assertSearchesOwnRows(first, first_vectors, 3)
+        self.assertSearchesOwnRows(second, second_vectors, 2)
+        self.assertEqual(shared_index.shard_stats()[0][1:4], (3, 2, 35))
+
+        self.delete(first)
+        self.assertSearchesOwnRows(second, second_vectors, 2)
+        self.assertEqual(shared_index.shard_stats()[0][1:4], (4, 1, 20))
+        self.delete(second)
+        self.assertEqual(shared_index.shard_stats(), [])
+
+    def test_full_shard_starts_a_new_one(self):
+        first, _ = self.project(50, 1)
+        second, _ = self.project(50, 2)
+        third, third_vectors = self.project(10, 3)
+        self.assertEqual(third.shared_shard, f'd{DIMENSION}-0002')
+        self.assertSearchesOwnRows(third, third_vectors, 3)
+
+    def test_project_build_is_standalone(self):
+        vector_db, vectors = self.project(12, 1)
+        self.project(5, 2)
+        vector_db.refresh_from_db()
+        index, chunks, manifest = shared_index.project_build(vector_db)
+        np.testing.assert_array_equal(index.reconstruct_n(0, index.ntotal), vectors)
+        self.assertEqual((len(chunks), manifest['num_chunks'], manifest['build_key']), (12, 12, 'key1'))
+
+    def test_consolidate_moves_a_dedicated_index(self):
+        vector_db = VectorDatabase.objects.create(user=self.user, name='dedicated')
+        index, chunks, vectors = _build(8, 4)
+        index_store.publish_index(vector_db, index, chunks, {'build_key': 'key4'})
+        index_root = vector_db.index_root
+        self.assertEqual(shared_index.consolidate(vector_db), 1)
+        self.assertEqual(index_store.existing_versions(index_root), [])
+        self.assertFalse(os.path.exists(os.path.join(index_root, index_store.CURRENT_FILENAME)))
+        self.assertSearchesOwnRows(vector_db, vectors, 4)
+        self.assertEqual(index_store.current_build_key(vector_db), 'key4')
+
+    def test_large_or_non_flat_indexes_are_not_accepted(self):
+        import faiss
+
+        index, chunks, _ = _build(60, 5)
+        self.assertFalse(shared_index.accepts(index, len(chunks)))
+        self.assertFalse(shared_index.accepts(faiss.IndexHNSWFlat(DIMENSION, 16), 10))
+        with override_settings(SHARED_INDEX_ENABLED=False):
+            self.assertFalse(shared_index.accepts(index, 10))
+
+    @override_settings(SHARED_INDEX_LOCK_WAIT=0)
+    def test_busy_shard_falls_back_to_a_dedicated_index(self):
+        first, first_vectors = self.project(10, 1)
+        vector_db = VectorDatabase.objects.create(user=self.user, name='late')
+        index, chunks, vectors = _build(5, 2)
+        with self.redis.lock(shared_index.LOCK_KEY.format(shard=first.shared_shard), timeout=60):
+            version = shared_index.publish_project(vector_db, index, chunks, {'build_key': 'key2'})
+        self.assertEqual((version, vector_db.shared_shard, vector_db.num_chunks), (1, '', 5))
+        self.assertTrue(vector_db.index_file)
+        self.assertSearchesOwnRows(vector_db, vectors, 2)
+        self.assertSearchesOwnRows(first, first_vectors, 1)
+
+    def test_publish_project_leaves_the_shard_when_it_grows(self):
+        vector_db, _ = self.project(10, 1)
+        index, chunks, vectors = _build(60, 2)
+        shared_index.publish_project(vector_db, index, chunks)
+        self.assertEqual(vector_db.shared_shard, '')
+        self.assertSearchesOwnRows(vector_db, vectors, 2)
+        self.assertEqual(shared_index.shard_stats(), [])
@@ -0,0 +1,60 @@
+import os
+import builtins
+import tempfile
+import shutil
+from types import SimpleNamespace
+from unittest import mock
+from django.test import SimpleTestCase
+from .. import text_extraction
+
+PAGES = ['Ünïcödé ' * 300, 'plain ascii text ' * 200, '漢字とかな 🎌 ' * 150]
+
+
+class ReadTextTests(SimpleTestCase):
+    def setUp(self):
+        folder = tempfile.mkdtemp(prefix='qq-text-')
+        self.addCleanup(shutil.rmtree, folder, ignore_errors=True)
+        self.document = SimpleNamespace(text_artifact_path=os.path.join(folder, 'artifact'))
+        # A small step so the ranges below start in many different blocks
+        with mock.patch.object(text_extraction, 'INDEX_STEP', 100):
+            self.meta = text_extraction.write_artifact(self.document.text_artifact_path, PAGES, 'doc.txt')
+        self.text = '\n\n'.join(PAGES)
+
+    def test_ranges_match_the_text(self):
+        for offset in (0, 1, 99, 100, 2345, 5400, len(self.text) - 3):
+            for limit in (1, 7, 250):
+                self.assertEqual(text_extraction.read_text(self.document, self.meta, offset, limit),
+                                 self.text[offset:offset + limit], (offset, limit))
+
+    def test_whole_text_and_pages(self):
+        self.assertEqual(text_extraction.read_text(self.document, self.meta), self.text)
+        self.assertEqual(text_extraction.read_pages(self.document, self.meta), PAGES)
+
+    def test_out_of_range(self):
+        self.assertEqual(text_extraction.read_text(self.document, self.meta, len(self.text) + 10, 5), '')
+        self.assertEqual(text_extraction.read_text(self.document, self.meta, 10, 0), '')
+
+    def test_reads_only_the_requested_range(self):
+        sizes = []
+
+        class CountingFile:
+            def __init__(self, f):
+                self.f = f
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                self.f.close()
+
+            def seek(self, position):
+                return self.f.seek(position)
+
+            def read(self, size=-1):
+                sizes.append(size)
+                return self.f.read(size)
+
+        with mock.patch.object(text_extraction, 'open', lambda *args: CountingFile(builtins.open(*args)), create=True):
+            self.assertEqual(text_extraction.read_text(self.document, self.meta, 5000, 20), self.text[5000:5020])
+        # Never a read to EOF, and never more than the UTF-8 bytes of one block
+        self.assertTrue(sizes and all(0 < size <= 4 * 100 for size in sizes), sizes)
@@ -0,0 +1,81 @@
+import io
+import os
+import hashlib
+from django.contrib.auth.models import User
+from django.test import TestCase
+from .. import uploads
+from ..models import Document, UploadSession, VectorDatabase
+from .utils import TempMediaMixin
+
+
+class WriteChunkTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('uploader', password='x')
+        self.vector_db = VectorDatabase.objects.create(user=self.user)
+        self.data = os.urandom(1000)
+
+    def new_session(self, **kwargs):
+        return UploadSession.objects.create(user=self.user, vector_database=self.vector_db, filename='file.bin',
+                                            total_size=len(self.data), **kwargs)
+
+    def write(self, session, offset, length):
+        return uploads.write_chunk(session, io.BytesIO(self.data[offset:offset + length]), offset, length)
+
+    def test_chunks_are_assembled_and_hashed(self):
+        session = self.new_session()
+        self.assertIsNone(self.write(session, 0, 400))
+        self.assertIsNone(self.write(session, 400, 400))
+        document = self.write(session, 800, 200)
+
+        self.assertIsInstance(document, Document)
+        with open(document.file.path, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertEqual(document.content_hash, hashlib.sha256(self.data).hexdigest())
+        session.refresh_from_db()
+        self.assertEqual(session.status, UploadSession.STATUS_COMPLETE)
+        self.assertFalse(os.path.exists(session.part_path))
+
+    def test_wrong_offset_reports_the_expected_one(self):
+        session = self.new_session()
+        self.write(session, 0, 400)
+        with self.assertRaises(uploads.OffsetMismatch) as raised:
+            self.write(session, 200, 400)
+        self.assertEqual(raised.exception.offset, 400)
+
+    def test_stale_session_cannot_advance_the_offset(self):
+        session = self.new_session()
+        stale = UploadSession.objects.get(pk=session.pk)
+        self.write(session, 0, 400)
+        # A second writer still believes the upload is at offset 0; its bytes must not reach the part file
+        with self.assertRaises(uploads.OffsetMismatch) as raised:
+            uploads.write_chunk(stale, io.BytesIO(b'x' * 400), 0, 400)
+        self.assertEqual(raised.exception.offset, 400)
+        with open(session.part_path, 'rb') as f:
+            self.assertEqual(f.read(), self.data[:400])
+        self.assertEqual(os.listdir(os.path.dirname(session.part_path)), [os.path.basename(session.part_path)])
+
+    def test_chunk_past_declared_size_is_rejected(self):
+        session = self.new_session()
+        with self.assertRaises(uploads.UploadError):
+            self.write(session, 0, len(self.data) + 1)
+
+    def test_resume_on_another_worker_rebuilds_the_hash(self):
+        session = self.new_session()
+        self.write(session, 0, 600)
+        uploads._forget_hasher(session.upload_id)
+        document = self.write(session, 600, 400)
+        self.assertEqual(document.content_hash, hashlib.sha256(self.data).hexdigest())
+
+    def test_declared_hash_mismatch_fails_the_upload(self):
+        session = self.new_session(expected_hash='0' * 64)
+        with self.assertRaises(uploads.UploadError):
+            self.write(session, 0, len(self.data))
+        session.refresh_from_db()
+        self.assertEqual(session.status, UploadSession.STATUS_FAILED)
+
+    def test_identical_content_is_deduplicated(self):
+        first = self.write(self.new_session(), 0, len(self.data))
+        second = self.write(self.new_session(), 0, len(self.data))
+        self.assertEqual(first.pk, second.pk)
+        self.assertEqual(Document.objects.filter(vector_database=self.vector_db).count(), 1)
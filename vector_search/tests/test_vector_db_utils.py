@@ -0,0 +1,48 @@
+import gc
+import numpy as np
+from django.test import SimpleTestCase
+from ..vector_db_utils import MIN_TRAINING_VECTORS, fill_index, new_index, search_parameters
+
+
+class IndexParameterTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.vectors = np.random.default_rng(0).random((MIN_TRAINING_VECTORS, 32), dtype='float32')
+
+    def build(self, factory, nprobe=None):
+        index = new_index(32, factory, len(self.vectors))
+        return fill_index(index, self.vectors, 4096, train_size=4096, nprobe=nprobe)
+
+    def test_nprobe_reaches_ivf_behind_a_transform(self):
+        import faiss
+
+        for factory in ('IVF16,Flat', 'PCA16,IVF16,Flat', 'OPQ8,IVF16,PQ8'):
+            index = self.build(factory, nprobe=5)
+            self.assertEqual(faiss.extract_index_ivf(index).nprobe, 5, factory)
+
+    def test_search_parameters_wrap_transformed_ivf(self):
+        import faiss
+
+        index = self.build('PCA16,IVF16,Flat', nprobe=1)
+        params = search_parameters(index, {'nprobe': 16})
+        self.assertIsInstance(params, faiss.SearchParametersPreTransform)
+        # The nested parameters outlive the local that created them
+        gc.collect()
+        self.assertEqual(params.referenced_objects[0].nprobe, 16)
+        # Searching every list is exhaustive within the transformed space
+        exact = faiss.IndexFlatL2(16)
+        exact.add(faiss.downcast_VectorTransform(index.chain.at(0)).apply(self.vectors))
+        _, ids = index.search(self.vectors[:20], 5, params=params)
+        _, expected = exact.search(faiss.downcast_VectorTransform(index.chain.at(0)).apply(self.vectors[:20]), 5)
+        np.testing.assert_array_equal(ids[:, 0], expected[:, 0])
+
+    def test_search_parameters_by_index_type(self):
+        import faiss
+
+        # Built inline: search_parameters must not drop the only reference to the index it was given
+        self.assertIsInstance(search_parameters(self.build('IVF16,Flat'), {'nprobe': 4}), faiss.SearchParametersIVF)
+        self.assertIsInstance(search_parameters(self.build('HNSW16,Flat'), {'efSearch': 32}), faiss.SearchParametersHNSW)
+        self.assertIsNone(search_parameters(self.build('Flat'), {'nprobe': 4}))
+        self.assertIsNone(search_parameters(self.build('PCA16,IVF16,Flat'), {'efSearch': 32}))
+        self.assertIsNone(search_parameters(self.build('IVF16,Flat'), {}))
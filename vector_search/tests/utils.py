@@ -0,0 +1,34 @@
+import shutil
+import tempfile
+from unittest import mock
+from django.test import override_settings
+from .. import index_store, ingest_lock, shared_index
+
+
+class FakeRedisMixin:
+    """Point get_redis() at an in-memory fakeredis server (with Lua) for each test."""
+
+    def setUp(self):
+        import fakeredis
+
+        super().setUp()
+        self.redis = fakeredis.FakeRedis(decode_responses=True)
+        patcher = mock.patch.object(ingest_lock, '_client', self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class TempMediaMixin:
+    """A fresh MEDIA_ROOT for each test, with no indexes loaded from an earlier one."""
+
+    def setUp(self):
+        super().setUp()
+        # Shards are cached by (shard, version), which repeats across tests
+        for cache in (index_store._cache, shared_index._cache):
+            cache.clear()
+            self.addCleanup(cache.clear)
+        self.media_root = tempfile.mkdtemp(prefix='qq-media-')
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
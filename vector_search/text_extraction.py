@@ -0,0 +1,294 @@
+import os
+import re
+import json
+import codecs
+import logging
+from .uploads import hash_file
+
+logger = logging.getLogger('vector_search')
+
+ARTIFACT_VERSION = 1
+# A byte offset is recorded every INDEX_STEP characters so previews can seek
+# into large artifacts without decoding everything in front of them.
+INDEX_STEP = 64 * 1024
+
+SUPPORTED_EXTENSIONS = ('.pdf', '.html', '.htm', '.txt')
+
+_BLANK_LINES = re.compile(r'\n{3,}')
+_TRAILING_SPACE = re.compile(r'[ \t\f\v]+\n')
+
+
+def normalize_text(text):
+    text = text.replace('\r\n', '\n').replace('\r', '\n').replace('\x00', '')
+    text = _TRAILING_SPACE.sub('\n', text)
+    return _BLANK_LINES.sub('\n\n', text).strip()
+
+
+def extract_pdf(path):
+    import PyPDF2
+
+    pages = []
+    with open(path, 'rb') as f:
+        reader = PyPDF2.PdfReader(f)
+        for page in reader.pages:
+            pages.append(normalize_text(page.extract_text() or ''))
+    return pages
+
+
+# Never text
+_NON_TEXT_TAGS = ['script', 'style', 'noscript', 'template', 'iframe', 'svg', 'canvas']
+# Page furniture rather than content: dropped before the text is taken
+_NON_CONTENT_TAGS = ['form', 'button', 'select', 'nav', 'aside']
+_NON_CONTENT_ROLES = {'navigation', 'banner', 'contentinfo', 'complementary', 'search', 'menu', 'dialog'}
+_BOILERPLATE_NAME = re.compile(
+    r'(^|[-_\s])(nav|navbar|menu|breadcrumbs?|sidebar|footer|cookies?|consent|share|social|related|'
+    r'adverts?|ads|promo|newsletter|subscribe|popup|modal|comments?|skip-link)([-_\s]|$)', re.IGNORECASE)
+_CONTAINER_TAGS = ['div', 'section', 'ul', 'ol', 'table', 'span', 'p']
+_BLOCK_TAGS = ['p', 'div', 'section', 'article', 'main', 'header', 'footer', 'li', 'ul', 'ol', 'dl', 'dt', 'dd',
+               'table', 'tr', 'blockquote', 'pre', 'figure', 'figcaption', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+               'hr', 'address', 'details', 'summary']
+_INLINE_SPACE = re.compile(r'[ \t\f\v\xa0\u200b]+')
+# Blocks with at least this share of their text in links, and short enough to
+# be a menu or a list of related links, are dropped
+MAX_LINK_DENSITY = 0.6
+MAX_LINK_BLOCK_CHARS = 2000
+# If boilerplate removal leaves less than this share of the page's text, the
+# heuristics misfired (say, a whole page inside <div class="nav-wrapper">)
+# and the full text is used instead
+MIN_KEPT_SHARE = 0.1
+
+
+def _html_parser():
+    # lxml (installed with unstructured) is several times faster than the stdlib parser
+    try:
+        import lxml  # noqa: F401
+        return 'lxml'
+    except ImportError:
+        return 'html.parser'
+
+
+def _is_hidden(tag):
+    style = (tag.get('style') or '').replace(' ', '').lower()
+    return tag.has_attr('hidden') or tag.get('aria-hidden') == 'true' or 'display:none' in style
+
+
+def _link_density(tag, text_length):
+    link_length = sum(len(a.get_text(strip=True)) for a in tag.find_all('a'))
+    return link_length / text_length if text_length else 0.0
+
+
+def _block_text(root):
+    # Line breaks only at block boundaries, so inline markup doesn't split sentences
+    for tag in root.find_all('br'):
+        tag.replace_with('\n')
+    for tag in root.find_all(_BLOCK_TAGS):
+        tag.insert_before('\n')
+        tag.insert_after('\n')
+    return normalize_text('\n'.join(_INLINE_SPACE.sub(' ', line).strip() for line in root.get_text().split('\n')))
+
+
+def _remove_boilerplate(soup):
+    """Drop navigation and similar blocks in place and return the element holding the main content."""
+    # The main content and everything around it is never dropped as a whole
+    content = soup.find_all(['main', 'article', 'body'])
+    protected = {id(tag) for tag in content} | {id(parent) for tag in content for parent in tag.parents}
+
+    for tag in soup.find_all(_NON_CONTENT_TAGS):
+        tag.decompose()
+    for tag in soup.find_all(['header', 'footer']):
+        # An article's own header holds its headline and byline
+        if id(tag) not in protected and tag.find_parent(['article', 'main']) is None:
+            tag.decompose()
+    for tag in soup.find_all(True):
+        if tag.decomposed or id(tag) in protected:
+            continue
+        names = ' '.join(tag.get('class') or []) + ' ' + (tag.get('id') or '')
+        if (tag.get('role') in _NON_CONTENT_ROLES or _is_hidden(tag)
+                or (tag.name in _CONTAINER_TAGS and _BOILERPLATE_NAME.search(names))):
+            tag.decompose()
+
+    articles = soup.find_all('article')
+    root = (soup.find('main') or soup.find(attrs={'role': 'main'})
+            or (articles[0] if len(articles) == 1 else None) or soup.body or soup)
+
+    for tag in root.find_all(['ul', 'ol', 'div', 'section', 'table']):
+        if tag.decomposed or id(tag) in protected:
+            continue
+        text_length = len(tag.get_text(strip=True))
+        if text_length <= MAX_LINK_BLOCK_CHARS and _link_density(tag, text_length) >= MAX_LINK_DENSITY:
+            tag.decompose()
+    return root
+
+
+def html_to_text(html, remove_boilerplate=True):
+    """Main text of an HTML page, without navigation, headers, footers, scripts and similar boilerplate.
+
+    The page's <main> (or its only <article>) is used when there is one,
+    otherwise the whole body. The title is kept as the first line.
+    """
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, _html_parser())
+    title = soup.title.get_text(strip=True) if soup.title else ''
+    for tag in soup.find_all(_NON_TEXT_TAGS):
+        tag.decompose()
+
+    if remove_boilerplate:
+        full_length = len((soup.body or soup).get_text(strip=True))
+        text = _block_text(_remove_boilerplate(soup))
+        if len(text) < full_length * MIN_KEPT_SHARE:
+            return html_to_text(html, remove_boilerplate=False)
+    else:
+        text = _block_text(soup.body or soup)
+
+    if title and not text.startswith(title):
+        text = normalize_text(f'{title}\n\n{text}')
+    return text
+
+
+def extract_html(path):
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        return [html_to_text(f.read())]
+
+
+def extract_txt(path):
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        return [normalize_text(f.read())]
+
+
+EXTRACTORS = {
+    '.pdf': extract_pdf,
+    '.html': extract_html,
+    '.htm': extract_html,
+    '.txt': extract_txt,
+}
+
+
+def extract_pages(path):
+    extension = os.path.splitext(path)[1].lower()
+    extractor = EXTRACTORS.get(extension)
+    if extractor is None:
+        return None
+    return extractor(path)
+
+
+def write_artifact(base_path, pages, source_name):
+    """Write pages as one UTF-8 text file plus a JSON index of page and seek offsets."""
+    os.makedirs(os.path.dirname(base_path), exist_ok=True)
+    page_offsets = []
+    parts = []
+    length = 0
+    for page in pages:
+        if parts:
+            parts.append('\n\n')
+            length += 2
+        page_offsets.append(length)
+        parts.append(page)
+        length += len(page)
+    text = ''.join(parts)
+
+    byte_offsets = []
+    byte_position = 0
+    for start in range(0, len(text), INDEX_STEP):
+        byte_offsets.append(byte_position)
+        byte_position += len(text[start:start + INDEX_STEP].encode('utf-8'))
+
+    meta = {
+        'version': ARTIFACT_VERSION,
+        'source': source_name,
+        'length': len(text),
+        'pages': page_offsets,
+        'index_step': INDEX_STEP,
+        'byte_offsets': byte_offsets,
+    }
+
+    # Write to temp names and rename so readers never see a partial artifact
+    with open(base_path + '.txt.tmp', 'w', encoding='utf-8', newline='') as f:
+        f.write(text)
+    with open(base_path + '.json.tmp', 'w') as f:
+        json.dump(meta, f)
+    os.replace(base_path + '.txt.tmp', base_path + '.txt')
+    os.replace(base_path + '.json.tmp', base_path + '.json')
+    return meta
+
+
+def read_meta(document):
+    base_path = document.text_artifact_path
+    if not base_path or not os.path.isfile(base_path + '.json'):
+        return None
+    with open(base_path + '.json') as f:
+        meta = json.load(f)
+    if meta.get('version') != ARTIFACT_VERSION:
+        return None
+    return meta
+
+
+def ensure_text_artifact(document):
+    """Return the artifact metadata for a document, extracting it on first use.
+
+    Returns None for unsupported file types.
+    """
+    if document.text_length is not None:
+        meta = read_meta(document)
+        if meta is not None:
+            return meta
+
+    path = document.file.path
+    if not document.content_hash:
+        with open(path, 'rb') as f:
+            document.content_hash = hash_file(f)
+
+    # A deduplicated copy may already have been extracted under the same hash
+    meta = read_meta(document)
+    if meta is None:
+        pages = extract_pages(path)
+        if pages is None:
+            return None
+        meta = write_artifact(document.text_artifact_path, pages, document.file.name)
+        logger.info(f"Extracted {meta['length']} characters from {len(pages)} page(s) of {document.file.name}")
+
+    document.text_length = meta['length']
+    document.page_count = len(meta['pages'])
+    type(document).objects.filter(pk=document.pk).update(
+        content_hash=document.content_hash,
+        text_length=document.text_length,
+        page_count=document.page_count,
+    )
+    return meta
+
+
+def read_text(document, meta, offset=0, limit=None):
+    """Read `limit` characters of the artifact starting at character `offset`."""
+    offset = max(0, min(offset, meta['length']))
+    if limit is None:
+        limit = meta['length'] - offset
+    step = meta['index_step']
+    block = offset // step
+    if block >= len(meta['byte_offsets']):
+        return ''
+    if not limit:
+        return ''
+    skip = offset - block * step
+    wanted = skip + limit
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    parts = []
+    decoded = 0
+    with open(document.text_artifact_path + '.txt', 'rb') as f:
+        f.seek(meta['byte_offsets'][block])
+        # A character is at least one byte, so reading no more bytes than the
+        # characters still wanted never reads far past the end of the range
+        while decoded < wanted:
+            data = f.read(max(wanted - decoded, 4))
+            part = decoder.decode(data, final=not data)
+            parts.append(part)
+            decoded += len(part)
+            if not data:
+                break
+    return ''.join(parts)[skip:wanted]
+
+
+def read_pages(document, meta):
+    text = read_text(document, meta)
+    offsets = meta['pages'] + [len(text) + 2]
+    # Each page is followed by the two-character separator added in write_artifact
+    return [text[offsets[i]:offsets[i + 1] - 2] for i in range(len(meta['pages']))]
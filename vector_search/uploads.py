@@ -0,0 +1,259 @@
+import os
+import uuid
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+from .models import Document, UploadSession, user_directory_path
+
+logger = logging.getLogger('vector_search')
+
+READ_SIZE = 64 * 1024
+
+# Hash state for uploads this process is streaming, keyed by upload_id.
+# hashlib objects can't be persisted, so a resume landing on another worker
+# rebuilds the state from the part file once and carries on from there.
+_hashers = OrderedDict()
+_hashers_lock = threading.Lock()
+MAX_CACHED_HASHERS = 256
+
+
+class UploadError(Exception):
+    pass
+
+
+class OffsetMismatch(UploadError):
+    def __init__(self, offset):
+        super().__init__(f"Expected offset {offset}")
+        self.offset = offset
+
+
+def hash_file(file):
+    hasher = hashlib.sha256()
+    if hasattr(file, 'chunks'):
+        for chunk in file.chunks():
+            hasher.update(chunk)
+        file.seek(0)
+    else:
+        for chunk in iter(lambda: file.read(READ_SIZE), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def find_duplicate(user, vector_db, content_hash):
+    """Return (document, same_project) for stored content matching the hash, or (None, False)."""
+    if not content_hash:
+        return None, False
+    candidates = Document.objects.filter(user=user, content_hash=content_hash).exclude(file='')
+    doc = candidates.filter(vector_database=vector_db).first()
+    if doc is not None:
+        return doc, True
+    for doc in candidates:
+        if os.path.isfile(doc.file.path):
+            return doc, False
+    return None, False
+
+
+def _document_target(user, vector_db, filename):
+    document = Document(user=user, vector_database=vector_db)
+    name = default_storage.get_available_name(user_directory_path(document, filename))
+    path = default_storage.path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return document, name, path
+
+
+def link_document(user, vector_db, source, filename):
+    # Hard link the existing file into this project so nothing is stored twice
+    # and each project folder stays self-contained for deletes.
+    document, name, path = _document_target(user, vector_db, filename)
+    try:
+        os.link(source.file.path, path)
+    except OSError:
+        logger.warning(f"Hard link failed for {source.file.path}, copying instead")
+        with open(source.file.path, 'rb') as src, open(path, 'wb') as dst:
+            for chunk in iter(lambda: src.read(READ_SIZE), b''):
+                dst.write(chunk)
+    document.file.name = name
+    document.file_size = source.file_size
+    document.content_hash = source.content_hash
+    # Same user and same hash, so the extracted text artifact is shared as well
+    document.text_length = source.text_length
+    document.page_count = source.page_count
+    document.save()
+    logger.info(f"Linked duplicate of document {source.document_id} into project {vector_db.project_id}")
+    return document
+
+
+def store_uploaded_file(user, vector_db, file):
+    """Store a multipart upload, reusing identical content already owned by the user.
+
+    Returns (document, deduplicated).
+    """
+    content_hash = hash_file(file)
+    duplicate, same_project = find_duplicate(user, vector_db, content_hash)
+    if same_project:
+        return duplicate, True
+    if duplicate is not None:
+        return link_document(user, vector_db, duplicate, file.name), True
+    document = Document(user=user, vector_database=vector_db, file=file, content_hash=content_hash)
+    document.save()
+    return document, False
+
+
+def store_scraped_page(user, vector_db, url, filename, content, etag='', last_modified='', document=None):
+    """Create or refresh the document for a scraped page from its extracted text.
+
+    Returns (document, changed). An existing document whose content is
+    unchanged only has its validators updated and keeps its processed flag.
+    """
+    data = content.encode('utf-8')
+    content_hash = hashlib.sha256(data).hexdigest()
+
+    if document is not None and document.content_hash == content_hash:
+        Document.objects.filter(pk=document.pk).update(etag=etag, last_modified=last_modified)
+        return document, False
+
+    if document is None:
+        document = Document(user=user, vector_database=vector_db, source_url=url)
+    else:
+        document.delete_file()
+        document.processed = False
+        document.text_length = None
+        document.page_count = 0
+    document.etag = etag
+    document.last_modified = last_modified
+    document.content_hash = content_hash
+    document.file_size = len(data)
+    document.file.save(filename, ContentFile(data), save=True)
+    return document, True
+
+
+def purge_expired_sessions(user):
+    cutoff = timezone.now() - timedelta(seconds=settings.UPLOAD_SESSION_TTL)
+    expired = UploadSession.objects.filter(user=user, updated_at__lt=cutoff).exclude(status=UploadSession.STATUS_COMPLETE)
+    for session in expired:
+        session.delete()
+
+
+def _get_hasher(session, offset):
+    with _hashers_lock:
+        cached = _hashers.get(session.upload_id)
+    if cached is not None and cached[0] == offset:
+        return cached[1].copy()
+
+    hasher = hashlib.sha256()
+    remaining = offset
+    if remaining:
+        with open(session.part_path, 'rb') as f:
+            while remaining:
+                chunk = f.read(min(READ_SIZE, remaining))
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                remaining -= len(chunk)
+    return hasher
+
+
+def _remember_hasher(upload_id, offset, hasher):
+    with _hashers_lock:
+        _hashers[upload_id] = (offset, hasher)
+        _hashers.move_to_end(upload_id)
+        while len(_hashers) > MAX_CACHED_HASHERS:
+            _hashers.popitem(last=False)
+
+
+def _forget_hasher(upload_id):
+    with _hashers_lock:
+        _hashers.pop(upload_id, None)
+
+
+def write_chunk(session, stream, offset, length):
+    """Append `length` bytes read from `stream` at `offset`, hashing as they are appended.
+
+    The chunk is spooled next to the part file first, and only copied into
+    it while holding the session's row lock with the offset re-checked, so a
+    writer that lost a race never touches the part file.
+    """
+    if offset != session.received_bytes:
+        raise OffsetMismatch(session.received_bytes)
+    if offset + length > session.total_size:
+        raise UploadError('Chunk extends past the declared file size')
+
+    os.makedirs(os.path.dirname(session.part_path), exist_ok=True)
+    spool_path = f'{session.part_path}.{uuid.uuid4().hex}.chunk'
+    try:
+        written = 0
+        with open(spool_path, 'wb') as spool:
+            while written < length:
+                chunk = stream.read(min(READ_SIZE, length - written))
+                if not chunk:
+                    break
+                spool.write(chunk)
+                written += len(chunk)
+
+        new_offset = offset + written
+        with transaction.atomic():
+            locked = UploadSession.objects.select_for_update().get(upload_id=session.upload_id)
+            if locked.received_bytes != offset or locked.status != UploadSession.STATUS_UPLOADING:
+                session.received_bytes = locked.received_bytes
+                session.status = locked.status
+                raise OffsetMismatch(locked.received_bytes)
+
+            hasher = _get_hasher(session, offset)
+            mode = 'r+b' if os.path.exists(session.part_path) else 'wb'
+            with open(spool_path, 'rb') as spool, open(session.part_path, mode) as f:
+                f.seek(offset)
+                for chunk in iter(lambda: spool.read(READ_SIZE), b''):
+                    f.write(chunk)
+                    hasher.update(chunk)
+                f.truncate(new_offset)
+            UploadSession.objects.filter(upload_id=session.upload_id).update(
+                received_bytes=new_offset, updated_at=timezone.now())
+    finally:
+        if os.path.exists(spool_path):
+            os.remove(spool_path)
+
+    session.received_bytes = new_offset
+    _remember_hasher(session.upload_id, new_offset, hasher)
+    if new_offset == session.total_size:
+        return finalize_upload(session, hasher.hexdigest())
+    return None
+
+
+def finalize_upload(session, content_hash):
+    _forget_hasher(session.upload_id)
+    if session.expected_hash and session.expected_hash != content_hash:
+        session.status = UploadSession.STATUS_FAILED
+        session.save()
+        session.delete_part()
+        raise UploadError('Uploaded content does not match the declared sha256')
+
+    vector_db = session.vector_database
+    duplicate, same_project = find_duplicate(session.user, vector_db, content_hash)
+    if same_project:
+        document = duplicate
+        session.delete_part()
+    elif duplicate is not None:
+        document = link_document(session.user, vector_db, duplicate, session.filename)
+        session.delete_part()
+    else:
+        document, name, path = _document_target(session.user, vector_db, session.filename)
+        os.replace(session.part_path, path)
+        document.file.name = name
+        document.file_size = session.total_size
+        document.content_hash = content_hash
+        document.save()
+
+    session.content_hash = content_hash
+    session.document = document
+    session.status = UploadSession.STATUS_COMPLETE
+    session.save()
+    vector_db.refresh_document_stats()
+    logger.info(f"Completed chunked upload {session.upload_id} as document {document.document_id}")
+    return document
@@ -6,19 +6,29 @@ urlpatterns = [
     path('', views.BaseView.as_view(), name='base'),
     # Document Management
     path('upload/', views.UploadDocumentView.as_view(), name='upload_document'),
+    path('upload/start/', views.StartChunkedUploadView.as_view(), name='start_chunked_upload'),
+    path('upload/chunk/', views.UploadChunkView.as_view(), name='upload_chunk'),
+    path('upload/status/', views.UploadStatusView.as_view(), name='upload_status'),
     path('upload_text_document/', views.SaveTextDocumentView.as_view(), name='save_text_document'),
     path('create_project/', views.CreateProjectView.as_view(), name='create_project'),
     path('process/', views.ProcessDocumentsView.as_view(), name='process_documents'),
     path('query/', views.QueryDocumentsView.as_view(), name='query_documents'),
     path('scrape_url/', views.ScrapeUrlView.as_view(), name='scrape_url'),
+    path('scrape_urls/', views.BatchScrapeView.as_view(), name='batch_scrape'),
     path('document_preview/', views.DocumentPreviewView.as_view(), name='document_preview'),
     path('delete_document/', views.DeleteDocumentView.as_view(), name='delete_document'),
     path('delete_project/', views.DeleteProjectView.as_view(), name='delete_project'),
+    path('api_tokens/', views.ProjectAPITokenView.as_view(), name='api_tokens'),
+    path('api_tokens/revoke/', views.RevokeProjectAPITokenView.as_view(), name='revoke_api_token'),
     path('task_status/', views.TaskStatusView.as_view(), name='task_status'),
+    path('task_progress/', views.TaskProgressView.as_view(), name='task_progress'),
+    path('task_progress/ticket/', views.TaskProgressTicketView.as_view(), name='task_progress_ticket'),
 
     # Project Management
     path('projects/', views.ProjectExplorerView.as_view(), name='project_explorer'),
     path('project_detail/', views.ProjectDetailView.as_view(), name='project_detail'),
+    path('export_project/', views.ExportProjectView.as_view(), name='export_project'),
+    path('import_project/', views.ImportProjectView.as_view(), name='import_project'),
     path('profile/', views.UserProfileView.as_view(), name='user_profile'),
 
     # User Accounts
@@ -1,25 +1,79 @@
 import os
-import torch
-import faiss
+import glob
+import time
 import logging
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from sentence_transformers import SentenceTransformer
-from langchain_community.document_loaders import PyPDFLoader, UnstructuredHTMLLoader, TextLoader, DirectoryLoader
-import PyPDF2
 import numpy as np
+from functools import lru_cache
+from .dedup import dedupe_chunks
+from .chunking import UNIT_TOKENS, token_chunk_documents, model_chunk_size
+from .embedding_backends import build_encoder, default_backend
+from . import embedding_pool
 
 
 logger = logging.getLogger('vector_search')
 
-def load_documents(folder_path):
+# torch, sentence_transformers, faiss and the LangChain loaders take seconds
+# and hundreds of MB to import, so they are imported in the functions that use
+# them. Web workers, management commands and Celery processes that never embed
+# or search don't pay for them.
+
+DEFAULT_MODEL_NAME = 'all-MiniLM-L6-v2'
+
+@lru_cache(maxsize=4)
+def load_model(model_name=DEFAULT_MODEL_NAME):
+    # Loading a SentenceTransformer takes seconds; keep one per process and model
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(model_name)
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    logger.info(f"Loaded SentenceTransformer model {model_name} on {device}")
+    return model.to(device)
+
+@lru_cache(maxsize=4)
+def load_encoder(model_name=DEFAULT_MODEL_NAME, backend=None):
+    # Torch, ONNX or int8 ONNX behind the same encode(texts, batch_size) call
+    backend = backend or default_backend()
+    encoder = build_encoder(load_model(model_name), model_name, backend)
+    logger.info(f"Using {backend} embedding backend for {model_name}")
+    return encoder
+
+def documents_from_pages(pages, source):
+    # Mirror the metadata the LangChain loaders produce: one document per PDF page
+    from langchain_core.documents import Document as LangchainDocument
+    if source.lower().endswith('.pdf'):
+        return [LangchainDocument(page_content=page, metadata={'source': source, 'page': i})
+                for i, page in enumerate(pages)]
+    return [LangchainDocument(page_content='\n\n'.join(pages), metadata={'source': source})]
+
+def load_documents(folder_path, extracted=None):
+    # `extracted` is a list of (source, pages) from the cached text artifacts;
+    # when given, nothing is parsed again and folder_path is not scanned.
+    if extracted is not None:
+        documents = []
+        for source, pages in extracted:
+            documents.extend(documents_from_pages(pages, source))
+        logger.info(f"Loaded {len(documents)} documents from {len(extracted)} text artifacts")
+        return documents
+
+    from langchain_community.document_loaders import PyPDFLoader, TextLoader, DirectoryLoader
+    from .text_extraction import extract_html
+
     logger.info(f"Loading documents from {folder_path}")
     loaders = {
         '.pdf': (PyPDFLoader, {}),
-        '.html': (UnstructuredHTMLLoader, {}),
         '.txt': (TextLoader, {'encoding': 'utf8'})
     }
     
     documents = []
+    # HTML goes through the BeautifulSoup extractor rather than UnstructuredHTMLLoader
+    html_paths = sorted(glob.glob(os.path.join(folder_path, '**', '*.htm*'), recursive=True))
+    for path in html_paths:
+        try:
+            documents.extend(documents_from_pages(extract_html(path), path))
+        except Exception as e:
+            logger.error(f"Error loading {path}: {str(e)}")
+    logger.info(f"Loaded {len(html_paths)} .html documents")
     for ext, (loader_class, loader_args) in loaders.items():
         glob_pattern = f'**/*{ext}'
         try:
@@ -34,6 +88,8 @@ def load_documents(folder_path):
     return documents
 
 def chunk_texts(documents, chunk_size=1000, chunk_overlap=200):
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
     # logger.info(f"Chunking {len(documents)} documents")
     text_splitter = RecursiveCharacterTextSplitter(
         chunk_size=chunk_size,
@@ -43,74 +99,335 @@ def chunk_texts(documents, chunk_size=1000, chunk_overlap=200):
     # logger.info(f"Created {len(chunks)} chunks")
     return chunks
 
-def get_embeddings(chunks, model_name='all-MiniLM-L6-v2', batch_size=32):
+def resolve_chunking(model, chunk_unit=UNIT_TOKENS, chunk_size=None, chunk_overlap=None):
+    """Fill in the defaults for unset chunking parameters."""
+    if chunk_unit == UNIT_TOKENS:
+        chunk_size = chunk_size or model_chunk_size(model)
+        chunk_overlap = chunk_overlap if chunk_overlap is not None else 32
+    else:
+        chunk_size = chunk_size or 1000
+        chunk_overlap = chunk_overlap if chunk_overlap is not None else 200
+    return {'chunk_unit': chunk_unit, 'chunk_size': chunk_size, 'chunk_overlap': chunk_overlap}
+
+def chunk_documents(documents, model, chunk_unit=UNIT_TOKENS, chunk_size=None, chunk_overlap=None):
+    """Split documents and return (chunks, resolved chunking parameters)."""
+    params = resolve_chunking(model, chunk_unit, chunk_size, chunk_overlap)
+    if chunk_unit == UNIT_TOKENS:
+        chunks = token_chunk_documents(documents, model.tokenizer, params['chunk_size'], params['chunk_overlap'])
+    else:
+        chunks = chunk_texts(documents, chunk_size=params['chunk_size'], chunk_overlap=params['chunk_overlap'])
+    return chunks, params
+
+# Each encode() batch is padded to its longest member, so batches are built
+# from chunks of similar length and sized to a padded-token budget instead of
+# a fixed count: many short chunks per batch, fewer long ones.
+EMBEDDING_TOKEN_BUDGET = 16384
+EMBEDDING_MAX_BATCH_SIZE = 256
+
+def token_lengths(texts, encoder):
+    """Token count of each text as the encoder will see it (specials included, truncated)."""
+    tokenizer = encoder.tokenizer
+    extra = tokenizer.num_special_tokens_to_add(pair=False)
+    lengths = []
+    for i in range(0, len(texts), 1024):
+        encoded = tokenizer(texts[i:i + 1024], add_special_tokens=False, return_attention_mask=False,
+                            return_token_type_ids=False, verbose=False)
+        lengths.extend(len(ids) + extra for ids in encoded['input_ids'])
+    return [min(length, encoder.max_seq_length) for length in lengths]
+
+def length_batches(lengths, token_budget=EMBEDDING_TOKEN_BUDGET, max_batch_size=EMBEDDING_MAX_BATCH_SIZE):
+    """Group indices sorted by descending length into batches whose padded size fits the budget."""
+    order = sorted(range(len(lengths)), key=lambda i: -lengths[i])
+    batches = []
+    batch = []
+    for i in order:
+        # Sorted descending, so the first member sets the padded length
+        padded = lengths[batch[0]] if batch else lengths[i]
+        if batch and ((len(batch) + 1) * padded > token_budget or len(batch) >= max_batch_size):
+            batches.append(batch)
+            batch = []
+        batch.append(i)
+    if batch:
+        batches.append(batch)
+    return batches
+
+def _encode_in_process(encoder, texts, batches):
+    embeddings = None
+    started = time.perf_counter()
+    for batch in batches:
+        batch_embeddings = encoder.encode([texts[i] for i in batch], batch_size=len(batch))
+        if embeddings is None:
+            embeddings = np.empty((len(texts), batch_embeddings.shape[1]), dtype='float32')
+        # Write back into arrival order so embeddings line up with chunks
+        embeddings[batch] = batch_embeddings
+    return embeddings, {os.getpid(): (len(texts), time.perf_counter() - started)}
+
+def get_embeddings(chunks, model_name=DEFAULT_MODEL_NAME, token_budget=EMBEDDING_TOKEN_BUDGET,
+                   max_batch_size=EMBEDDING_MAX_BATCH_SIZE, backend=None, stats=None):
+    # `stats`, when given, receives per-process throughput
     logger.info(f"Getting embeddings for {len(chunks)} chunks using model {model_name}")
     try:
-        model = SentenceTransformer(model_name)
-        device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        logger.info(f"Using device: {device}")
-        model = model.to(device)
-        
-        embeddings = []
-        for i in range(0, len(chunks), batch_size):
-            batch = chunks[i:i+batch_size]
-            batch_embeddings = model.encode([chunk.page_content for chunk in batch], 
-                                            device=device, 
-                                            show_progress_bar=True)
-            embeddings.extend(batch_embeddings)
-        
-        embeddings_array = np.array(embeddings)
-        logger.info(f"Created embeddings array of shape {embeddings_array.shape}")
-        return embeddings_array
+        backend = backend or default_backend()
+        encoder = load_encoder(model_name, backend)
+
+        texts = [chunk.page_content for chunk in chunks]
+        if not texts:
+            return np.zeros((0, encoder.dimension), dtype='float32')
+        lengths = token_lengths(texts, encoder)
+        batches = length_batches(lengths, token_budget, max_batch_size)
+
+        started = time.perf_counter()
+        embeddings = None
+        if embedding_pool.should_use_pool(len(texts)):
+            try:
+                embeddings, per_process = embedding_pool.encode_batches(texts, batches, model_name, backend)
+            except (AssertionError, OSError) as e:
+                # e.g. a daemonic prefork child, which may not start processes of its own
+                logger.warning(f"Embedding pool unavailable ({e}), encoding in-process")
+        if embeddings is None:
+            embeddings, per_process = _encode_in_process(encoder, texts, batches)
+        elapsed = time.perf_counter() - started
+
+        throughput = {
+            'processes': [
+                {'pid': pid, 'chunks': count, 'seconds': round(seconds, 3),
+                 'chunks_per_second': round(count / seconds, 1) if seconds else None}
+                for pid, (count, seconds) in sorted(per_process.items())
+            ],
+            'chunks_per_second': round(len(texts) / elapsed, 1) if elapsed else None,
+        }
+        if stats is not None:
+            stats['embedding_throughput'] = throughput
+
+        padded = sum(len(batch) * lengths[batch[0]] for batch in batches)
+        logger.info(f"Created embeddings array of shape {embeddings.shape} in {len(batches)} batches "
+                    f"({sum(lengths) / padded:.0%} of padded tokens used) at {throughput['chunks_per_second']} chunks/s "
+                    f"over {len(per_process)} process(es)")
+        for process in throughput['processes']:
+            logger.info(f"Embedding process {process['pid']}: {process['chunks']} chunks at {process['chunks_per_second']} chunks/s")
+        return embeddings
     except Exception as e:
         logger.error(f"Error in get_embeddings: {str(e)}")
         raise
 
-def create_vector_database(folder_path):
-    logger.info(f"Starting create_vector_database for folder: {folder_path}")
-    try:
-        documents = load_documents(folder_path)
-        logger.info(f"Loaded {len(documents)} documents")
+# Quantizers trained on fewer vectors than this give poor clusters; such
+# projects get an exact flat index instead.
+MIN_TRAINING_VECTORS = 10000
+
+def new_index(dimension, index_factory='Flat', num_vectors=None):
+    import faiss
+
+    if index_factory in (None, '', 'Flat'):
+        return faiss.IndexFlatL2(dimension)
+    index = faiss.index_factory(dimension, index_factory)
+    if not index.is_trained and num_vectors is not None and num_vectors < MIN_TRAINING_VECTORS:
+        logger.info(f"Only {num_vectors} vectors, using a flat index instead of {index_factory}")
+        return faiss.IndexFlatL2(dimension)
+    return index
+
+def training_sample(embeddings, size, seed=0):
+    """Rows to train a quantizer on, read in file order so a memmap is read sequentially."""
+    if len(embeddings) <= size:
+        return np.ascontiguousarray(embeddings, dtype='float32')
+    rows = np.sort(np.random.default_rng(seed).choice(len(embeddings), size=size, replace=False))
+    return np.ascontiguousarray(embeddings[rows], dtype='float32')
 
-        if not documents:
-            logger.warning("No documents loaded. Returning None.")
-            return None, None
+def fill_index(index, embeddings, rows_per_batch, train_size=100000, nprobe=None):
+    # Works the same on an in-memory array and on a memmapped spool
+    import faiss
 
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-        chunks = text_splitter.split_documents(documents)
-        logger.info(f"Created {len(chunks)} chunks")
+    if not index.is_trained:
+        index.train(training_sample(embeddings, train_size))
+        logger.info(f"Trained {type(index).__name__} on {min(len(embeddings), train_size)} vectors")
+    for start in range(0, len(embeddings), rows_per_batch):
+        index.add(np.ascontiguousarray(embeddings[start:start + rows_per_batch], dtype='float32'))
+    # Also finds the IVF index behind a PCA/OPQ transform (IndexPreTransform)
+    ivf = faiss.try_extract_index_ivf(index) if nprobe else None
+    if ivf is not None:
+        ivf.nprobe = nprobe
+    return index
 
-        if not chunks:
-            logger.warning("No chunks created. Returning None.")
-            return None, None
+def search_parameters(index, params):
+    """faiss SearchParameters for a tuned search, or None to use the index's own settings.
 
-        model = SentenceTransformer('all-MiniLM-L6-v2')
-        logger.info("Loaded SentenceTransformer model")
+    Passed per search call, so a shared (and possibly memory-mapped
+    read-only) index is never modified to apply them.
+    """
+    import faiss
 
-        embeddings = model.encode([chunk.page_content for chunk in chunks])
-        logger.info(f"Created {len(embeddings)} embeddings")
+    # Not a faiss index: a project's rows in a shared index, which is always flat
+    if not params or not isinstance(index, faiss.Index):
+        return None
+    # A separate name: the downcast proxy doesn't own the index, the caller's object does
+    downcast = faiss.downcast_index(index)
+    if isinstance(downcast, faiss.IndexPreTransform):
+        # A PCA/OPQ transform in front: the parameters are for the index it wraps
+        inner = search_parameters(downcast.index, params)
+        if inner is None:
+            return None
+        wrapped = faiss.SearchParametersPreTransform(index_params=inner)
+        # Older faiss releases don't keep the nested parameters alive themselves
+        wrapped.referenced_objects = [inner]
+        return wrapped
+    if isinstance(downcast, faiss.IndexIVF) and params.get('nprobe'):
+        return faiss.SearchParametersIVF(nprobe=int(params['nprobe']))
+    if isinstance(downcast, faiss.IndexHNSW) and params.get('efSearch'):
+        return faiss.SearchParametersHNSW(efSearch=int(params['efSearch']))
+    return None
 
-        index = faiss.IndexFlatL2(embeddings.shape[1])
-        index.add(embeddings)
-        logger.info(f"Created FAISS index with {index.ntotal} vectors")
+def _merge_throughput(total, part):
+    processes = {p['pid']: p for p in total.get('processes', [])}
+    for process in part['processes']:
+        merged = processes.setdefault(process['pid'], {'pid': process['pid'], 'chunks': 0, 'seconds': 0.0})
+        merged['chunks'] += process['chunks']
+        merged['seconds'] = round(merged['seconds'] + process['seconds'], 3)
+        merged['chunks_per_second'] = round(merged['chunks'] / merged['seconds'], 1) if merged['seconds'] else None
+    total['processes'] = sorted(processes.values(), key=lambda p: p['pid'])
+    return total
 
+def spool_embeddings(chunks, spool, model_name, rows_per_slice, start=0, on_slice=None, stats=None):
+    """Embed chunks[start:] slice by slice into the float32 memmap `spool`.
+
+    Only one slice of embeddings is held in memory at a time. After each
+    slice is flushed, on_slice(rows_done) is called so progress can be
+    checkpointed.
+    """
+    throughput = {}
+    started = time.perf_counter()
+    for offset in range(start, len(chunks), rows_per_slice):
+        end = min(offset + rows_per_slice, len(chunks))
+        slice_stats = {}
+        spool[offset:end] = get_embeddings(chunks[offset:end], model_name, stats=slice_stats)
+        spool.flush()
+        _merge_throughput(throughput, slice_stats['embedding_throughput'])
+        if on_slice is not None:
+            on_slice(end)
+    elapsed = time.perf_counter() - started
+    throughput.setdefault('processes', [])
+    throughput['chunks_per_second'] = round((len(chunks) - start) / elapsed, 1) if elapsed else None
+    if stats is not None:
+        stats['embedding_throughput'] = throughput
+    logger.info(f"Spooled {len(chunks) - start} embeddings (rows {start}-{len(chunks)})")
+    return spool
+
+def _prepare_chunks(folder_path, extracted, dedup_threshold, stats, model_name, chunk_unit, chunk_size, chunk_overlap):
+    documents = load_documents(folder_path, extracted=extracted)
+    logger.info(f"Loaded {len(documents)} documents")
+    if not documents:
+        logger.warning("No documents loaded. Returning None.")
+        return None
+
+    model = load_model(model_name)
+    chunks, stats['chunking'] = chunk_documents(documents, model, chunk_unit, chunk_size, chunk_overlap)
+    logger.info(f"Created {len(chunks)} chunks with {stats['chunking']}")
+    if not chunks:
+        logger.warning("No chunks created. Returning None.")
+        return None
+
+    # Collapse near-identical chunks (overlap, repeated boilerplate, overlapping sources) before embedding
+    stats['chunks_created'] = len(chunks)
+    chunks, stats['duplicates_removed'] = dedupe_chunks(chunks, threshold=dedup_threshold)
+    return chunks
+
+def create_vector_database(folder_path, extracted=None, dedup_threshold=None, stats=None,
+                           model_name=DEFAULT_MODEL_NAME, chunk_unit=UNIT_TOKENS, chunk_size=None, chunk_overlap=None,
+                           index_factory='Flat', memory_budget=None, spool_dir=None, train_size=100000, nprobe=None,
+                           checkpoint=None, checkpoint_rows=None, progress=None):
+    # `stats`, when given, is filled with counts and the resolved chunking
+    # parameters for the caller to report and store. When the embeddings
+    # would exceed `memory_budget` bytes they are spooled to disk under
+    # spool_dir and streamed into the index instead of held in memory.
+    # With a BuildCheckpoint, chunks and every `checkpoint_rows` embeddings
+    # are persisted as they are produced and a rerun picks up where the
+    # last one stopped. `progress(stage, done, total)` is told about each step.
+    stats = stats if stats is not None else {}
+    progress = progress or (lambda stage, done=None, total=None: None)
+    logger.info(f"Starting create_vector_database for folder: {folder_path}")
+    try:
+        if checkpoint is not None and checkpoint.has_chunks():
+            chunks = checkpoint.load_chunks()
+            stats.update(checkpoint.state.get('stats', {}))
+            logger.info(f"Loaded {len(chunks)} chunks from checkpoint")
+        else:
+            progress('chunking')
+            chunks = _prepare_chunks(folder_path, extracted, dedup_threshold, stats,
+                                     model_name, chunk_unit, chunk_size, chunk_overlap)
+            if chunks is None:
+                return None, None
+            if checkpoint is not None:
+                checkpoint.save_chunks(chunks, {key: stats[key] for key in ('chunking', 'chunks_created', 'duplicates_removed')})
+
+        encoder = load_encoder(model_name)
+        stats['embedding_backend'] = encoder.backend
+        row_bytes = encoder.dimension * 4
+        index = new_index(encoder.dimension, index_factory, len(chunks))
+        over_budget = memory_budget and len(chunks) * row_bytes > memory_budget
+        # Encoder activations and the copy handed to faiss come on top of
+        # each slice, so only a quarter of the budget goes to the slice itself.
+        rows_per_slice = max(256, memory_budget // (4 * row_bytes)) if over_budget else len(chunks)
+
+        if checkpoint is not None:
+            stats['build_mode'] = 'spooled' if over_budget else 'checkpointed'
+            if checkpoint_rows:
+                rows_per_slice = min(rows_per_slice, checkpoint_rows)
+            spool = checkpoint.embeddings(len(chunks), encoder.dimension)
+            stats['resumed_from_row'] = checkpoint.rows_done
+
+            def on_slice(rows_done):
+                checkpoint.mark_rows(rows_done)
+                progress('embedding', rows_done, len(chunks))
+
+            progress('embedding', checkpoint.rows_done, len(chunks))
+            spool_embeddings(chunks, spool, model_name, rows_per_slice, start=checkpoint.rows_done,
+                             on_slice=on_slice, stats=stats)
+            progress('indexing')
+            fill_index(index, spool, rows_per_slice, train_size, nprobe)
+            del spool
+        elif over_budget:
+            stats['build_mode'] = 'spooled'
+            spool_path = os.path.join(spool_dir or folder_path, f'.build-spool-{os.getpid()}-{time.time_ns()}.npy')
+            try:
+                spool = np.lib.format.open_memmap(spool_path, mode='w+', dtype='float32',
+                                                  shape=(len(chunks), encoder.dimension))
+                spool_embeddings(chunks, spool, model_name, rows_per_slice, stats=stats,
+                                 on_slice=lambda rows_done: progress('embedding', rows_done, len(chunks)))
+                progress('indexing')
+                fill_index(index, spool, rows_per_slice, train_size, nprobe)
+                del spool
+            finally:
+                if os.path.exists(spool_path):
+                    os.remove(spool_path)
+        else:
+            stats['build_mode'] = 'in_memory'
+            progress('embedding', 0, len(chunks))
+            embeddings = get_embeddings(chunks, model_name, stats=stats)
+            progress('indexing')
+            logger.info(f"Created {len(embeddings)} embeddings")
+            fill_index(index, embeddings, len(embeddings), train_size, nprobe)
+
+        logger.info(f"Created FAISS index with {index.ntotal} vectors ({stats['build_mode']})")
         return index, chunks
     except Exception as e:
         logger.exception(f"Error in create_vector_database: {str(e)}")
+        if checkpoint is not None:
+            # Let the task retry and resume rather than report an empty build
+            raise
         return None, None
 
-def query_vector_database(query, index, chunks, k=5, model_name='all-MiniLM-L6-v2'):
+def query_vector_database(query, index, chunks, k=5, model_name=DEFAULT_MODEL_NAME, search_params=None):
     logger.info(f"Querying vector database with: '{query}'")
     try:
-        model = SentenceTransformer(model_name)
-        device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        model = model.to(device)
-        
-        query_embedding = model.encode([query], device=device)
-        distances, indices = index.search(query_embedding.astype('float32'), k)
+        encoder = load_encoder(model_name)
+
+        query_embedding = encoder.encode([query])
+        distances, indices = index.search(query_embedding.astype('float32'), k,
+                                          params=search_parameters(index, search_params))
         
         results = []
         for i, dist in zip(indices[0], distances[0]):
+            # -1 pads the results when the index holds fewer than k vectors
+            if i < 0:
+                continue
             results.append({
                 'chunk': chunks[i],
                 'distance': dist
@@ -1,14 +1,21 @@
 from django.shortcuts import render
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
 from django.contrib.auth import authenticate, login, logout
 from django.conf import settings
 from django.middleware.csrf import get_token 
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
-from .models import Document, VectorDatabase
+from rest_framework.settings import api_settings
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from .models import Document, VectorDatabase, UploadSession, ProjectAPIToken
+from . import access_stats, bundles, crawler, index_store, ingest_lock, progress, text_extraction, uploads
+from .admission import AdmissionControlMixin
+from .authentication import ProjectTokenAuthentication, StreamTicketAuthentication
+from .permissions import ProjectTokenScope
+from .pagination import ProjectCursorPagination, DocumentCursorPagination
 import os
+import json
 from .vector_db_utils import create_vector_database, query_vector_database
-import faiss
 import pickle
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework.response import Response
@@ -19,8 +26,6 @@ from urllib.parse import urlparse
 from django.core.files.base import ContentFile
 import urllib.parse
 from django.core.files.storage import default_storage
-from bs4 import BeautifulSoup
-import PyPDF2
 import uuid
 from django.contrib.auth.models import User
 from celery.result import AsyncResult
@@ -32,6 +37,9 @@ import shutil
 from django.core.exceptions import PermissionDenied
 from django.db.models import Count, Q
 from django.core.cache import cache
+from datetime import datetime, timezone as dt_timezone
+import redis
+import kombu.exceptions
 
 
 # Set up logger
@@ -47,6 +55,7 @@ class BaseView(APIView):
             'version': '1.2.0',
             'status': 'running',
             'application_stats': stats,
+            'sse_connections': progress.connection_count(),
             'environment': getattr(settings, 'ENVIRONMENT', 'development'),
             'debug_mode': settings.DEBUG,
             'media_root': settings.MEDIA_ROOT,
@@ -89,8 +98,9 @@ class BaseView(APIView):
 
         return stats
 
-class UploadDocumentView(APIView):
+class UploadDocumentView(AdmissionControlMixin, APIView):
     permission_classes = [IsAuthenticated]
+    admission_scope = 'ingest'
 
     def post(self, request):
         project_id = request.data.get('project_id')
@@ -104,13 +114,136 @@ class UploadDocumentView(APIView):
         
         files = request.FILES.getlist('documents')
         if files:
+            uploaded = []
             for file in files:
-                Document.objects.create(user=request.user, file=file, vector_database=vector_db)
-            return Response({'message': 'Documents uploaded successfully'}, status=status.HTTP_200_OK)
+                document, deduplicated = uploads.store_uploaded_file(request.user, vector_db, file)
+                uploaded.append({
+                    'document_id': document.document_id,
+                    'file_name': document.file.name,
+                    'deduplicated': deduplicated,
+                })
+            vector_db.refresh_document_stats()
+            return Response({'message': 'Documents uploaded successfully', 'documents': uploaded}, status=status.HTTP_200_OK)
         else:
             return Response({'error': 'No files were uploaded'}, status=status.HTTP_400_BAD_REQUEST)
 
 
+class StartChunkedUploadView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        project_id = request.data.get('project_id')
+        filename = request.data.get('filename')
+        total_size = request.data.get('total_size')
+        expected_hash = (request.data.get('sha256') or '').lower()
+
+        if not project_id or not filename or total_size is None:
+            return Response({'error': 'Project ID, filename and total_size are required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            total_size = int(total_size)
+        except (TypeError, ValueError):
+            return Response({'error': 'total_size must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        if total_size <= 0 or total_size > settings.UPLOAD_MAX_SIZE:
+            return Response({'error': f'total_size must be between 1 and {settings.UPLOAD_MAX_SIZE} bytes'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            vector_db = VectorDatabase.objects.get(project_id=project_id, user=request.user)
+        except VectorDatabase.DoesNotExist:
+            return Response({'error': 'Vector database not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        filename = os.path.basename(filename.replace('\\', '/'))
+        uploads.purge_expired_sessions(request.user)
+
+        # If the client already knows the hash, identical content skips the transfer entirely
+        duplicate, same_project = uploads.find_duplicate(request.user, vector_db, expected_hash)
+        if duplicate is not None:
+            document = duplicate if same_project else uploads.link_document(request.user, vector_db, duplicate, filename)
+            vector_db.refresh_document_stats()
+            return Response({
+                'complete': True,
+                'deduplicated': True,
+                'document_id': document.document_id,
+            }, status=status.HTTP_200_OK)
+
+        session = UploadSession.objects.create(
+            user=request.user,
+            vector_database=vector_db,
+            filename=filename,
+            total_size=total_size,
+            expected_hash=expected_hash,
+        )
+        return Response({
+            'upload_id': session.upload_id,
+            'offset': 0,
+            'chunk_size': settings.UPLOAD_CHUNK_SIZE,
+            'complete': False,
+        }, status=status.HTTP_201_CREATED)
+
+
+class UploadChunkView(AdmissionControlMixin, APIView):
+    permission_classes = [IsAuthenticated]
+    admission_scope = 'ingest'
+
+    def put(self, request):
+        # The body is the raw chunk; parameters come from the query string and
+        # headers so the request body is streamed to disk rather than parsed.
+        upload_id = request.query_params.get('upload_id')
+        offset = request.headers.get('Upload-Offset', request.query_params.get('offset'))
+        if not upload_id or offset is None:
+            return Response({'error': 'upload_id and Upload-Offset are required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            offset = int(offset)
+            length = int(request.headers.get('Content-Length') or 0)
+        except ValueError:
+            return Response({'error': 'Upload-Offset and Content-Length must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            session = UploadSession.objects.select_related('vector_database', 'user').get(upload_id=upload_id, user=request.user)
+        except UploadSession.DoesNotExist:
+            return Response({'error': 'Upload not found'}, status=status.HTTP_404_NOT_FOUND)
+        if session.status != UploadSession.STATUS_UPLOADING:
+            return Response({'error': f'Upload is {session.status}'}, status=status.HTTP_409_CONFLICT)
+
+        try:
+            document = uploads.write_chunk(session, request._request, offset, length)
+        except uploads.OffsetMismatch as e:
+            return Response({'error': 'Offset mismatch', 'offset': e.offset}, status=status.HTTP_409_CONFLICT)
+        except uploads.UploadError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        data = {
+            'upload_id': session.upload_id,
+            'offset': session.received_bytes,
+            'complete': document is not None,
+        }
+        if document is not None:
+            data['document_id'] = document.document_id
+            data['sha256'] = session.content_hash
+        return Response(data, status=status.HTTP_200_OK)
+
+
+class UploadStatusView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        upload_id = request.GET.get('upload_id')
+        if not upload_id:
+            return Response({'error': 'upload_id is required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            session = UploadSession.objects.get(upload_id=upload_id, user=request.user)
+        except UploadSession.DoesNotExist:
+            return Response({'error': 'Upload not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        return Response({
+            'upload_id': session.upload_id,
+            'status': session.status,
+            'offset': session.received_bytes,
+            'total_size': session.total_size,
+            'complete': session.status == UploadSession.STATUS_COMPLETE,
+            'document_id': session.document_id,
+        }, status=status.HTTP_200_OK)
+
+
 class CreateProjectView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -153,13 +286,33 @@ class ProcessDocumentsView(APIView):
         except VectorDatabase.DoesNotExist:
             return Response({'error': 'Vector database not found'}, status=status.HTTP_404_NOT_FOUND)
         
-        from .tasks import process_documents_task
-        task = process_documents_task.delay(project_id, request.user.id)
-        
-        return Response({'message': 'Document processing started', 'task_id': str(task.id)}, status=status.HTTP_202_ACCEPTED)
+        # Coalesce with a run already in flight for this project; a follow-up
+        # is queued only if documents were added after that run started
+        def has_new_documents(started_at):
+            return Document.objects.filter(
+                vector_database=vector_db, processed=False,
+                uploaded_at__gt=datetime.fromtimestamp(started_at, tz=dt_timezone.utc),
+            ).exists()
 
-class QueryDocumentsView(APIView):
-    permission_classes = [IsAuthenticated]
+        try:
+            task_id, state = ingest_lock.request_run(vector_db.project_id, request.user.id, has_new_documents)
+        except (redis.RedisError, kombu.exceptions.OperationalError) as e:
+            # The lock is released again if the task couldn't be queued
+            logger.error(f"Could not schedule processing for project {project_id}: {str(e)}")
+            return Response({'error': 'Document processing is temporarily unavailable'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        messages = {
+            'started': 'Document processing started',
+            'running': 'Document processing is already running for this project',
+            'queued': 'Document processing is running; a follow-up run is queued for newly added documents',
+        }
+        return Response({'message': messages[state], 'task_id': task_id, 'state': state}, status=status.HTTP_202_ACCEPTED)
+
+class QueryDocumentsView(AdmissionControlMixin, APIView):
+    # Also open to project API tokens, limited to their own project
+    authentication_classes = api_settings.DEFAULT_AUTHENTICATION_CLASSES + [ProjectTokenAuthentication]
+    permission_classes = [IsAuthenticated, ProjectTokenScope]
+    admission_scope = 'query'
 
     def post(self, request):
         logger.info("QueryDocumentsView.post method called")
@@ -179,24 +332,17 @@ class QueryDocumentsView(APIView):
             }, status=404)
         
         try:
-            index_path = os.path.join(settings.MEDIA_ROOT, vector_db.index_file.name)
-            chunks_path = os.path.join(settings.MEDIA_ROOT, vector_db.chunks_file.name)
-            
-            logger.info(f"Index path: {index_path}")
-            logger.info(f"Chunks path: {chunks_path}")
-            
-            if not os.path.exists(index_path) or not os.path.exists(chunks_path):
+            logger.info(f"Index version: {vector_db.index_version}, index file: {vector_db.index_file.name}")
+
+            # Versions are immutable, so a cached copy is valid for as long as the row points at it
+            try:
+                index, chunks = index_store.load_index(vector_db)
+                access_stats.record_access(vector_db.project_id)
+                logger.info(f"Index loaded successfully. Chunks type: {type(chunks)}, Length: {len(chunks)}")
+            except FileNotFoundError:
                 return JsonResponse({
                     'error': 'Vector database files not found. Please reprocess your documents.'
                 }, status=404)
-            
-            index = faiss.read_index(index_path)
-            logger.info("FAISS index loaded successfully")
-            
-            try:
-                with open(chunks_path, 'rb') as f:
-                    chunks = pickle.load(f)
-                logger.info(f"Chunks loaded successfully. Type: {type(chunks)}, Length: {len(chunks)}")
             except KeyError as e:
                 if str(e) == "'__fields_set__'":
                     logger.error("Pydantic version mismatch detected when loading chunks")
@@ -206,14 +352,15 @@ class QueryDocumentsView(APIView):
                     }, status=500)
                 else:
                     raise
-            except Exception as e:
+            except (pickle.UnpicklingError, EOFError, AttributeError, ImportError) as e:
                 logger.error(f"Error loading chunks: {str(e)}", exc_info=True)
                 return JsonResponse({
                     'error': 'Error loading chunks file. Please reprocess your documents.',
                     'details': str(e)
                 }, status=500)
 
-            results = query_vector_database(query, index, chunks)
+            results = query_vector_database(query, index, chunks, model_name=vector_db.model_name,
+                                            search_params=vector_db.search_params)
             logger.info(f"Query results obtained. Number of results: {len(results)}")
             
             formatted_results = []
@@ -228,24 +375,80 @@ class QueryDocumentsView(APIView):
                     logger.error(f"Problematic chunk: {r['chunk']}")
                     continue
             
-            return JsonResponse({'results': formatted_results})
+            return JsonResponse({'results': formatted_results, 'index_version': vector_db.index_version})
         except Exception as e:
             logger.error(f"An error occurred while querying the vector database: {str(e)}", exc_info=True)
             return JsonResponse({
                 'error': f'An error occurred while querying the vector database: {str(e)}',
                 'details': {
-                    'index_path': index_path if 'index_path' in locals() else 'Not set',
-                    'chunks_path': chunks_path if 'chunks_path' in locals() else 'Not set',
+                    'index_file': vector_db.index_file.name,
+                    'index_version': vector_db.index_version,
                     'chunks_type': type(chunks).__name__ if 'chunks' in locals() else 'Not loaded',
                     'results_type': type(results).__name__ if 'results' in locals() else 'Not generated'
                 }
             }, status=500)
 
+class ProjectAPITokenView(APIView):
+    """List (GET) or create (POST) a project's API tokens for machine clients."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        project_id = request.GET.get('project_id')
+        if not project_id:
+            return Response({'error': 'Project ID is required'}, status=status.HTTP_400_BAD_REQUEST)
+        if not VectorDatabase.objects.filter(project_id=project_id, user=request.user).exists():
+            return Response({'error': 'Project not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        tokens = ProjectAPIToken.objects.filter(vector_database_id=project_id).order_by('-created_at')
+        return Response({'tokens': [{
+            'token_id': token.token_id,
+            'name': token.name,
+            'prefix': token.prefix,
+            'created_at': token.created_at.isoformat(),
+            'last_used_at': token.last_used_at.isoformat() if token.last_used_at else None,
+        } for token in tokens]}, status=status.HTTP_200_OK)
+
+    def post(self, request):
+        project_id = request.data.get('project_id')
+        name = request.data.get('name', '')
+        if not project_id:
+            return Response({'error': 'Project ID is required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            vector_db = VectorDatabase.objects.get(project_id=project_id, user=request.user)
+        except VectorDatabase.DoesNotExist:
+            return Response({'error': 'Project not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        token, key = ProjectAPIToken.issue(vector_db, name=name)
+        return Response({
+            'message': 'API token created. Store the key now; it cannot be shown again.',
+            'token_id': token.token_id,
+            'name': token.name,
+            'key': key,
+        }, status=status.HTTP_201_CREATED)
+
+class RevokeProjectAPITokenView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        project_id = request.data.get('project_id')
+        token_id = request.data.get('token_id')
+        if not project_id or not token_id:
+            return Response({'error': 'Both project_id and token_id are required'}, status=status.HTTP_400_BAD_REQUEST)
+
+        deleted, _ = ProjectAPIToken.objects.filter(
+            token_id=token_id, vector_database_id=project_id, user=request.user
+        ).delete()
+        if not deleted:
+            return Response({'error': 'API token not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'message': 'API token revoked'}, status=status.HTTP_200_OK)
+
 class ProjectExplorerView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
+        paginator = ProjectCursorPagination()
         user_projects = VectorDatabase.objects.filter(user=request.user)
+        page = paginator.paginate_queryset(user_projects, request, view=self)
         project_data = [
             {
                 'id': project.project_id,
@@ -255,11 +458,19 @@ class ProjectExplorerView(APIView):
                 'description': project.description,
                 'approvedDomains': project.approvedDomains,
                 'introPrompt': project.introPrompt,
-                'num_documents': project.documents.count(),
+                'num_documents': project.num_documents,
+                'num_chunks': project.num_chunks,
+                'total_bytes': project.total_bytes,
+                'index_size': project.index_size,
+                'duplicate_chunks': project.duplicate_chunks,
             }
-            for project in user_projects
+            for project in page
         ]
-        return JsonResponse({'projects': project_data}, status=200)
+        return JsonResponse({
+            'projects': project_data,
+            'next': paginator.get_next_link(),
+            'previous': paginator.get_previous_link(),
+        }, status=200)
 
 class ProjectDetailView(APIView):
     permission_classes = [IsAuthenticated]
@@ -276,8 +487,16 @@ class ProjectDetailView(APIView):
         except VectorDatabase.DoesNotExist:
             return Response({"error": "Project not found"}, status=status.HTTP_404_NOT_FOUND)
 
-        # Get all documents associated with this project
-        documents = Document.objects.filter(vector_database=project)
+        # Get one page of documents associated with this project. The cursor is
+        # read from the query string (?cursor=...), so follow `next` with the same body.
+        paginator = DocumentCursorPagination()
+        documents = Document.objects.filter(vector_database=project).only(
+            'document_id', 'file', 'uploaded_at', 'processed', 'file_size'
+        )
+        page = paginator.paginate_queryset(documents, request, view=self)
+
+        # Build paths by joining against MEDIA_ROOT instead of going through storage per file
+        media_root = os.path.abspath(settings.MEDIA_ROOT)
 
         # Prepare the project data
         project_data = {
@@ -285,23 +504,31 @@ class ProjectDetailView(APIView):
             'name': project.name,
             'created_at': project.created_at.isoformat(),
             'updated_at': project.updated_at.isoformat(),
+            'num_documents': project.num_documents,
+            'num_chunks': project.num_chunks,
+            'total_bytes': project.total_bytes,
+            'index_size': project.index_size,
+            'duplicate_chunks': project.duplicate_chunks,
             'files': [
                 {
                     'id': doc.document_id,
                     'name': doc.file.name,
                     'uploaded_at': doc.uploaded_at.isoformat(),
                     'processed': doc.processed,
-                    'file_path': doc.file.path,
-                    'file_size': doc.file.size,
+                    'file_path': os.path.join(media_root, doc.file.name),
+                    'file_size': doc.file_size,
                 }
-                for doc in documents
-            ]
+                for doc in page
+            ],
+            'next': paginator.get_next_link(),
+            'previous': paginator.get_previous_link(),
         }
 
         return Response(project_data, status=status.HTTP_200_OK)
 
-class ScrapeUrlView(APIView):
+class ScrapeUrlView(AdmissionControlMixin, APIView):
     permission_classes = [IsAuthenticated]
+    admission_scope = 'ingest'
 
     def post(self, request):
         url = request.data.get('url')
@@ -318,40 +545,75 @@ class ScrapeUrlView(APIView):
             return Response({"error": "Invalid URL"}, status=status.HTTP_400_BAD_REQUEST)
         
         try:
-            response = requests.get(url, timeout=10)
-            response.raise_for_status()  # Raises an HTTPError for bad responses
-            
-            content_type = response.headers.get('Content-Type', '')
-            if 'text/html' not in content_type.lower():
-                return Response({"error": "The URL does not point to an HTML page"}, status=status.HTTP_400_BAD_REQUEST)
-        
-            html_content = response.text
+            vector_db = VectorDatabase.objects.get(project_id=project_id, user=request.user)
+        except VectorDatabase.DoesNotExist:
+            return Response({'error': 'Vector database not found'}, status=status.HTTP_404_NOT_FOUND)
 
-            try:
-                vector_db = VectorDatabase.objects.get(project_id=project_id, user=request.user)
-            except VectorDatabase.DoesNotExist:
-                return Response({'error': 'Vector database not found'}, status=status.HTTP_404_NOT_FOUND)
-            
-            if html_content:
-                # Create a safe filename from the URL
-                parsed_url = urllib.parse.urlparse(url)
-                safe_filename = f"{parsed_url.netloc}{parsed_url.path}".replace('/', '_')
-                if not safe_filename.endswith('.html'):
-                    safe_filename += '.html'
-
-                # Create the Document object
-                document = Document(user=request.user, vector_database=vector_db)
-                document.file.save(safe_filename, ContentFile(html_content.encode('utf-8')), save=True)
-
-                return Response({'message': 'Document uploaded successfully'}, status=status.HTTP_200_OK)
-            else:
-                return Response({'error': 'No content was uploaded'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        except requests.RequestException as e:
-            return Response({"error": f"Error fetching URL: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        # Re-scraping a known page sends its validators so an unchanged page costs a 304
+        document = Document.objects.filter(vector_database=vector_db, source_url=url).first()
+        page = crawler.fetch_page(
+            crawler.get_session(), url,
+            etag=document.etag if document else '',
+            last_modified=document.last_modified if document else '',
+        )
+        if page.error:
+            return Response({"error": f"Error fetching URL: {page.error}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        if page.not_modified and document:
+            return Response({'message': 'Document is already up to date', 'document_id': document.document_id}, status=status.HTTP_200_OK)
+        if not page.is_html:
+            return Response({"error": "The URL does not point to an HTML page"}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Only the page's main text is stored, so ingestion never parses HTML
+        text = text_extraction.html_to_text(page.content) if page.content else ''
+        if text:
+            document, changed = uploads.store_scraped_page(
+                request.user, vector_db, url, crawler.safe_filename_for_url(url, '.txt'),
+                text, page.etag, page.last_modified, document=document,
+            )
+            vector_db.refresh_document_stats()
+            message = 'Document uploaded successfully' if changed else 'Document is already up to date'
+            return Response({'message': message, 'document_id': document.document_id}, status=status.HTTP_200_OK)
+        else:
+            return Response({'error': 'No text content was found on the page'}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class BatchScrapeView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        project_id = request.data.get('project_id')
+        sitemap_url = request.data.get('sitemap_url')
+        if hasattr(request.data, 'getlist'):
+            urls = request.data.getlist('urls')
+        else:
+            urls = request.data.get('urls') or []
+        if isinstance(urls, str):
+            urls = urls.split()
+
+        if not project_id or not (urls or sitemap_url):
+            return Response({"error": "Project ID and a list of URLs or a sitemap URL are required"}, status=status.HTTP_400_BAD_REQUEST)
+
+        invalid = [url for url in urls if not crawler.is_valid_url(url)]
+        if sitemap_url and not crawler.is_valid_url(sitemap_url):
+            invalid.append(sitemap_url)
+        if invalid:
+            return Response({"error": "Invalid URL", "invalid_urls": invalid}, status=status.HTTP_400_BAD_REQUEST)
+        if len(urls) > settings.CRAWL_MAX_URLS:
+            return Response({"error": f"At most {settings.CRAWL_MAX_URLS} URLs can be crawled at once"}, status=status.HTTP_400_BAD_REQUEST)
+
+        if not VectorDatabase.objects.filter(project_id=project_id, user=request.user).exists():
+            return Response({'error': 'Vector database not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        from .tasks import crawl_urls_task
+        task = crawl_urls_task.delay(project_id, request.user.id, urls=urls, sitemap_url=sitemap_url)
+
+        return Response({'message': 'Crawl started', 'task_id': str(task.id)}, status=status.HTTP_202_ACCEPTED)
 
-class DocumentPreviewView(APIView):
+class DocumentPreviewView(AdmissionControlMixin, APIView):
     permission_classes = [IsAuthenticated]
+    # Its own limits: a preview is usually a cached read and shouldn't wait behind uploads
+    admission_scope = 'preview'
+    max_chars = 50000
 
     def post(self, request):
         document_id = request.data.get('document_id')
@@ -360,59 +622,47 @@ class DocumentPreviewView(APIView):
         if not document_id or not project_id:
             return Response({"error": "Both document_id and project_id are required"}, status=status.HTTP_400_BAD_REQUEST)
 
+        try:
+            offset = int(request.data.get('offset', 0))
+            limit = min(int(request.data.get('limit', self.max_chars)), self.max_chars)
+            page = request.data.get('page')
+            page = int(page) if page not in (None, '') else None
+        except (TypeError, ValueError):
+            return Response({"error": "offset, limit and page must be integers"}, status=status.HTTP_400_BAD_REQUEST)
+        if offset < 0 or limit <= 0:
+            return Response({"error": "offset must be >= 0 and limit > 0"}, status=status.HTTP_400_BAD_REQUEST)
+
         try:
             vector_db = VectorDatabase.objects.get(project_id=project_id, user=request.user)
             document = Document.objects.get(document_id=document_id, vector_database=vector_db)
         except (VectorDatabase.DoesNotExist, Document.DoesNotExist):
             return Response({"error": "Document or project not found"}, status=status.HTTP_404_NOT_FOUND)
 
-        file_path = document.file.path
-        file_name = os.path.basename(file_path)
+        file_name = os.path.basename(document.file.name)
         file_extension = os.path.splitext(file_name)[1].lower()
+        if file_extension not in text_extraction.SUPPORTED_EXTENSIONS:
+            return Response({"error": "Unsupported file type"}, status=status.HTTP_400_BAD_REQUEST)
 
-        preview_content = ""
+        # Served from the text artifact extracted at ingest; extracted here on first preview otherwise
+        meta = text_extraction.ensure_text_artifact(document)
+        if page is not None:
+            if not 0 <= page < len(meta['pages']):
+                return Response({"error": "Page out of range"}, status=status.HTTP_400_BAD_REQUEST)
+            offset = meta['pages'][page]
 
-        if file_extension == '.pdf':
-            preview_content = self.preview_pdf(file_path)
-        elif file_extension in ['.html', '.htm']:
-            preview_content = self.preview_html(file_path)
-        elif file_extension == '.txt':
-            preview_content = self.preview_txt(file_path)
-        else:
-            return Response({"error": "Unsupported file type"}, status=status.HTTP_400_BAD_REQUEST)
+        preview_content = text_extraction.read_text(document, meta, offset, limit)
+        next_offset = offset + len(preview_content)
 
         return Response({
             "file_name": file_name,
-            "preview_content": preview_content
+            "preview_content": preview_content,
+            "offset": offset,
+            "limit": limit,
+            "total_length": meta['length'],
+            "next_offset": next_offset if next_offset < meta['length'] else None,
+            "page_offsets": meta['pages'],
         }, status=status.HTTP_200_OK)
 
-    def preview_pdf(self, file_path, max_pages=10):
-        with open(file_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            num_pages = len(pdf_reader.pages)
-            preview_content = ""
-
-            for page in range(min(num_pages, max_pages)):
-                preview_content += pdf_reader.pages[page].extract_text() + "\n\n"
-
-        return preview_content.strip()
-
-    def preview_html(self, file_path, max_chars=50000):
-        with open(file_path, 'r', encoding='utf-8') as file:
-            soup = BeautifulSoup(file, 'html.parser')
-            text = soup.get_text(separator=' ')  # Use space as separator
-            text = ' '.join(text.split())  # Remove extra whitespace
-            preview_content = text[:max_chars] + "..." if len(text) > max_chars else text
-
-        return preview_content.strip()
-
-    def preview_txt(self, file_path, max_chars=50000):
-        with open(file_path, 'r', encoding='utf-8') as file:
-            text = file.read(max_chars)
-            preview_content = text + "..." if len(text) == max_chars else text
-
-        return preview_content.strip()
-
 class DeleteDocumentView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -441,8 +691,9 @@ class DeleteDocumentView(APIView):
 
         return Response({"message": "Document deleted successfully"}, status=status.HTTP_200_OK)
 
-class SaveTextDocumentView(APIView):
+class SaveTextDocumentView(AdmissionControlMixin, APIView):
     permission_classes = [IsAuthenticated]
+    admission_scope = 'ingest'
 
     def post(self, request):
         project_id = request.data.get('project_id')
@@ -477,6 +728,7 @@ class SaveTextDocumentView(APIView):
         # Create the Document object
         document = Document(user=request.user, vector_database=vector_db)
         document.file.save(unique_file_name, ContentFile(text_content.encode('utf-8')), save=True)
+        vector_db.refresh_document_stats()
 
         return Response({
             'message': 'Text document saved successfully',
@@ -607,6 +859,48 @@ class TaskStatusView(APIView):
             'result': result
         })
 
+class EventStreamRenderer(BaseRenderer):
+    # Lets DRF accept EventSource's "Accept: text/event-stream"; errors are sent as JSON data
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return f"data: {json.dumps(data)}\n\n".encode('utf-8')
+
+
+class TaskProgressTicketView(APIView):
+    """Issue a single-use ticket for opening a task's progress stream from the browser."""
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        task_id = request.data.get('task_id')
+        if not task_id:
+            return Response({'error': 'Task ID is required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            ticket = progress.issue_ticket(request.user.id, task_id)
+        except redis.RedisError as e:
+            logger.error(f"Could not issue a progress stream ticket for task {task_id}: {str(e)}")
+            return Response({'error': 'Progress streaming is temporarily unavailable'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return Response({'ticket': ticket, 'expires_in': settings.SSE_TICKET_TTL}, status=status.HTTP_201_CREATED)
+
+class TaskProgressView(APIView):
+    """Stream a task's state changes as Server-Sent Events instead of polling task_status/."""
+    # Header authentication, or a ticket from task_progress/ticket/ for EventSource
+    authentication_classes = api_settings.DEFAULT_AUTHENTICATION_CLASSES + [StreamTicketAuthentication]
+    renderer_classes = [EventStreamRenderer, JSONRenderer]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        task_id = request.GET.get('task_id')
+        if not task_id:
+            return JsonResponse({'error': 'Task ID is required'}, status=400)
+
+        response = StreamingHttpResponse(progress.stream(task_id), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Stop nginx-style proxies from buffering the stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
 class DemoModeView(APIView):
     def post(self, request):
         logger.info("Demo mode activation started")
@@ -641,7 +935,16 @@ class DemoModeView(APIView):
 
             for project_folder in os.listdir(demo_folder):
                 project_path = os.path.join(demo_folder, project_folder)
-                if os.path.isdir(project_path):
+                if project_folder.endswith(bundles.BUNDLE_EXTENSION) and os.path.isfile(project_path):
+                    # Bundles (export_project) are checksummed and carry their own metadata
+                    with open(project_path, 'rb') as f:
+                        new_project = bundles.import_bundle(f, user)
+                    logger.info(f"Imported demo project {new_project.name} with ID: {new_project.project_id}")
+                    projects.append({
+                        'name': new_project.name,
+                        'id': new_project.project_id
+                    })
+                elif os.path.isdir(project_path):
                     logger.debug(f"Processing demo project folder: {project_folder}")
                     
                     # Create a new project for each folder
@@ -689,8 +992,18 @@ class DemoModeView(APIView):
                     if faiss_index_path and chunks_path:
                         new_project.index_file = faiss_index_path
                         new_project.chunks_file = chunks_path
+                        index_full_path = os.path.join(settings.MEDIA_ROOT, faiss_index_path)
+                        new_project.index_size = os.path.getsize(index_full_path)
+                        # Memory-mapped where the format allows, since only the header is needed
+                        new_project.num_chunks = index_store.read_faiss_index(index_full_path)[0].ntotal
+                        # The demo indexes were built with 1000/200 character chunks
+                        new_project.embedding_model = 'all-MiniLM-L6-v2'
+                        new_project.chunk_unit = 'characters'
+                        new_project.chunk_size = 1000
+                        new_project.chunk_overlap = 200
                         new_project.save()
                         logger.info(f"Updated project {new_project.project_id} with index paths")
+                    new_project.refresh_document_stats()
 
             response_data = {
                 'message': 'Demo mode activated',
@@ -709,6 +1022,60 @@ class DemoModeView(APIView):
                 'error': 'Demo mode activation failed. Please try again or contact support.'
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+class ExportProjectView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        project_id = request.query_params.get('project_id')
+        include_sources = request.query_params.get('sources', '1') not in ('0', 'false')
+        if not project_id:
+            return Response({'error': 'Project ID is required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            vector_db = VectorDatabase.objects.get(project_id=project_id, user=request.user)
+        except VectorDatabase.DoesNotExist:
+            return Response({'error': 'Vector database not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        # Built before streaming starts, so a missing index is still a proper error response
+        try:
+            manifest, members = bundles.bundle_manifest(vector_db, include_sources)
+        except bundles.BundleError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except FileNotFoundError:
+            return Response({'error': 'Vector database files not found. Please reprocess your documents.'}, status=status.HTTP_404_NOT_FOUND)
+
+        response = StreamingHttpResponse(bundles.iter_bundle(manifest, members), content_type='application/x-tar')
+        response['Content-Disposition'] = f'attachment; filename="project_{vector_db.project_id}{bundles.BUNDLE_EXTENSION}"'
+        return response
+
+
+class ImportProjectView(AdmissionControlMixin, APIView):
+    permission_classes = [IsAuthenticated]
+    admission_scope = 'ingest'
+
+    def post(self, request):
+        # The body is the raw bundle, read as it arrives; the optional name comes from the query string
+        try:
+            length = int(request.headers.get('Content-Length') or 0)
+        except ValueError:
+            return Response({'error': 'Content-Length must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        if not length:
+            return Response({'error': 'No bundle was uploaded'}, status=status.HTTP_400_BAD_REQUEST)
+        if length > settings.BUNDLE_MAX_SIZE:
+            return Response({'error': f'Bundles are limited to {settings.BUNDLE_MAX_SIZE} bytes'}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+        try:
+            vector_db = bundles.import_bundle(request._request, request.user, name=request.query_params.get('name'))
+        except bundles.BundleError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            'message': 'Project imported successfully',
+            'project_id': vector_db.project_id,
+            'name': vector_db.name,
+            'num_documents': vector_db.num_documents,
+            'num_chunks': vector_db.num_chunks,
+        }, status=status.HTTP_201_CREATED)
+
+
 class DeleteProjectView(APIView):
     permission_classes = [IsAuthenticated]
 
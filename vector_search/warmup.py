@@ -0,0 +1,66 @@
+import os
+import time
+import logging
+from django.conf import settings
+from . import access_stats, index_store
+from .models import VectorDatabase
+
+logger = logging.getLogger('vector_search')
+
+
+def estimated_bytes(vector_db):
+    # The index file plus the pickled chunks; unpickled chunks take somewhat more.
+    # For a project in a shared index, its share of the shard's vectors.
+    chunks_path = os.path.join(settings.MEDIA_ROOT, vector_db.chunks_file.name) if vector_db.chunks_file else ''
+    chunks_size = os.path.getsize(chunks_path) if chunks_path and os.path.exists(chunks_path) else 0
+    return vector_db.index_size + chunks_size
+
+
+def prewarm(limit=None, memory_bytes=None, load_models=True):
+    """Load the hottest projects' indexes (and their embedding models) into this process.
+
+    Stops at `limit` projects, the per-process index cache size or the memory
+    budget, whichever comes first. Returns a list of (project_id, bytes, seconds).
+    """
+    from .vector_db_utils import load_encoder
+
+    limit = min(limit or settings.PREWARM_TOP_PROJECTS, settings.INDEX_CACHE_MAX_ENTRIES)
+    budget = memory_bytes if memory_bytes is not None else settings.PREWARM_MEMORY_MB * 1024 * 1024
+    try:
+        # Extra candidates so projects that are gone or over budget can be skipped
+        ranked = access_stats.hottest(limit * 3)
+    except Exception as e:
+        logger.warning(f"Skipping prewarm, access stats unavailable: {str(e)}")
+        return []
+
+    projects = VectorDatabase.objects.in_bulk(ranked)
+    loaded = []
+    used = 0
+    models = set()
+    for project_id in ranked:
+        if len(loaded) >= limit:
+            break
+        vector_db = projects.get(project_id)
+        if vector_db is None:
+            access_stats.forget(project_id)
+            continue
+        if not (vector_db.index_file or vector_db.shared_shard):
+            continue
+        size = estimated_bytes(vector_db)
+        if used + size > budget:
+            continue
+        started = time.perf_counter()
+        try:
+            index_store.load_index(vector_db)
+        except Exception as e:
+            logger.warning(f"Could not prewarm project {project_id}: {str(e)}")
+            continue
+        used += size
+        models.add(vector_db.model_name)
+        loaded.append((project_id, size, time.perf_counter() - started))
+
+    if load_models:
+        for model_name in models:
+            load_encoder(model_name)
+    logger.info(f"Prewarmed {len(loaded)} projects ({used / 2 ** 20:.0f} MB) and {len(models)} models")
+    return loaded
@@ -1,6 +1,10 @@
 from __future__ import absolute_import, unicode_literals
 import os
 from celery import Celery
+from datetime import datetime
+import time
+from celery.signals import (before_task_publish, task_failure, task_prerun, task_retry, task_success,
+                            worker_process_shutdown, worker_shutdown)
 
 # Set the default Django settings module for the 'celery' program.
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'vector_search_project.settings')
@@ -14,6 +18,61 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 # Load task modules from all registered Django app configs.
 app.autodiscover_tasks()
 
+
+@before_task_publish.connect
+def stamp_enqueued_at(headers=None, **kwargs):
+    # Read back in task_prerun to measure how long the task sat in its queue
+    if headers is not None:
+        headers['enqueued_at'] = time.time()
+
+
+@task_prerun.connect
+def record_queue_wait(task=None, **kwargs):
+    enqueued_at = getattr(task.request, 'enqueued_at', None)
+    if enqueued_at is None:
+        return
+    # A countdown/ETA is a deliberate delay, not time spent waiting for a worker
+    ready_at = enqueued_at
+    if task.request.eta:
+        eta = task.request.eta
+        ready_at = max(ready_at, (datetime.fromisoformat(eta) if isinstance(eta, str) else eta).timestamp())
+    from vector_search.queues import record_queue_wait
+    record_queue_wait(task, max(0.0, time.time() - ready_at))
+
+
+# Task state changes are pushed to task_progress/ subscribers over Redis pub/sub
+@task_prerun.connect
+def publish_started(task_id=None, **kwargs):
+    from vector_search.progress import publish
+    publish(task_id, 'STARTED')
+
+
+@task_success.connect
+def publish_success(sender=None, result=None, **kwargs):
+    from vector_search.progress import publish
+    state = 'FAILURE' if isinstance(result, dict) and 'error' in result else 'SUCCESS'
+    publish(sender.request.id, state, result=result)
+
+
+@task_failure.connect
+def publish_failure(task_id=None, exception=None, **kwargs):
+    from vector_search.progress import publish
+    publish(task_id, 'FAILURE', result=str(exception))
+
+
+@task_retry.connect
+def publish_retry(request=None, reason=None, **kwargs):
+    from vector_search.progress import publish
+    publish(request.id, 'RETRY', reason=str(reason))
+
+
+@worker_shutdown.connect
+@worker_process_shutdown.connect
+def stop_embedding_pool(**kwargs):
+    # The embedding pool is started lazily by the first large job; stop its children with the worker
+    from vector_search.embedding_pool import shutdown_pool
+    shutdown_pool()
+
 @app.task(bind=True)
 def debug_task(self):
     print(f'Request: {self.request!r}')
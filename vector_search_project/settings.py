@@ -1,4 +1,5 @@
 import os
+import json
 from pathlib import Path
 import dj_database_url
 from dotenv import load_dotenv
@@ -101,6 +102,11 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
+# Long builds are acked only when they finish (acks_late); a task is redelivered
+# if not acked within the visibility timeout, so keep it above the longest build
+CELERY_BROKER_TRANSPORT_OPTIONS = {'visibility_timeout': int(os.getenv('CELERY_VISIBILITY_TIMEOUT', 6 * 3600))}
+# Ingestion tasks are long; don't let a worker reserve more than the one it is running
+CELERY_WORKER_PREFETCH_MULTIPLIER = int(os.getenv('CELERY_WORKER_PREFETCH_MULTIPLIER', 1))
 
 # Application definition
 
@@ -119,12 +125,19 @@ INSTALLED_APPS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
-        'rest_framework.authentication.BasicAuthentication',
+        'vector_search.authentication.CachedJWTAuthentication',
+        'vector_search.authentication.CachedBasicAuthentication',
     ],
 }
 
+# Authentication caches (process-local). Verified Basic credentials, users
+# resolved from JWTs and API tokens are reused for this many seconds, so
+# password and account changes made in another process apply within it.
+AUTH_CACHE_TTL = int(os.getenv('AUTH_CACHE_TTL', 60))
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv('AUTH_CACHE_MAX_ENTRIES', 1024))
+
 MIDDLEWARE = [
+    'vector_search.middleware.RequestTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -176,6 +189,122 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Chunked uploads
+UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024))  # Suggested client chunk size
+UPLOAD_MAX_SIZE = int(os.getenv('UPLOAD_MAX_SIZE', 512 * 1024 * 1024))
+UPLOAD_SESSION_TTL = int(os.getenv('UPLOAD_SESSION_TTL', 24 * 3600))  # Seconds before an idle upload is purged
+BUNDLE_MAX_SIZE = int(os.getenv('BUNDLE_MAX_SIZE', 4 * 1024 ** 3))  # Largest project bundle accepted by import_project/
+
+# Embedding and chunking defaults for new projects; each project keeps the values it was first built with
+EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'all-MiniLM-L6-v2')
+CHUNK_UNIT = os.getenv('CHUNK_UNIT', 'tokens')  # 'tokens' (model tokenizer) or 'characters'
+CHUNK_SIZE = int(os.getenv('CHUNK_SIZE', 0))  # 0 sizes token chunks to the model's max_seq_length
+CHUNK_OVERLAP = int(os.getenv('CHUNK_OVERLAP')) if os.getenv('CHUNK_OVERLAP') else None  # Unset: 32 tokens or 200 characters
+EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'torch')  # 'torch', 'onnx' or 'onnx-int8' (needs onnxruntime)
+EMBEDDING_ONNX_DIR = os.getenv('EMBEDDING_ONNX_DIR', os.path.join(BASE_DIR, 'onnx_models'))  # Exported models, created on first use
+EMBEDDING_NUM_THREADS = int(os.getenv('EMBEDDING_NUM_THREADS', 0))  # 0 lets ONNX Runtime use all cores
+EMBEDDING_POOL_PROCESSES = int(os.getenv('EMBEDDING_POOL_PROCESSES', min(4, os.cpu_count() or 1)))  # Encoder processes per Celery worker; 1 disables the pool
+EMBEDDING_POOL_THRESHOLD = int(os.getenv('EMBEDDING_POOL_THRESHOLD', 2000))  # Chunks in one job before the pool is used
+
+# Near-duplicate chunk removal at ingest (Jaccard similarity of word 3-grams)
+CHUNK_DEDUP_ENABLED = os.getenv('CHUNK_DEDUP_ENABLED', 'True').lower() == 'true'
+CHUNK_DEDUP_THRESHOLD = float(os.getenv('CHUNK_DEDUP_THRESHOLD', 0.9))
+
+# Index publishing
+INDEX_KEEP_VERSIONS = int(os.getenv('INDEX_KEEP_VERSIONS', 2))  # Newest versions never garbage-collected
+INDEX_GC_GRACE_SECONDS = int(os.getenv('INDEX_GC_GRACE_SECONDS', 600))  # How long a superseded version stays readable
+INDEX_CACHE_MAX_ENTRIES = int(os.getenv('INDEX_CACHE_MAX_ENTRIES', 8))  # Loaded indexes kept per process
+INDEX_MMAP = os.getenv('INDEX_MMAP', 'True').lower() == 'true'  # Memory-map indexes read-only so worker processes share one copy
+
+# Shared index for small projects: projects with at most SHARED_INDEX_MAX_CHUNKS chunks are kept together in
+# flat shards instead of index files of their own, and move to a dedicated index when a re-ingest takes them
+# past it. Not used with INDEX_STORAGE_BACKEND, since shards are only kept under MEDIA_ROOT.
+SHARED_INDEX_ENABLED = os.getenv('SHARED_INDEX_ENABLED', 'True').lower() == 'true'
+SHARED_INDEX_MAX_CHUNKS = int(os.getenv('SHARED_INDEX_MAX_CHUNKS', 2000))
+# Any change to a member rewrites its whole shard; at 20000 vectors of dimension 384 that is about 30 MB of
+# vectors plus the chunks, well under a second on local disk, and the cost grows linearly with this
+SHARED_INDEX_SHARD_VECTORS = int(os.getenv('SHARED_INDEX_SHARD_VECTORS', 20000))
+SHARED_INDEX_CACHE_ENTRIES = int(os.getenv('SHARED_INDEX_CACHE_ENTRIES', 4))  # Loaded shards kept per process
+SHARED_INDEX_LOCK_TIMEOUT = int(os.getenv('SHARED_INDEX_LOCK_TIMEOUT', 120))  # Seconds a shard rewrite may hold the shard's lock
+SHARED_INDEX_LOCK_WAIT = int(os.getenv('SHARED_INDEX_LOCK_WAIT', 15))  # Seconds a publish waits for a busy shard before using a dedicated index
+
+# Project access stats (Redis) and cache prewarming
+ACCESS_STATS_FLUSH_SECONDS = int(os.getenv('ACCESS_STATS_FLUSH_SECONDS', 10))  # Query counts are batched in process for this long
+ACCESS_HOTNESS_HALF_LIFE = int(os.getenv('ACCESS_HOTNESS_HALF_LIFE', 7 * 24 * 3600))  # A query's weight in the hotness ranking halves over this many seconds
+PREWARM_ON_START = os.getenv('PREWARM_ON_START', 'False').lower() == 'true'  # Load the hottest projects when a Gunicorn worker starts
+PREWARM_TOP_PROJECTS = int(os.getenv('PREWARM_TOP_PROJECTS', 8))  # Capped at INDEX_CACHE_MAX_ENTRIES
+PREWARM_MEMORY_MB = int(os.getenv('PREWARM_MEMORY_MB', 1024))  # Index and chunk bytes loaded per process at most
+
+# Index distribution. With INDEX_STORAGE_BACKEND empty, published versions are
+# read from the local MEDIA_ROOT, so web and Celery must share a disk. Set it to
+# a storage class (e.g. 'storages.backends.s3.S3Storage', or
+# 'django.core.files.storage.FileSystemStorage' with INDEX_STORAGE_OPTIONS
+# '{"location": "/srv/index-store"}' as a stand-in) to upload every version
+# there and have each node read it through a local, checksum-verified cache.
+INDEX_STORAGE_BACKEND = os.getenv('INDEX_STORAGE_BACKEND', '')
+INDEX_STORAGE_OPTIONS = json.loads(os.getenv('INDEX_STORAGE_OPTIONS', '{}'))
+INDEX_CACHE_DIR = os.getenv('INDEX_CACHE_DIR', os.path.join(BASE_DIR, 'index_cache'))
+INDEX_CACHE_MAX_BYTES = int(os.getenv('INDEX_CACHE_MAX_BYTES', 20 * 1024 ** 3))  # Least recently used artifacts are evicted beyond this
+
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+if INDEX_STORAGE_BACKEND:
+    STORAGES['indexes'] = {'BACKEND': INDEX_STORAGE_BACKEND, 'OPTIONS': INDEX_STORAGE_OPTIONS}
+INDEX_FACTORY = os.getenv('INDEX_FACTORY', 'Flat')  # faiss.index_factory string, e.g. 'IVF4096,PQ32' for very large projects
+INDEX_BUILD_MEMORY_MB = int(os.getenv('INDEX_BUILD_MEMORY_MB', 1024))  # Larger embedding sets are spooled to disk during builds
+INDEX_TRAIN_SAMPLE = int(os.getenv('INDEX_TRAIN_SAMPLE', 100000))  # Vectors sampled to train IVF/PQ quantizers
+INDEX_NPROBE = int(os.getenv('INDEX_NPROBE', 16))  # IVF lists searched per query
+INDEX_CHECKPOINT_ROWS = int(os.getenv('INDEX_CHECKPOINT_ROWS', 2048))  # Embeddings written between build checkpoints
+INDEX_TUNE_RECALL = float(os.getenv('INDEX_TUNE_RECALL', 0.95))  # recall@k the tuner's choice must reach against exact search
+INDEX_TUNE_K = int(os.getenv('INDEX_TUNE_K', 5))  # k measured by the tuner; the query endpoint returns 5 results
+INDEX_TUNE_QUERIES = int(os.getenv('INDEX_TUNE_QUERIES', 200))  # Chunk embeddings sampled as tuning queries
+INDEX_TUNE_MAX_VECTORS = int(os.getenv('INDEX_TUNE_MAX_VECTORS', 1000000))  # Larger projects are measured on a sample of this size
+PROCESS_MAX_RETRIES = int(os.getenv('PROCESS_MAX_RETRIES', 3))  # Retries of a failed build, each resuming from its checkpoint
+PROCESS_RETRY_DELAY = int(os.getenv('PROCESS_RETRY_DELAY', 30))  # Seconds before the first retry, doubled each time
+INGEST_LOCK_TTL = int(os.getenv('INGEST_LOCK_TTL', 6 * 3600))  # Per-project processing lock; expires if a worker dies holding it
+INGEST_FAST_MAX_DOCUMENTS = int(os.getenv('INGEST_FAST_MAX_DOCUMENTS', 20))  # Projects up to this size go to the ingest_fast queue,
+INGEST_FAST_MAX_BYTES = int(os.getenv('INGEST_FAST_MAX_BYTES', 25 * 1024 * 1024))  # larger ones to ingest_bulk
+INGEST_MAX_ACTIVE_PER_USER = int(os.getenv('INGEST_MAX_ACTIVE_PER_USER', 1))  # Concurrent runs per user before later ones are deferred
+INGEST_FAIRNESS_DELAY = int(os.getenv('INGEST_FAIRNESS_DELAY', 30))  # Seconds a deferred run waits before trying again
+
+# Admission control for CPU-heavy endpoints: query/, the upload and scrape
+# views ('ingest') and document_preview/ ('preview', which mostly reads cached
+# text and so doesn't compete with uploads). Limits are shared by all web
+# workers through Redis. Per-user limits come from the user's plan: a Django
+# group named after an entry in ADMISSION_PLANS, else 'default'; every scope
+# needs an entry in each. Beyond the queue, requests get 429.
+ADMISSION_CONTROL = os.getenv('ADMISSION_CONTROL', 'True').lower() == 'true'
+ADMISSION_GLOBAL_LIMITS = json.loads(os.getenv('ADMISSION_GLOBAL_LIMITS', json.dumps({
+    'query': {'concurrent': 32, 'queued': 64},
+    'ingest': {'concurrent': 8, 'queued': 16},
+    'preview': {'concurrent': 16, 'queued': 32},
+})))
+ADMISSION_PLANS = json.loads(os.getenv('ADMISSION_PLANS', json.dumps({
+    'default': {'query': {'concurrent': 4, 'queued': 8}, 'ingest': {'concurrent': 2, 'queued': 2},
+                'preview': {'concurrent': 4, 'queued': 8}},
+    'pro': {'query': {'concurrent': 16, 'queued': 32}, 'ingest': {'concurrent': 4, 'queued': 8},
+            'preview': {'concurrent': 8, 'queued': 16}},
+})))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv('ADMISSION_QUEUE_TIMEOUT', 10))  # Longest wait for a slot; well under the Gunicorn timeout
+ADMISSION_SLOT_TTL = int(os.getenv('ADMISSION_SLOT_TTL', 120))  # A slot held by a killed worker is freed after this long
+ADMISSION_RETRY_AFTER = int(os.getenv('ADMISSION_RETRY_AFTER', 5))  # Retry-After seconds sent with 429
+
+# Task progress streaming (task_progress/)
+TASK_PROGRESS_TTL = int(os.getenv('TASK_PROGRESS_TTL', 3600))  # How long the last state of a task is kept for late subscribers
+SSE_MAX_SECONDS = int(os.getenv('SSE_MAX_SECONDS', 300))  # A stream is closed after this long; EventSource reconnects on its own
+SSE_HEARTBEAT_SECONDS = int(os.getenv('SSE_HEARTBEAT_SECONDS', 15))  # Keepalive comment interval on idle streams
+SSE_RETRY_MS = int(os.getenv('SSE_RETRY_MS', 3000))  # Reconnect delay suggested to clients
+SSE_TICKET_TTL = int(os.getenv('SSE_TICKET_TTL', 60))  # A stream ticket must be used within this long, and only once
+
+# Batch URL crawling
+CRAWL_MAX_WORKERS = int(os.getenv('CRAWL_MAX_WORKERS', 8))
+CRAWL_PER_HOST_LIMIT = int(os.getenv('CRAWL_PER_HOST_LIMIT', 2))  # Concurrent requests per host
+CRAWL_TIMEOUT = int(os.getenv('CRAWL_TIMEOUT', 10))
+CRAWL_MAX_URLS = int(os.getenv('CRAWL_MAX_URLS', 500))  # Per batch, including sitemap expansion
+CRAWL_USER_AGENT = os.getenv('CRAWL_USER_AGENT', 'QueryQuill/1.2 (+https://query-quill-8pqht.ondigitalocean.app)')
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {